@@ -0,0 +1,345 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2013:
+#     Sébastien Pasche, sebastien.pasche@leshop.ch
+#     Raphael Anthamatten  raphael.anthamatten@leshop.ch
+#
+# Permission is hereby granted, free of charge, to any person obtaining a
+# copy of this software and associated documentation files (the "Software"),
+# to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.
+#
+
+"""
+Benchmark the stats helpers, the eval helpers and every check against
+fake_elasticsearch.py clusters of growing size.
+
+Every cluster size runs in its own process, so its peak RSS is not hidden
+by a larger cluster measured before it. Requests and bytes are counted on
+the client side, per scenario run, bytes as transferred then decompressed.
+
+--compare-compression measures every cluster size with and without
+compressed responses, --bandwidth gives the fake server the throughput of a
+remote link.
+"""
+
+author = "Sebastien Pasche"
+maintainer = "Sebastien Pasche"
+version = "0.0.1"
+
+import json
+import optparse
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+FAKE_SERVER = os.path.join(BENCHMARK_DIR, 'fake_elasticsearch.py')
+sys.path.insert(0, os.path.dirname(BENCHMARK_DIR))
+
+from elasticsearch_checks import \
+    ElasticSearchCheckHelpers, ElasticSearchStatsHelpers, \
+    ElasticSearchStatsEvalHelpers, monotonic
+
+
+#measures compared with the baseline, higher is worse
+COMPARED_MEASURES = ['p50', 'p90', 'requests', 'bytes']
+
+
+# OPT parsing
+# -----------
+parser = optparse.OptionParser(
+    "%prog [options]", version="%prog " + version)
+
+parser.add_option('--nodes',
+                  dest="nodes", default='1,10,100,1000',
+                  help='Comma separated cluster sizes to run. Default : 1,10,100,1000')
+parser.add_option('--latency',
+                  dest="latency", type="float", default=0,
+                  help='Delay added by the fake server to every response. In [ms]. Default : 0')
+parser.add_option('--bandwidth',
+                  dest="bandwidth", type="float", default=0,
+                  help='Throughput of the fake server responses. In [kB/s]. Default : no limit')
+parser.add_option('--compare-compression',
+                  dest="compare_compression", default=False, action="store_true",
+                  help='Compare transfer size and time with and without compressed responses')
+parser.add_option('--iterations',
+                  dest="iterations", type="int", default=20,
+                  help='Runs of every scenario. Default : 20')
+parser.add_option('--save-baseline',
+                  dest="save_baseline", default=None,
+                  help='Save the results as a JSON baseline')
+parser.add_option('--baseline',
+                  dest="baseline", default=None,
+                  help='Compare the results with this JSON baseline')
+parser.add_option('--tolerance',
+                  dest="tolerance", type="float", default=20.0,
+                  help='Increase against the baseline reported as a regression. In [%]. Default : 20')
+#internal, one cluster size measured by a child process
+parser.add_option('--port',
+                  dest="port", type="int", default=None,
+                  help=optparse.SUPPRESS_HELP)
+parser.add_option('--no-compression',
+                  dest="no_compression", default=False, action="store_true",
+                  help=optparse.SUPPRESS_HELP)
+
+
+def percentile(values, rank):
+    """
+    Nearest rank percentile
+    """
+    values = sorted(values)
+    index = max(0, int(round(rank / 100.0 * len(values))) - 1)
+    return values[min(index, len(values) - 1)]
+
+
+def scenarios(port, state_dir, compression=True):
+    """
+    :param compression: ask for compressed responses
+    :type compression: bool
+    :return: list of (name, callable) measured against the fake server on port
+    """
+    heap = ElasticSearchCheckHelpers.check_module('heap')
+    min_docs = ElasticSearchCheckHelpers.check_module('min-docs')
+    cluster_status = ElasticSearchCheckHelpers.check_module('cluster-status')
+    connection = {'scheme': 'http', 'hostname': '127.0.0.1', 'port': port}
+    argv = ['-H', '127.0.0.1', '-p', str(port)] + ([] if compression else ['--no-compression'])
+    check_args = {
+        'cluster-status': [],
+        'min-docs': ['--state-file', os.path.join(state_dir, 'min-docs.state'), '--state-min-interval', '0'],
+        'max-docs': ['--state-file', os.path.join(state_dir, 'max-docs.state'), '--state-min-interval', '0'],
+        'heap': ['--all-nodes'],
+        'disk-io': ['--all-nodes', '--state-file', os.path.join(state_dir, 'disk-io.state'), '--state-min-interval', '0'],
+    }
+
+    measured = [
+        ('cluster_stats', lambda: ElasticSearchStatsEvalHelpers.get_nb_indexed_docs(
+            ElasticSearchStatsHelpers.cluster_statistics(
+                filter_path=['indices.docs.count'],
+                cache=False,
+                **connection
+            )
+        )),
+        ('docs_stats', lambda: ElasticSearchStatsEvalHelpers.get_nb_indexed_docs(
+            ElasticSearchStatsHelpers.docs_statistics(
+                filter_path=min_docs.DOCS_STATS_FILTER_PATH,
+                cache=False,
+                **connection
+            )
+        )),
+        ('cluster_health', lambda: ElasticSearchStatsEvalHelpers.get_cluster_status(
+            ElasticSearchStatsHelpers.cluster_health(
+                filter_path=cluster_status.CLUSTER_HEALTH_FILTER_PATH,
+                cache=False,
+                **connection
+            )
+        )),
+        ('nodes_stats', lambda: ElasticSearchStatsEvalHelpers.get_nodes_heap_used_percent(
+            ElasticSearchStatsHelpers.node_statistics(
+                node_id='_all',
+                metrics=heap.NODE_STATS_METRICS,
+                filter_path=heap.NODE_STATS_FILTER_PATH,
+                cache=False,
+                **connection
+            )
+        )),
+        ('nodes_stats_unfiltered', lambda: ElasticSearchStatsEvalHelpers.get_nodes_heap_used_percent(
+            ElasticSearchStatsHelpers.node_statistics(
+                node_id='_all',
+                cache=False,
+                **connection
+            )
+        )),
+    ]
+    for name in ElasticSearchCheckHelpers.CHECK_MODULES:
+        measured.append((
+            'check ' + name,
+            lambda name=name: ElasticSearchCheckHelpers.run_check(name, argv + check_args[name])
+        ))
+    return measured
+
+
+def measure(run, iterations):
+    """
+    Run a scenario, once to warm up then iterations times
+    :return: dict of latency percentiles in [ms], requests and bytes per run, runs per second
+    """
+    run()
+    latencies = []
+    before = ElasticSearchStatsHelpers.transfer_statistics()
+    start = monotonic()
+    for iteration in range(iterations):
+        sent = monotonic()
+        run()
+        latencies.append((monotonic() - sent) * 1000)
+    elapsed = monotonic() - start
+    after = ElasticSearchStatsHelpers.transfer_statistics()
+
+    return {
+        'p50': percentile(latencies, 50),
+        'p90': percentile(latencies, 90),
+        'p99': percentile(latencies, 99),
+        'requests': (after['requests'] - before['requests']) / float(iterations),
+        'bytes': (after['bytes'] - before['bytes']) / float(iterations),
+        'decoded_bytes': (after['decoded_bytes'] - before['decoded_bytes']) / float(iterations),
+        'per_second': iterations / elapsed,
+    }
+
+
+def run_cluster_size(port, iterations, compression=True):
+    """
+    Measure every scenario against one fake cluster, in this process
+    :return: dict of scenario results, with the process peak RSS in [kB]
+    """
+    ElasticSearchStatsHelpers.configure(compression=compression)
+    state_dir = tempfile.mkdtemp(prefix='benchmark_checks')
+    try:
+        results = dict(
+            (name, measure(run, iterations))
+            for name, run in scenarios(port, state_dir, compression)
+        )
+    finally:
+        shutil.rmtree(state_dir)
+    results['peak_rss_kb'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return results
+
+
+def run_child(nodes, latency, iterations, bandwidth=0, compression=True):
+    """
+    Start a fake cluster of nodes nodes, then measure it from a child process
+    :return: results of run_cluster_size
+    """
+    server = subprocess.Popen(
+        [sys.executable, FAKE_SERVER, '--port', '0', '--nodes', str(nodes), '--latency', str(latency),
+         '--bandwidth', str(bandwidth)],
+        stdout=subprocess.PIPE
+    )
+    try:
+        port = server.stdout.readline().decode('utf-8').strip().rsplit(':', 1)[1]
+        output = subprocess.check_output([
+            sys.executable, os.path.abspath(__file__),
+            '--port', port,
+            '--iterations', str(iterations)
+        ] + ([] if compression else ['--no-compression']))
+        return json.loads(output.decode('utf-8'))
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def print_results(nodes, results):
+    print("{n} nodes, peak RSS {r} kB".format(n=nodes, r=results['peak_rss_kb']))
+    print("  {s:<24} {a:>9} {b:>9} {c:>9} {d:>8} {e:>10} {f:>9}".format(
+        s='scenario', a='p50 ms', b='p90 ms', c='p99 ms', d='requests', e='bytes', f='runs/s'
+    ))
+    for name in sorted(results):
+        if name == 'peak_rss_kb':
+            continue
+        measures = results[name]
+        print("  {s:<24} {p50:9.2f} {p90:9.2f} {p99:9.2f} {requests:8.1f} {bytes:10.0f} {per_second:9.1f}".format(
+            s=name,
+            **measures
+        ))
+
+
+def print_compression(nodes, compressed, uncompressed):
+    print("{n} nodes".format(n=nodes))
+    print("  {s:<24} {a:>10} {b:>10} {c:>7} {d:>10} {e:>10} {f:>8}".format(
+        s='scenario', a='gzip B', b='plain B', c='ratio', d='gzip p50', e='plain p50', f='speedup'
+    ))
+    for name in sorted(compressed):
+        if name == 'peak_rss_kb':
+            continue
+        on, off = compressed[name], uncompressed[name]
+        print("  {s:<24} {a:10.0f} {b:10.0f} {c:6.1f}x {d:8.2f}ms {e:8.2f}ms {f:7.2f}x".format(
+            s=name,
+            a=on['bytes'],
+            b=off['bytes'],
+            c=off['bytes'] / on['bytes'] if on['bytes'] else 0,
+            d=on['p50'],
+            e=off['p50'],
+            f=off['p50'] / on['p50'] if on['p50'] else 0
+        ))
+
+
+def compare(results, baseline, tolerance):
+    """
+    Print the measures that moved against a baseline
+    :return: list of regressed measures
+    """
+    regressions = []
+    for nodes, scenario_results in sorted(results.items(), key=lambda item: int(item[0])):
+        reference_results = baseline.get(nodes, {})
+        compared = [
+            (scenario, measure, scenario_results[scenario][measure], reference_results.get(scenario, {}).get(measure))
+            for scenario in sorted(scenario_results) if scenario != 'peak_rss_kb'
+            for measure in COMPARED_MEASURES
+        ]
+        compared.append(('process', 'peak_rss_kb', scenario_results['peak_rss_kb'], reference_results.get('peak_rss_kb')))
+
+        for scenario, measure, value, reference in compared:
+            if not reference:
+                continue
+            change = (value - reference) * 100.0 / reference
+            if abs(change) < 1:
+                continue
+            print("{n:>4} nodes {s:<24} {m:<11} {r:12.2f} -> {v:12.2f} {c:+7.1f}%".format(
+                n=nodes, s=scenario, m=measure, r=reference, v=value, c=change
+            ))
+            if change > tolerance:
+                regressions.append('{n} nodes {s} {m}'.format(n=nodes, s=scenario, m=measure))
+    return regressions
+
+
+if __name__ == '__main__':
+    opts, args = parser.parse_args()
+    if args:
+        parser.error("Does not accept any argument.")
+
+    if opts.port is not None:
+        sys.stdout.write(json.dumps(run_cluster_size(opts.port, opts.iterations, not opts.no_compression)))
+        sys.exit(0)
+
+    if opts.compare_compression:
+        for nodes in opts.nodes.split(','):
+            print_compression(
+                nodes,
+                run_child(int(nodes), opts.latency, opts.iterations, opts.bandwidth),
+                run_child(int(nodes), opts.latency, opts.iterations, opts.bandwidth, compression=False)
+            )
+        sys.exit(0)
+
+    results = {}
+    for nodes in opts.nodes.split(','):
+        results[nodes] = run_child(int(nodes), opts.latency, opts.iterations, opts.bandwidth)
+        print_results(nodes, results[nodes])
+
+    if opts.save_baseline:
+        with open(opts.save_baseline, 'w') as baseline_file:
+            json.dump(results, baseline_file, indent=2, sort_keys=True)
+
+    if opts.baseline:
+        with open(opts.baseline) as baseline_file:
+            regressions = compare(results, json.load(baseline_file), opts.tolerance)
+        if regressions:
+            print("Regressions: {r}".format(r=', '.join(regressions)))
+            sys.exit(1)
@@ -0,0 +1,216 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2013:
+#     Sébastien Pasche, sebastien.pasche@leshop.ch
+#     Raphael Anthamatten  raphael.anthamatten@leshop.ch
+#
+# Permission is hereby granted, free of charge, to any person obtaining a
+# copy of this software and associated documentation files (the "Software"),
+# to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.
+#
+
+"""
+Compare NodeStatsTable with the dict walking accessors on node stats of
+growing clusters, without any network.
+
+Every run evaluates thresholds on METRIC_PATHS and a counter rate over two
+samples. The kept size is what an evaluation has to hold on to: the decoded
+payloads for the accessors, the tables for NodeStatsTable.
+
+A check builds its tables from the payloads on every run, so the speedup
+compares the accessors with building then evaluating the tables. The eval
+speedup leaves the build out, as for tables kept between runs.
+"""
+
+author = "Sebastien Pasche"
+maintainer = "Sebastien Pasche"
+version = "0.0.1"
+
+import json
+import optparse
+import os
+import sys
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCHMARK_DIR))
+sys.path.insert(0, BENCHMARK_DIR)
+
+from elasticsearch_checks import \
+    ElasticSearchStatsEvalHelpers, NodeStatsTable, SampleTime, monotonic
+from fake_elasticsearch import FakeCluster
+
+
+#metrics compared to thresholds, as a node check over many metrics would
+METRIC_PATHS = [
+    ['jvm', 'mem', 'heap_used_percent'],
+    ['jvm', 'mem', 'heap_used_in_bytes'],
+    ['os', 'cpu_percent'],
+    ['os', 'mem', 'used_percent'],
+    ['process', 'open_file_descriptors'],
+    ['fs', 'total', 'free_in_bytes'],
+    ['indices', 'docs', 'count'],
+    ['indices', 'search', 'query_total'],
+    ['thread_pool', 'search', 'queue'],
+    ['thread_pool', 'bulk', 'rejected'],
+    ['transport', 'rx_count'],
+    ['http', 'current_open'],
+]
+COUNTER_PATH = ['fs', 'total', 'disk_io_op']
+RESET_PATH = ['jvm', 'uptime_in_millis']
+
+
+# OPT parsing
+# -----------
+parser = optparse.OptionParser(
+    "%prog [options]", version="%prog " + version)
+
+parser.add_option('--nodes',
+                  dest="nodes", default='10,100,1000',
+                  help='Comma separated cluster sizes to run. Default : 10,100,1000')
+parser.add_option('--iterations',
+                  dest="iterations", type="int", default=20,
+                  help='Runs of every evaluation, the median is kept. Default : 20')
+parser.add_option('--no-numpy',
+                  dest="no_numpy", default=False, action="store_true",
+                  help='Evaluate the tables without numpy, even when it is installed')
+
+
+def median(values):
+    values = sorted(values)
+    middle = len(values) // 2
+    if len(values) % 2:
+        return values[middle]
+    return (values[middle - 1] + values[middle]) / 2.0
+
+
+def kept_size(value):
+    """
+    Approximate size in [B] of an object and everything it holds
+    """
+    if isinstance(value, NodeStatsTable):
+        return sum(kept_size(part) for part in (value.ids, value.names)) + sum(
+            sys.getsizeof(column) for column in value.columns.values()
+        )
+    size = sys.getsizeof(value)
+    if isinstance(value, dict):
+        size += sum(kept_size(key) + kept_size(item) for key, item in value.items())
+    elif isinstance(value, (list, tuple)):
+        size += sum(kept_size(item) for item in value)
+    return size
+
+
+def samples(nb_nodes):
+    """
+    :return: two decoded node stats samples of a fake cluster, one second apart
+    """
+    cluster = FakeCluster(nb_nodes)
+    cluster.start_time -= 60
+    first = json.loads(json.dumps(cluster.nodes_stats('_all', '_all')))
+    cluster.start_time -= 1
+    second = json.loads(json.dumps(cluster.nodes_stats('_all', '_all')))
+    return [(SampleTime(0.0, 0.0), first), (SampleTime(1.0, 1.0), second)]
+
+
+def evaluate_dicts(stats):
+    """
+    Thresholds and counter rate with the dict walking accessors
+    """
+    for path in METRIC_PATHS:
+        values = ElasticSearchStatsEvalHelpers.get_nodes_value(stats[-1][1], path)
+        dict(
+            (node, ElasticSearchStatsEvalHelpers.threshold_status(value, 50, 80))
+            for node, value in values.items()
+        )
+    series = {}
+    for sample_time, payload in stats:
+        for node_id, node in payload['nodes'].items():
+            series.setdefault(node_id, []).append((sample_time, node))
+    return dict(
+        (node_samples[-1][1]['name'], ElasticSearchStatsEvalHelpers.counter_rate(node_samples, COUNTER_PATH, RESET_PATH))
+        for node_samples in series.values()
+    )
+
+
+def build_tables(stats):
+    return [
+        NodeStatsTable.from_node_stats(payload, METRIC_PATHS + [COUNTER_PATH, RESET_PATH])
+        for sample_time, payload in stats
+    ]
+
+
+def evaluate_tables(stats, tables):
+    """
+    Thresholds and counter rate with NodeStatsTable
+    """
+    for path in METRIC_PATHS:
+        tables[-1].threshold_states(path, 50, 80)
+    return NodeStatsTable.counter_rates(
+        tables,
+        [sample_time.timestamp for sample_time, payload in stats],
+        COUNTER_PATH,
+        RESET_PATH
+    )
+
+
+def timed(run, iterations):
+    """
+    :return: median duration of run in [ms]
+    """
+    durations = []
+    for iteration in range(iterations):
+        start = monotonic()
+        run()
+        durations.append((monotonic() - start) * 1000)
+    return median(durations)
+
+
+if __name__ == '__main__':
+    opts, args = parser.parse_args()
+    if args:
+        parser.error("Does not accept any argument.")
+    if opts.no_numpy:
+        ElasticSearchStatsEvalHelpers._numpy_module = False
+
+    print("numpy: {n}".format(n=ElasticSearchStatsEvalHelpers._numpy() is not None))
+    print("{n:>6} {a:>10} {b:>10} {c:>10} {d:>10} {g:>12} {e:>12} {f:>12}".format(
+        n='nodes', a='dicts ms', b='build ms', c='table ms', d='speedup', g='eval speedup',
+        e='payload kB', f='tables kB'
+    ))
+    for nb_nodes in [int(nodes) for nodes in opts.nodes.split(',')]:
+        stats = samples(nb_nodes)
+        tables = build_tables(stats)
+
+        #same rates either way, or the comparison means nothing
+        expected = evaluate_dicts(stats)
+        measured = evaluate_tables(stats, tables)
+        assert sorted(expected) == list(measured), 'node names differ'
+        assert all(abs(expected[name] - measured[name]) < 1e-6 for name in expected), 'rates differ'
+
+        dicts_ms = timed(lambda: evaluate_dicts(stats), opts.iterations)
+        build_ms = timed(lambda: build_tables(stats), opts.iterations)
+        table_ms = timed(lambda: evaluate_tables(stats, tables), opts.iterations)
+        print("{n:>6} {a:10.3f} {b:10.3f} {c:10.3f} {d:9.1f}x {g:11.1f}x {e:12.1f} {f:12.1f}".format(
+            n=nb_nodes,
+            a=dicts_ms,
+            b=build_ms,
+            c=table_ms,
+            d=dicts_ms / (build_ms + table_ms) if build_ms + table_ms else 0,
+            g=dicts_ms / table_ms if table_ms else 0,
+            e=kept_size([payload for sample_time, payload in stats]) / 1024.0,
+            f=kept_size(tables) / 1024.0
+        ))
@@ -0,0 +1,197 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2013:
+#     Sébastien Pasche, sebastien.pasche@leshop.ch
+#     Raphael Anthamatten  raphael.anthamatten@leshop.ch
+#
+# Permission is hereby granted, free of charge, to any person obtaining a
+# copy of this software and associated documentation files (the "Software"),
+# to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.
+#
+
+"""
+Measure the import time and the cold start time of every check subcommand.
+
+The cold start runs check_elasticsearch.py against a closed local port: the
+interpreter starts, the check module is imported, options are parsed and
+the first request fails at once, so the measure holds no elasticsearch time.
+"""
+
+author = "Sebastien Pasche"
+maintainer = "Sebastien Pasche"
+version = "0.0.1"
+
+import json
+import optparse
+import os
+import socket
+import subprocess
+import sys
+import time
+
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+ENTRY_POINT = os.path.join(REPO_DIR, 'check_elasticsearch.py')
+sys.path.insert(0, REPO_DIR)
+
+from elasticsearch_checks import ElasticSearchCheckHelpers
+
+
+#options a subcommand needs to get to its first request
+CHECK_ARGS = {
+    'heap': ['--node-id', '_local'],
+    'disk-io': ['--node-id', '_local'],
+}
+
+IMPORT_PROBE = (
+    "import sys, time\n"
+    "start = time.time()\n"
+    "import {m}\n"
+    "sys.stdout.write('%f %d' % (time.time() - start, 'requests' in sys.modules))\n"
+)
+
+
+# OPT parsing
+# -----------
+parser = optparse.OptionParser(
+    "%prog [options]", version="%prog " + version)
+
+parser.add_option('--python',
+                  dest="python", default=sys.executable,
+                  help='Interpreter running the checks. Default : this one')
+parser.add_option('--runs',
+                  dest="runs", type="int", default=10,
+                  help='Runs per measure, the median is kept. Default : 10')
+parser.add_option('--save-baseline',
+                  dest="save_baseline", default=None,
+                  help='Save the results as a JSON baseline')
+parser.add_option('--baseline',
+                  dest="baseline", default=None,
+                  help='Compare the results with this JSON baseline')
+parser.add_option('--tolerance',
+                  dest="tolerance", type="float", default=20.0,
+                  help='Slowdown against the baseline reported as a regression. In [%]. Default : 20')
+
+
+def median(values):
+    values = sorted(values)
+    middle = len(values) // 2
+    if len(values) % 2:
+        return values[middle]
+    return (values[middle - 1] + values[middle]) / 2.0
+
+
+def closed_port():
+    """
+    Get a local port nobody listens on
+    """
+    probe = socket.socket()
+    probe.bind(('127.0.0.1', 0))
+    port = probe.getsockname()[1]
+    probe.close()
+    return port
+
+
+def measure_import(python, module, runs):
+    """
+    :return: (median import time in [s], whether requests got imported)
+    """
+    durations = []
+    requests_imported = False
+    for run in range(runs):
+        output = subprocess.check_output(
+            [python, '-c', IMPORT_PROBE.format(m=module)],
+            cwd=REPO_DIR
+        )
+        duration, imported = output.decode('utf-8').split()
+        durations.append(float(duration))
+        requests_imported = requests_imported or imported == '1'
+    return median(durations), requests_imported
+
+
+def measure_cold_start(python, name, runs, port):
+    """
+    :return: median wall time in [s] of a complete check process
+    """
+    command = [python, ENTRY_POINT, name, '-H', '127.0.0.1', '-p', str(port)] + CHECK_ARGS.get(name, [])
+    durations = []
+    with open(os.devnull, 'w') as devnull:
+        for run in range(runs):
+            start = time.time()
+            subprocess.call(command, stdout=devnull, stderr=devnull)
+            durations.append(time.time() - start)
+    return median(durations)
+
+
+def compare(results, baseline, tolerance):
+    """
+    Print the change of every measure against a baseline
+    :return: list of regressed measures
+    """
+    regressions = []
+    for name, measures in sorted(results.items()):
+        for measure in ('import', 'cold_start'):
+            reference = baseline.get(name, {}).get(measure)
+            if not reference:
+                continue
+            change = (measures[measure] - reference) * 100.0 / reference
+            print("{n:<16} {m:<11} {r:8.1f}ms -> {v:8.1f}ms {c:+6.1f}%".format(
+                n=name,
+                m=measure,
+                r=reference * 1000,
+                v=measures[measure] * 1000,
+                c=change
+            ))
+            if change > tolerance:
+                regressions.append('{n} {m}'.format(n=name, m=measure))
+    return regressions
+
+
+if __name__ == '__main__':
+    opts, args = parser.parse_args()
+    if args:
+        parser.error("Does not accept any argument.")
+
+    port = closed_port()
+    results = {}
+    print("{n:<16} {i:>10} {c:>12}  requests imported".format(n='check', i='import', c='cold start'))
+    for name, module in ElasticSearchCheckHelpers.CHECK_MODULES.items():
+        import_time, requests_imported = measure_import(opts.python, module, opts.runs)
+        cold_start = measure_cold_start(opts.python, name, opts.runs, port)
+        results[name] = {
+            'import': import_time,
+            'cold_start': cold_start,
+            'requests_imported': requests_imported
+        }
+        print("{n:<16} {i:8.1f}ms {c:10.1f}ms  {r}".format(
+            n=name,
+            i=import_time * 1000,
+            c=cold_start * 1000,
+            r=requests_imported
+        ))
+
+    if opts.save_baseline:
+        with open(opts.save_baseline, 'w') as baseline_file:
+            json.dump(results, baseline_file, indent=2, sort_keys=True)
+
+    if opts.baseline:
+        with open(opts.baseline) as baseline_file:
+            regressions = compare(results, json.load(baseline_file), opts.tolerance)
+        if regressions:
+            print("Regressions: {r}".format(r=', '.join(regressions)))
+            sys.exit(1)
@@ -0,0 +1,456 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2013:
+#     Sébastien Pasche, sebastien.pasche@leshop.ch
+#     Raphael Anthamatten  raphael.anthamatten@leshop.ch
+#
+# Permission is hereby granted, free of charge, to any person obtaining a
+# copy of this software and associated documentation files (the "Software"),
+# to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.
+#
+
+"""
+Local stand-in for an elasticsearch cluster, serving synthetic stats.
+
+Served endpoints, with filter_path support unless --ignore-filter-path:
+    /_cluster/stats
+    /_cluster/health
+    /_stats/docs
+    /_nodes/stats, /_nodes/{node_id}/stats, /_nodes/{node_id}/stats/{metrics}
+    /_fake/stats        requests and bytes served so far
+    /_fake/health       set the health, ?status=yellow&nodes=2
+
+/_cluster/health long-polls with wait_for_status, wait_for_nodes and timeout.
+
+Counters (indexed docs, disk io operations) grow with time so rate based
+checks get realistic samples. Responses are gzip or deflate compressed when
+the client accepts it, as elasticsearch does with http.compression enabled.
+"""
+
+author = "Sebastien Pasche"
+maintainer = "Sebastien Pasche"
+version = "0.0.1"
+
+import fnmatch
+import json
+import optparse
+import sys
+import threading
+import time
+import zlib
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+    from urllib.parse import urlparse, parse_qs
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+    from urlparse import urlparse, parse_qs
+
+
+#DEFAULTS
+#--------
+DEFAULT_NODES = 3
+DEFAULT_DOCS_RATE = 1000
+DEFAULT_DISK_IO_RATE = 100
+
+#metrics of a node stats response, in /_nodes/{node_id}/stats/{metrics}
+NODE_METRICS = ['indices', 'os', 'process', 'jvm', 'thread_pool', 'fs', 'transport', 'http']
+#cluster colours, worst first
+HEALTH_STATUSES = ['red', 'yellow', 'green']
+#elasticsearch http.compression_level default
+DEFAULT_COMPRESSION_LEVEL = 3
+
+
+class FakeCluster(object):
+    """
+        Synthetic cluster whose counters grow with time
+    """
+
+    def __init__(self, nb_nodes=DEFAULT_NODES, docs_rate=DEFAULT_DOCS_RATE, disk_io_rate=DEFAULT_DISK_IO_RATE):
+        self.nb_nodes = nb_nodes
+        self.docs_rate = docs_rate
+        self.disk_io_rate = disk_io_rate
+        self.start_time = time.time()
+        self.node_ids = ['fake{i:04d}'.format(i=i) for i in range(nb_nodes)]
+        #health, changed through /_fake/health, long-polls wait on it
+        self.status = 'green'
+        self.nb_nodes_up = nb_nodes
+        self.health_changed = threading.Condition()
+
+    def elapsed(self):
+        return time.time() - self.start_time
+
+    def cluster_stats(self):
+        docs = int(self.elapsed() * self.docs_rate)
+        return {
+            'cluster_name': 'fake',
+            'status': 'green',
+            'indices': {
+                'count': 42,
+                'shards': {'total': 10 * self.nb_nodes, 'primaries': 5 * self.nb_nodes},
+                'docs': {'count': docs, 'deleted': docs // 100},
+                'store': {'size_in_bytes': docs * 512},
+            },
+            'nodes': {
+                'count': {'total': self.nb_nodes, 'data': self.nb_nodes, 'master': min(3, self.nb_nodes)},
+                'jvm': {'mem': {'heap_used_in_bytes': self.nb_nodes * 2 ** 30, 'heap_max_in_bytes': self.nb_nodes * 2 ** 31}},
+            },
+        }
+
+    def set_health(self, status=None, nb_nodes=None):
+        with self.health_changed:
+            self.status = status or self.status
+            self.nb_nodes_up = self.nb_nodes if nb_nodes is None else nb_nodes
+            self.health_changed.notify_all()
+        return self.cluster_health()
+
+    def health_reached(self, wait_for_status=None, wait_for_nodes=None):
+        if wait_for_status and HEALTH_STATUSES.index(self.status) < HEALTH_STATUSES.index(wait_for_status):
+            return False
+        if wait_for_nodes:
+            operator = wait_for_nodes.rstrip('0123456789')
+            expected = int(wait_for_nodes[len(operator):])
+            return {
+                '': self.nb_nodes_up == expected,
+                '<': self.nb_nodes_up < expected,
+                '<=': self.nb_nodes_up <= expected,
+                '>': self.nb_nodes_up > expected,
+                '>=': self.nb_nodes_up >= expected,
+            }[operator]
+        return True
+
+    def wait_for_health(self, wait_for_status=None, wait_for_nodes=None, timeout=30):
+        """
+        :return: (health, whether the wait timed out)
+        """
+        deadline = time.time() + timeout
+        with self.health_changed:
+            while not self.health_reached(wait_for_status, wait_for_nodes):
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    health = self.cluster_health()
+                    health['timed_out'] = True
+                    return health, True
+                self.health_changed.wait(remaining)
+            return self.cluster_health(), False
+
+    def cluster_health(self):
+        return {
+            'cluster_name': 'fake',
+            'status': self.status,
+            'timed_out': False,
+            'number_of_nodes': self.nb_nodes_up,
+            'number_of_data_nodes': self.nb_nodes_up,
+            'active_primary_shards': 5 * self.nb_nodes,
+            'active_shards': 10 * self.nb_nodes,
+            'relocating_shards': 0,
+            'initializing_shards': 0,
+            'unassigned_shards': 0,
+        }
+
+    def docs_stats(self):
+        docs = int(self.elapsed() * self.docs_rate)
+        #42 indices sharing the docs, the last one takes the remainder
+        indices = dict(
+            ('index{i:02d}'.format(i=i), docs // 42 + (docs % 42 if i == 41 else 0))
+            for i in range(42)
+        )
+        return {
+            '_shards': {'total': 10 * self.nb_nodes, 'successful': 10 * self.nb_nodes, 'failed': 0},
+            '_all': {
+                'primaries': {'docs': {'count': docs, 'deleted': docs // 100}},
+                'total': {'docs': {'count': 2 * docs, 'deleted': docs // 50}},
+            },
+            'indices': dict(
+                (name, {
+                    'primaries': {'docs': {'count': count, 'deleted': count // 100}},
+                    'total': {'docs': {'count': 2 * count, 'deleted': count // 50}},
+                })
+                for name, count in indices.items()
+            ),
+        }
+
+    def node_stats(self, index, metrics):
+        elapsed = self.elapsed()
+        sections = {
+            'indices': {
+                'docs': {'count': int(elapsed * self.docs_rate) // self.nb_nodes, 'deleted': 0},
+                'store': {'size_in_bytes': 2 ** 34},
+                'indexing': {'index_total': int(elapsed * self.docs_rate) // self.nb_nodes, 'index_time_in_millis': int(elapsed * 10)},
+                'search': {'query_total': int(elapsed * 50), 'query_time_in_millis': int(elapsed * 20)},
+            },
+            'os': {'cpu_percent': 20 + index % 60, 'load_average': 1.5, 'mem': {'free_percent': 30, 'used_percent': 70}},
+            'process': {'open_file_descriptors': 1024, 'cpu': {'percent': 10, 'total_in_millis': int(elapsed * 1000)}},
+            'jvm': {
+                'uptime_in_millis': int(elapsed * 1000),
+                'mem': {
+                    'heap_used_in_bytes': (20 + index % 70) * 2 ** 24,
+                    'heap_used_percent': 20 + index % 70,
+                    'heap_max_in_bytes': 100 * 2 ** 24,
+                },
+                'gc': {'collectors': {
+                    'young': {'collection_count': int(elapsed), 'collection_time_in_millis': int(elapsed * 5)},
+                    'old': {'collection_count': 0, 'collection_time_in_millis': 0},
+                }},
+            },
+            'thread_pool': dict(
+                (pool, {'threads': 8, 'queue': 0, 'active': index % 8, 'rejected': 0, 'completed': int(elapsed * 10)})
+                for pool in ('bulk', 'get', 'index', 'search', 'management')
+            ),
+            'fs': {'total': {
+                'total_in_bytes': 2 ** 40,
+                'free_in_bytes': 2 ** 39,
+                'disk_reads': int(elapsed * self.disk_io_rate * (index + 1)) // 2,
+                'disk_writes': int(elapsed * self.disk_io_rate * (index + 1)) // 2,
+                'disk_io_op': int(elapsed * self.disk_io_rate * (index + 1)),
+                'disk_io_size_in_bytes': int(elapsed * self.disk_io_rate * (index + 1)) * 4096,
+            }},
+            'transport': {'server_open': 13, 'rx_count': int(elapsed * 100), 'tx_count': int(elapsed * 100)},
+            'http': {'current_open': 2, 'total_opened': 10},
+        }
+        node = {
+            'timestamp': int(time.time() * 1000),
+            'name': 'node{i}'.format(i=index),
+            'transport_address': 'inet[/10.0.{a}.{b}:9300]'.format(a=index // 250, b=index % 250 + 1),
+            'host': 'es{i}'.format(i=index),
+            'ip': ['inet[/10.0.{a}.{b}:9300]'.format(a=index // 250, b=index % 250 + 1), 'NONE'],
+        }
+        for metric in metrics:
+            node[metric] = sections[metric]
+        return node
+
+    def nodes_stats(self, node_id, metrics):
+        if node_id in ('_all', ''):
+            indexes = range(self.nb_nodes)
+        elif node_id in ('_local', '_master'):
+            indexes = [0]
+        else:
+            wanted = node_id.split(',')
+            indexes = [
+                index for index, node in enumerate(self.node_ids)
+                if node in wanted or 'node{i}'.format(i=index) in wanted
+            ]
+        metrics = NODE_METRICS if metrics in ('_all', '') else [m for m in metrics.split(',') if m in NODE_METRICS]
+
+        return {
+            'cluster_name': 'fake',
+            'nodes': dict(
+                (self.node_ids[index], self.node_stats(index, metrics))
+                for index in indexes
+            ),
+        }
+
+
+def filter_payload(payload, filter_path):
+    """
+    Keep the parts of a payload matching filter_path, as elasticsearch does
+    :param payload: decoded response
+    :type payload: dict
+    :param filter_path: comma separated dotted paths, * matching one key
+    :type filter_path: str
+    :return: filtered payload
+    """
+    def keep(node, patterns):
+        if any(not pattern for pattern in patterns):
+            return node
+        if not isinstance(node, dict):
+            return None
+        kept = {}
+        for key, value in node.items():
+            sub_patterns = [pattern[1:] for pattern in patterns if fnmatch.fnmatchcase(key, pattern[0])]
+            if sub_patterns:
+                value = keep(value, sub_patterns)
+                if value is not None:
+                    kept[key] = value
+        return kept or None
+
+    return keep(payload, [path.split('.') for path in filter_path.split(',')]) or {}
+
+
+class FakeElasticSearchHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    #headers and body are written apart, do not let them wait for an ack
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        if self.server.debug:
+            BaseHTTPRequestHandler.log_message(self, format, *args)
+
+    def route(self, path, query):
+        """
+        :return: (HTTP status, payload), payload None when nothing is served there
+        """
+        cluster = self.server.cluster
+        parts = [part for part in path.split('/') if part]
+        if parts == ['_cluster', 'stats']:
+            return 200, cluster.cluster_stats()
+        if parts == ['_cluster', 'health']:
+            wait = dict((name, query[name][0]) for name in ('wait_for_status', 'wait_for_nodes') if name in query)
+            if not wait:
+                return 200, cluster.cluster_health()
+            timeout = float(query.get('timeout', ['30s'])[0].rstrip('s'))
+            health, timed_out = cluster.wait_for_health(timeout=timeout, **wait)
+            return 408 if timed_out else 200, health
+        if parts == ['_stats', 'docs']:
+            return 200, cluster.docs_stats()
+        if parts[:1] == ['_nodes'] and 'stats' in parts:
+            stats_index = parts.index('stats')
+            node_id = ','.join(parts[1:stats_index])
+            metrics = ','.join(parts[stats_index + 1:])
+            return 200, cluster.nodes_stats(node_id, metrics)
+        if parts == ['_fake', 'stats']:
+            return 200, self.server.statistics()
+        if parts == ['_fake', 'health']:
+            nb_nodes = query.get('nodes')
+            return 200, cluster.set_health(
+                status=query.get('status', [None])[0],
+                nb_nodes=int(nb_nodes[0]) if nb_nodes else None
+            )
+        return 404, None
+
+    def do_GET(self):
+        parsed = urlparse(self.path)
+        query = parse_qs(parsed.query)
+        status, payload = self.route(parsed.path, query)
+        if payload is None:
+            body = json.dumps({'error': 'no handler for {p}'.format(p=parsed.path)})
+        else:
+            filter_path = query.get('filter_path')
+            if filter_path and not self.server.ignore_filter_path:
+                payload = filter_payload(payload, filter_path[0])
+            body = json.dumps(payload)
+        body, encoding = self.server.encode(body.encode('utf-8'), self.headers.get('Accept-Encoding', ''))
+
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        if self.server.bandwidth:
+            time.sleep(len(body) / self.server.bandwidth)
+        if not parsed.path.startswith('/_fake/'):
+            self.server.count(len(body))
+
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=UTF-8')
+        if encoding:
+            self.send_header('Content-Encoding', encoding)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class FakeElasticSearchServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address, cluster, latency=0, ignore_filter_path=False,
+                 compression_level=DEFAULT_COMPRESSION_LEVEL, bandwidth=0, debug=False):
+        HTTPServer.__init__(self, address, FakeElasticSearchHandler)
+        self.cluster = cluster
+        self.latency = latency
+        self.ignore_filter_path = ignore_filter_path
+        self.compression_level = compression_level
+        self.bandwidth = bandwidth
+        self.debug = debug
+        self._lock = threading.Lock()
+        self._statistics = {'requests': 0, 'bytes': 0}
+
+    def encode(self, body, accept_encoding):
+        """
+        Compress a body with the first encoding the client accepts
+        :return: (body, content encoding, None when not compressed)
+        """
+        if not self.compression_level:
+            return body, None
+        accepted = [encoding.split(';')[0].strip() for encoding in accept_encoding.split(',')]
+        if 'gzip' in accepted:
+            compressor = zlib.compressobj(self.compression_level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+            return compressor.compress(body) + compressor.flush(), 'gzip'
+        if 'deflate' in accepted:
+            return zlib.compress(body, self.compression_level), 'deflate'
+        return body, None
+
+    def count(self, nb_bytes):
+        with self._lock:
+            self._statistics['requests'] += 1
+            self._statistics['bytes'] += nb_bytes
+
+    def statistics(self):
+        with self._lock:
+            return dict(self._statistics)
+
+
+# OPT parsing
+# -----------
+parser = optparse.OptionParser(
+    "%prog [options]", version="%prog " + version)
+
+parser.add_option('-H', '--hostname',
+                  dest="hostname", default='127.0.0.1',
+                  help='Address to listen on. Default : 127.0.0.1')
+parser.add_option('-p', '--port',
+                  dest="port", type="int", default=9200,
+                  help='Port to listen on, 0 picks a free one. Default : 9200')
+parser.add_option('--nodes',
+                  dest="nodes", type="int", default=DEFAULT_NODES,
+                  help='Number of nodes of the cluster. Default : 3')
+parser.add_option('--latency',
+                  dest="latency", type="float", default=0,
+                  help='Delay added to every response. In [ms]. Default : 0')
+parser.add_option('--docs-rate',
+                  dest="docs_rate", type="int", default=DEFAULT_DOCS_RATE,
+                  help='Indexed docs per second. Default : 1000')
+parser.add_option('--compression-level',
+                  dest="compression_level", type="int", default=DEFAULT_COMPRESSION_LEVEL,
+                  help='gzip or deflate level of the responses, 0 never compresses. Default : 3')
+parser.add_option('--bandwidth',
+                  dest="bandwidth", type="float", default=0,
+                  help='Throughput of the responses, as a remote link would have. In [kB/s]. Default : no limit')
+parser.add_option('--ignore-filter-path',
+                  dest="ignore_filter_path", default=False, action="store_true",
+                  help='Answer whole documents, as elasticsearch before 1.6 does')
+parser.add_option('--debug',
+                  dest="debug", default=False, action="store_true",
+                  help='Log every request')
+
+
+if __name__ == '__main__':
+    opts, args = parser.parse_args()
+    if args:
+        parser.error("Does not accept any argument.")
+    if not 1 <= opts.nodes <= 1000:
+        parser.error("The cluster has 1 to 1000 nodes.")
+
+    server = FakeElasticSearchServer(
+        (opts.hostname, opts.port),
+        FakeCluster(opts.nodes, docs_rate=opts.docs_rate),
+        latency=opts.latency / 1000.0,
+        ignore_filter_path=opts.ignore_filter_path,
+        compression_level=opts.compression_level,
+        bandwidth=opts.bandwidth * 1000,
+        debug=opts.debug
+    )
+    #the first line tells the chosen port to whoever started us
+    sys.stdout.write('listening on {h}:{p}\n'.format(h=opts.hostname, p=server.server_address[1]))
+    sys.stdout.flush()
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2013:
+#     Sébastien Pasche, sebastien.pasche@leshop.ch
+#     Raphael Anthamatten  raphael.anthamatten@leshop.ch
+#
+# Permission is hereby granted, free of charge, to any person obtaining a
+# copy of this software and associated documentation files (the "Software"),
+# to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.
+#
+
+author = "Sebastien Pasche"
+maintainer = "Sebastien Pasche"
+version = "0.0.1"
+
+# Single entry point of every check. The check module is imported from its
+# subcommand, and python puts the directory of this script, symlinks
+# resolved, first in sys.path so the lib is found without touching it.
+import sys
+
+from elasticsearch_checks import ElasticSearchCheckHelpers, MetricSinkHelpers, OutputFormatHelpers
+
+
+USAGE = """Usage: {p} CHECK [options]
+
+Checks:
+  {c}
+
+Run {p} CHECK --help for the options of a check."""
+
+
+if __name__ == '__main__':
+    prog = 'check_elasticsearch.py'
+    usage = USAGE.format(p=prog, c='\n  '.join(ElasticSearchCheckHelpers.CHECK_MODULES))
+
+    if len(sys.argv) < 2 or sys.argv[1] in ('-h', '--help'):
+        print(usage)
+        sys.exit(0 if len(sys.argv) > 1 else 3)
+    if sys.argv[1] == '--version':
+        print("{p} {v}".format(p=prog, v=version))
+        sys.exit(0)
+
+    name = sys.argv[1]
+    if name not in ElasticSearchCheckHelpers.CHECK_MODULES:
+        print("Unknown: unknown check {n}\n{u}".format(n=name, u=usage))
+        sys.exit(3)
+
+    #checks able to watch run until interrupted
+    module = ElasticSearchCheckHelpers.check_module(name)
+    if '--watch' in sys.argv[2:] and hasattr(module, 'watch'):
+        module.parser.prog = '{p} {n}'.format(p=prog, n=name)
+        opts = module.parse_args(sys.argv[2:])
+        ElasticSearchCheckHelpers.apply_default_parser_options(opts)
+        try:
+            module.watch(opts)
+        except KeyboardInterrupt:
+            sys.exit(0)
+
+    status, output = ElasticSearchCheckHelpers.run_check(
+        name,
+        sys.argv[2:],
+        prog='{p} {n}'.format(p=prog, n=name)
+    )
+    print(output)
+    #the result is out, the metric sinks get a bounded time to write the run
+    MetricSinkHelpers.flush()
+    sys.exit(OutputFormatHelpers.EXIT_CODES[status])
@@ -0,0 +1,125 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2013:
+#     Sébastien Pasche, sebastien.pasche@leshop.ch
+#     Raphael Anthamatten  raphael.anthamatten@leshop.ch
+#
+# Permission is hereby granted, free of charge, to any person obtaining a
+# copy of this software and associated documentation files (the "Software"),
+# to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.
+#
+
+author = "Sebastien Pasche"
+maintainer = "Sebastien Pasche"
+version = "0.0.1"
+
+# Only light modules are imported here, the checks themselves run in the
+# daemon. The elasticsearch_checks lib is loaded when the daemon is down.
+import json
+import optparse
+import os
+import socket
+import stat
+import sys
+import tempfile
+
+
+#DEFAULTS
+#--------
+#same default as check_elasticsearch_daemon.py
+DEFAULT_RUN_DIR = os.environ.get('XDG_RUNTIME_DIR') or os.path.join(
+    tempfile.gettempdir(), 'check_elasticsearch-{u}'.format(u=os.getuid())
+)
+DEFAULT_SOCKET = os.path.join(DEFAULT_RUN_DIR, 'check_elasticsearch.sock')
+DEFAULT_TIMEOUT = 60
+
+
+# OPT parsing
+# -----------
+parser = optparse.OptionParser(
+    "%prog [options] CHECK [check options]", version="%prog " + version)
+parser.disable_interspersed_args()
+
+parser.add_option('--socket',
+                  dest="socket", default=DEFAULT_SOCKET,
+                  help='Unix socket of check_elasticsearch_daemon.py. Default : $XDG_RUNTIME_DIR/check_elasticsearch.sock, else /tmp/check_elasticsearch-<uid>/check_elasticsearch.sock')
+parser.add_option('--timeout',
+                  dest="timeout", type="int", default=DEFAULT_TIMEOUT,
+                  help='Time to wait for the daemon answer. In [s]. Default : 60 [s]')
+parser.add_option('--no-fallback',
+                  dest="fallback", default=True, action="store_false",
+                  help='Do not run the check locally when the daemon is unreachable')
+
+
+def run_remote(path, timeout, name, argv):
+    """
+    Ask the daemon to run a check
+    :return: daemon response dict
+    """
+    #only a daemon of this user is trusted with the check results
+    if os.lstat(path).st_uid != os.getuid() or not stat.S_ISSOCK(os.lstat(path).st_mode):
+        raise socket.error('{p} is not a socket of this user'.format(p=path))
+
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    client.settimeout(timeout)
+    try:
+        client.connect(path)
+        client.sendall((json.dumps({'check': name, 'argv': argv}) + '\n').encode('utf-8'))
+        stream = client.makefile('rb')
+        try:
+            return json.loads(stream.readline().decode('utf-8'))
+        finally:
+            stream.close()
+    finally:
+        client.close()
+
+
+def run_local(name, argv):
+    """
+    Run a check in this process, as its script would
+    """
+    sys.path.insert(0, os.path.dirname(__file__))
+    from elasticsearch_checks import ElasticSearchCheckHelpers, OutputFormatHelpers, MetricSinkHelpers
+
+    status, output = ElasticSearchCheckHelpers.run_check(name, argv)
+    print(output)
+    #the result is out, the metric sinks get a bounded time to write the run
+    MetricSinkHelpers.flush()
+    sys.exit(OutputFormatHelpers.EXIT_CODES[status])
+
+
+if __name__ == '__main__':
+    # Ok first job : parse args
+    opts, args = parser.parse_args()
+    if not args:
+        parser.error("You must specify a check.")
+    name, argv = args[0], args[1:]
+
+    try:
+        response = run_remote(opts.socket, opts.timeout, name, argv)
+    except (socket.error, OSError, ValueError) as e:
+        if not opts.fallback:
+            print("Unknown: check daemon unreachable on {s}: {m}".format(s=opts.socket, m=e))
+            sys.exit(3)
+        run_local(name, argv)
+
+    if response.get('usage'):
+        run_local(name, argv)
+
+    print(response['output'])
+    sys.exit(response['code'])
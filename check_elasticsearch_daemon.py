@@ -0,0 +1,220 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2013:
+#     Sébastien Pasche, sebastien.pasche@leshop.ch
+#     Raphael Anthamatten  raphael.anthamatten@leshop.ch
+#
+# Permission is hereby granted, free of charge, to any person obtaining a
+# copy of this software and associated documentation files (the "Software"),
+# to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.
+#
+
+author = "Sebastien Pasche"
+maintainer = "Sebastien Pasche"
+version = "0.0.1"
+
+import json
+import optparse
+import os
+import stat
+import sys
+import tempfile
+import traceback
+
+try:
+    import socketserver
+except ImportError:
+    import SocketServer as socketserver
+
+
+#Ok try to load our directory to load the plugin utils.
+my_dir = os.path.dirname(__file__)
+sys.path.insert(0, my_dir)
+
+try:
+    from elasticsearch_checks import \
+        ElasticSearchCheckHelpers, ElasticSearchStatsHelpers, \
+        MetricSinkHelpers, OutputFormatHelpers
+except ImportError:
+    print("ERROR : this plugin needs the local elasticsearch_checks lib. Please install it")
+    sys.exit(2)
+
+
+#DEFAULTS
+#--------
+#in a run directory only the daemon user can enter, the client computes the same
+DEFAULT_RUN_DIR = os.environ.get('XDG_RUNTIME_DIR') or os.path.join(
+    tempfile.gettempdir(), 'check_elasticsearch-{u}'.format(u=os.getuid())
+)
+DEFAULT_SOCKET = os.path.join(DEFAULT_RUN_DIR, 'check_elasticsearch.sock')
+#check options naming files the daemon writes
+FILE_OPTIONS = ['state_file', 'hedge_state_file']
+REQUEST_TIMEOUT = 60
+
+
+# OPT parsing
+# -----------
+parser = optparse.OptionParser(
+    "%prog [options]", version="%prog " + version)
+
+parser.add_option('--socket',
+                  dest="socket", default=DEFAULT_SOCKET,
+                  help='Unix socket to serve checks on, in a directory only this user can write to. Default : $XDG_RUNTIME_DIR/check_elasticsearch.sock, else /tmp/check_elasticsearch-<uid>/check_elasticsearch.sock')
+parser.add_option('--state-dir',
+                  dest="state_dir", default=None,
+                  help='Directory the --state-file and --hedge-state-file of the checks are confined to. Default : checks with state files are refused')
+parser.add_option('--debug',
+                  dest="debug", default=False, action="store_true",
+                  help='Enable debug')
+
+#add process parser, connections and cached responses are kept between checks
+parser = ElasticSearchCheckHelpers.add_process_parser_options(parser)
+
+
+def prepare_socket(path):
+    """
+    Make sure the socket path is private to this user before binding it
+    The default run directory is created. A previous daemon socket is
+    removed, anything else at the socket path is left alone.
+    :param path: socket path
+    :type path: str
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    if path == DEFAULT_SOCKET and not os.path.lexists(directory):
+        os.mkdir(directory, 0o700)
+
+    info = os.lstat(directory)
+    if not stat.S_ISDIR(info.st_mode) or info.st_uid != os.getuid() or info.st_mode & 0o022:
+        raise Exception('{d} must be a directory of this user, not writable by others'.format(d=directory))
+
+    if os.path.lexists(path):
+        info = os.lstat(path)
+        if not stat.S_ISSOCK(info.st_mode) or info.st_uid != os.getuid():
+            raise Exception('{p} exists and is not a socket of this user, not removing it'.format(p=path))
+        os.unlink(path)
+
+
+def confine_files(opts, state_dir):
+    """
+    Confine the files a check writes to the state directory
+    Relative names are taken in it, other paths must lead into it.
+    :param opts: parsed check options, updated with the confined paths
+    :type opts: optparse.Values
+    :param state_dir: state directory, None when no file is allowed
+    :type state_dir: str
+    """
+    for option in FILE_OPTIONS:
+        path = getattr(opts, option, None)
+        if not path:
+            continue
+        if state_dir is None:
+            raise Exception('--{o} needs a daemon started with --state-dir'.format(o=option.replace('_', '-')))
+        root = os.path.realpath(state_dir)
+        confined = os.path.realpath(os.path.join(root, path))
+        if not confined.startswith(root + os.sep):
+            raise Exception('--{o} {p} is outside of the daemon state directory'.format(
+                o=option.replace('_', '-'),
+                p=path
+            ))
+        setattr(opts, option, confined)
+
+
+def run_check(name, argv, state_dir=None):
+    """
+    Run a check as its script would
+    Process options given in argv (pool, cache, metric sinks) are ignored,
+    the daemon ones apply. State files are confined to state_dir.
+    :param name: check name, one of ElasticSearchCheckHelpers.CHECK_MODULES
+    :type name: str
+    :param argv: check arguments
+    :type argv: list
+    :param state_dir: directory the check state files are confined to
+    :type state_dir: str
+    :return: response dict with status, output and exit code
+    """
+    module = ElasticSearchCheckHelpers.check_module(name)
+    try:
+        opts = module.parse_args(argv)
+    except SystemExit as e:
+        #the client runs the check itself to print the usage error
+        return {'usage': True, 'code': e.code}
+    confine_files(opts, state_dir)
+
+    status, output = module.check(opts)
+    return {
+        'status': status,
+        'output': output,
+        'code': OutputFormatHelpers.EXIT_CODES[status]
+    }
+
+
+class CheckRequestHandler(socketserver.StreamRequestHandler):
+    """
+        One JSON line request {"check": name, "argv": [...]}, one JSON line response
+    """
+
+    def handle(self):
+        self.request.settimeout(REQUEST_TIMEOUT)
+        try:
+            request = json.loads(self.rfile.readline().decode('utf-8'))
+            response = run_check(request['check'], request['argv'], self.server.state_dir)
+        except Exception as e:
+            if self.server.debug:
+                traceback.print_exc()
+            response = {
+                'status': 'Unknown',
+                'output': "Error: {m}".format(m=e),
+                'code': OutputFormatHelpers.EXIT_CODES['Unknown']
+            }
+
+        self.wfile.write((json.dumps(response) + '\n').encode('utf-8'))
+
+
+class CheckServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+if __name__ == '__main__':
+    # Ok first job : parse args
+    opts, args = parser.parse_args()
+    if args:
+        parser.error("Does not accept any argument.")
+
+    ElasticSearchCheckHelpers.apply_default_parser_options(opts, memory_cache=True)
+
+    #a previous daemon may have left its socket behind
+    try:
+        prepare_socket(opts.socket)
+    except Exception as e:
+        print("Error: {m}".format(m=e))
+        sys.exit(3)
+
+    server = CheckServer(opts.socket, CheckRequestHandler)
+    os.chmod(opts.socket, 0o600)
+    server.debug = opts.debug
+    server.state_dir = opts.state_dir
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        os.unlink(opts.socket)
+        MetricSinkHelpers.flush()
+        if opts.debug:
+            ElasticSearchStatsHelpers.print_debug_statistics()
@@ -0,0 +1,289 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2013:
+#     Sébastien Pasche, sebastien.pasche@leshop.ch
+#     Raphael Anthamatten  raphael.anthamatten@leshop.ch
+#
+# Permission is hereby granted, free of charge, to any person obtaining a
+# copy of this software and associated documentation files (the "Software"),
+# to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.
+#
+
+"""
+Serve the metrics of a cluster to Prometheus on /metrics.
+
+A scrape queries the cluster health, the docs stats and the node stats at
+once, then renders them in the Prometheus text format. The page is kept for
+--cache-interval seconds: the scrapes coming in the meantime, from several
+Prometheus replicas for instance, get it without querying elasticsearch and
+the scrapes arriving while it renders wait for it.
+"""
+
+author = "Sebastien Pasche"
+maintainer = "Sebastien Pasche"
+version = "0.0.1"
+
+import functools
+import optparse
+import os
+import sys
+import threading
+import time
+import traceback
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+
+
+#Ok try to load our directory to load the plugin utils.
+my_dir = os.path.dirname(__file__)
+sys.path.insert(0, my_dir)
+
+try:
+    from elasticsearch_checks import \
+        ElasticSearchCheckHelpers, ElasticSearchStatsHelpers, \
+        ElasticSearchConcurrentStatsHelpers, ElasticSearchStatsEvalHelpers, \
+        NodeStatsTable, Metric, PrometheusTextfileSink, monotonic
+except ImportError:
+    print("ERROR : this plugin needs the local elasticsearch_checks lib. Please install it")
+    sys.exit(2)
+
+
+#DEFAULTS
+#--------
+DEFAULT_LISTEN = '127.0.0.1:9208'
+DEFAULT_CACHE_INTERVAL = 15
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+#STATS SCOPE
+#-----------
+CLUSTER_HEALTH_FILTER_PATH = ['status', 'number_of_nodes']
+DOCS_STATS_FILTER_PATH = ['_all.primaries.docs.count']
+#a few fields of every node, so a 1000 nodes cluster stays a small response
+NODE_STATS_METRICS = ['jvm', 'fs']
+NODE_STATS_FILTER_PATH = ['nodes.*.name', 'nodes.*.jvm.mem.heap_used_percent', 'nodes.*.fs.total.disk_io_op']
+HEAP_USED_PATH = ['jvm', 'mem', 'heap_used_percent']
+DISK_IO_OP_PATH = ['fs', 'total', 'disk_io_op']
+
+
+# OPT parsing
+# -----------
+parser = optparse.OptionParser(
+    "%prog [options]", version="%prog " + version)
+
+#add default parser, the cluster to export
+parser = ElasticSearchCheckHelpers.add_default_parser_options(parser)
+
+parser.add_option('--listen',
+                  dest="listen", default=DEFAULT_LISTEN,
+                  help='Address and port to serve /metrics on. Default : 127.0.0.1:9208')
+parser.add_option('--cache-interval',
+                  dest="cache_interval", type="float", default=DEFAULT_CACHE_INTERVAL,
+                  help='Time a rendered page is served to every scrape, the scrape interval. In [s]. Default : 15 [s]')
+
+
+class MetricsPage(object):
+    """
+        Render the metrics page, at most once per cache interval
+    """
+
+    def __init__(self, opts):
+        self.opts = opts
+        self.tags = (('cluster', opts.metrics_cluster or (opts.hostname or '').split(',')[0]),)
+        self.statistics = {
+            'scrapes': 0,
+            'renders': 0
+        }
+        self._lock = threading.Lock()
+        self._page = None
+        self._rendered = None
+        #(monotonic time, docs count) of the previous render, for the indexing rate
+        self._last_docs = None
+
+    def get(self):
+        """
+        :return: the cached page, rendered again once older than the cache interval,
+        followed by the exporter counters of this scrape
+        """
+        with self._lock:
+            self.statistics['scrapes'] += 1
+            if self._page is None or monotonic() - self._rendered >= self.opts.cache_interval:
+                self._rendered = monotonic()
+                self.statistics['renders'] += 1
+                self._page = self.render()
+            return self._page + self.render_statistics()
+
+    def render_statistics(self):
+        """
+        :return: Prometheus text format bytes of the exporter counters, never cached
+        """
+        timestamp = time.time()
+        return PrometheusTextfileSink.render(self.opts.metrics_prefix, [
+            Metric('exporter_{s}_total'.format(s=name), self.statistics[name], 'counter', self.tags, timestamp)
+            for name in ['scrapes', 'renders']
+        ])
+
+    def _fetch(self):
+        """
+        Query the cluster health, the docs stats and the node stats at once
+        :return: dict endpoint -> JSON stats, or the exception raised
+        """
+        target = dict(
+            scheme=self.opts.scheme,
+            hostname=self.opts.hostname,
+            port=self.opts.port,
+            debug=self.opts.debug
+        )
+        jobs = {
+            'health': (self.opts.hostname, functools.partial(
+                ElasticSearchStatsHelpers.cluster_health,
+                filter_path=CLUSTER_HEALTH_FILTER_PATH,
+                **target
+            )),
+            'docs': (self.opts.hostname, functools.partial(
+                ElasticSearchStatsHelpers.docs_statistics,
+                filter_path=DOCS_STATS_FILTER_PATH,
+                **target
+            )),
+            'nodes': (self.opts.hostname, functools.partial(
+                ElasticSearchStatsHelpers.node_statistics,
+                node_id='_all',
+                metrics=NODE_STATS_METRICS,
+                filter_path=NODE_STATS_FILTER_PATH,
+                **target
+            )),
+        }
+        #a scrape never outlasts the interval its page is served for
+        return ElasticSearchConcurrentStatsHelpers.run(
+            jobs,
+            workers=len(jobs),
+            per_host=len(jobs),
+            deadline=self.opts.timeout or self.opts.cache_interval
+        )
+
+    def render(self):
+        """
+        :return: Prometheus text format page bytes
+        """
+        start = monotonic()
+        timestamp = time.time()
+        results = self._fetch()
+        metrics = []
+
+        def add(name, value, tags=(), kind='gauge'):
+            #NaN stands for a node missing the metric
+            if value is not None and value == value:
+                metrics.append(Metric(name, value, kind, self.tags + tuple(tags), timestamp))
+
+        for endpoint, result in sorted(results.items()):
+            add('scrape_error', int(isinstance(result, Exception)), [('endpoint', endpoint)])
+            if isinstance(result, Exception) and self.opts.debug:
+                print("{e}: {m}".format(e=endpoint, m=result))
+
+        health = results['health']
+        if not isinstance(health, Exception):
+            cluster_status = ElasticSearchStatsEvalHelpers.get_cluster_status(health)
+            #one gauge per colour, the current one is 1
+            for colour in ElasticSearchStatsHelpers.HEALTH_STATUSES:
+                add('cluster_status', int(colour == cluster_status), [('colour', colour)])
+            add('number_of_nodes', health.get('number_of_nodes'))
+
+        docs = results['docs']
+        if not isinstance(docs, Exception):
+            docs_count = ElasticSearchStatsEvalHelpers.get_nb_indexed_docs(docs)
+            add('docs_count', docs_count)
+            now = monotonic()
+            if self._last_docs is not None and docs_count >= self._last_docs[1] and now > self._last_docs[0]:
+                add('indexing_rate', (docs_count - self._last_docs[1]) / (now - self._last_docs[0]))
+            self._last_docs = (now, docs_count)
+
+        nodes = results['nodes']
+        if not isinstance(nodes, Exception):
+            #columns of doubles, a large cluster is not kept as decoded dicts
+            table = NodeStatsTable.from_node_stats(nodes, [HEAP_USED_PATH, DISK_IO_OP_PATH])
+            for node, value in zip(table.names, table.column(HEAP_USED_PATH)):
+                add('heap_used_percent', value, [('node', node)])
+            #the raw counter, Prometheus rate() deals with node restarts
+            for node, value in zip(table.names, table.column(DISK_IO_OP_PATH)):
+                add('disk_io_op_total', value, [('node', node)], kind='counter')
+
+        add('scrape_duration_seconds', monotonic() - start)
+        return PrometheusTextfileSink.render(self.opts.metrics_prefix, metrics)
+
+
+class MetricsRequestHandler(BaseHTTPRequestHandler):
+    """
+        GET /metrics, the page of the last render
+    """
+
+    def do_GET(self):
+        if self.path.split('?')[0] != '/metrics':
+            self.send_error(404)
+            return
+        try:
+            page = self.server.page.get()
+        except Exception as e:
+            if self.server.debug:
+                traceback.print_exc()
+            self.send_error(500, str(e))
+            return
+
+        self.send_response(200)
+        self.send_header('Content-Type', CONTENT_TYPE)
+        self.send_header('Content-Length', str(len(page)))
+        self.end_headers()
+        self.wfile.write(page)
+
+    def log_message(self, format, *args):
+        if self.server.debug:
+            BaseHTTPRequestHandler.log_message(self, format, *args)
+
+
+class MetricsServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+if __name__ == '__main__':
+    # Ok first job : parse args
+    opts, args = parser.parse_args()
+    if args:
+        parser.error("Does not accept any argument.")
+    if not opts.hostname:
+        parser.error("You must specify the elasticsearch hostname.")
+    if opts.cache_interval <= 0:
+        parser.error("The cache interval must be positive.")
+
+    ElasticSearchCheckHelpers.apply_default_parser_options(opts)
+
+    host, separator, port = opts.listen.rpartition(':')
+    server = MetricsServer((host or '127.0.0.1', int(port)), MetricsRequestHandler)
+    server.page = MetricsPage(opts)
+    server.debug = opts.debug
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if opts.debug:
+            ElasticSearchStatsHelpers.print_debug_statistics()
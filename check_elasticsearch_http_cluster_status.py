@@ -31,10 +31,10 @@ version = "0.0.1"
 import optparse
 import sys
 import os
+import time
 import traceback
 
 from pprint import pprint
-from statistics import mean
 
 
 #Ok try to load our directory to load the plugin utils.
@@ -44,13 +44,32 @@ sys.path.insert(0, my_dir)
 try:
     from elasticsearch_checks import \
         ElasticSearchCheckHelpers, ElasticSearchStatsHelpers, \
-        ElasticSearchStatsEvalHelpers, OutputFormatHelpers
+        ElasticSearchStatsEvalHelpers, OutputFormatHelpers, \
+        PassiveCheckResultHelpers, MetricSinkHelpers, DeadlineExceeded, \
+        monotonic
 except ImportError:
     print "ERROR : this plugin needs the local elasticsearch_checks lib. Please install it"
     sys.exit(2)
 
 
 
+#STATS SCOPE
+#-----------
+#the health is answered by the master alone, the cluster stats ask every node
+CLUSTER_HEALTH_FILTER_PATH = ['status']
+#the watch also follows the nodes count, a node leaving ends a green long-poll
+WATCH_FILTER_PATH = ['status', 'number_of_nodes', 'timed_out']
+
+
+#WATCH
+#-----
+DEFAULT_SERVICE = 'elasticsearch cluster-status'
+#wait before querying an unreachable cluster again. In [s]
+WATCH_RETRY_INTERVAL = 5
+#long-poll timeout while yellow or red, health can only wait for a better colour. In [s]
+DEFAULT_WATCH_DEGRADED_TIMEOUT = 2
+
+
 # OPT parsing
 # -----------
 parser = optparse.OptionParser(
@@ -59,13 +78,55 @@ parser = optparse.OptionParser(
 #add default parser
 parser = ElasticSearchCheckHelpers.add_default_parser_options(parser)
 
+parser.add_option('--watch',
+                  dest="watch", default=False, action="store_true",
+                  help='Run until interrupted, reporting every cluster status transition as it happens')
+parser.add_option('--watch-timeout',
+                  dest="watch_timeout", type="int",
+                  default=ElasticSearchStatsHelpers.DEFAULT_LONG_POLL_TIMEOUT,
+                  help='Longest wait of a health long-poll, the longest a degradation with no node leaving goes unseen. In [s]. Default : 30')
+parser.add_option('--watch-degraded-timeout',
+                  dest="watch_degraded_timeout", type="int", default=DEFAULT_WATCH_DEGRADED_TIMEOUT,
+                  help='Longest wait of a health long-poll while the cluster is yellow or red, the longest a worsening goes unseen. In [s]. Default : 2')
+parser.add_option('--command-file',
+                  dest="command_file", default=None,
+                  help='Watch only, also submit the results to this external command file')
+parser.add_option('--spool-dir',
+                  dest="spool_dir", default=None,
+                  help='Watch only, also submit the results as files in this check result spool directory')
+parser.add_option('--host-name',
+                  dest="host_name", default=None,
+                  help='Watch only, monitored host the results are attached to. Default : --hostname')
+parser.add_option('--service',
+                  dest="service", default=DEFAULT_SERVICE,
+                  help='Watch only, service description of the results. Default : elasticsearch cluster-status')
 
-if __name__ == '__main__':
-    # Ok first job : parse args
-    opts, args = parser.parse_args()
+
+def parse_args(argv=None):
+    """
+    Parse then validate the check arguments
+    :param argv: arguments, sys.argv[1:] when None
+    :type argv: list
+    :return: parsed options
+    """
+    opts, args = parser.parse_args(argv)
     if args:
         parser.error("Does not accept any argument.")
+    if opts.watch_timeout < 1:
+        parser.error("The watch timeout is at least 1 [s].")
+    if opts.watch_degraded_timeout < 1:
+        parser.error("The watch degraded timeout is at least 1 [s].")
+    return opts
 
+
+@ElasticSearchCheckHelpers.timed_check
+def check(opts):
+    """
+    Run the check
+    :param opts: options returned by parse_args
+    :type opts: optparse.Values
+    :return: (state, output string)
+    """
     # connection parameters
     port = opts.port
     hostname = opts.hostname or ''
@@ -75,10 +136,11 @@ if __name__ == '__main__':
 
     try:
         #get stats
-        stats = ElasticSearchStatsHelpers.cluster_statistics(
+        stats = ElasticSearchStatsHelpers.cluster_health(
             scheme=scheme,
             hostname=hostname,
             port=port,
+            filter_path=CLUSTER_HEALTH_FILTER_PATH,
             debug=debug
         )
 
@@ -93,6 +155,10 @@ if __name__ == '__main__':
             print(cluster_status)
             print("--------------")
 
+        #one gauge per colour, the current one is 1
+        for colour in ElasticSearchStatsHelpers.HEALTH_STATUSES:
+            MetricSinkHelpers.record('cluster_status', int(colour == cluster_status), tags={'colour': colour})
+
         
         #check logic
         status = 'OK'
@@ -119,17 +185,110 @@ if __name__ == '__main__':
         )
 
 
-        print(output)
+        if debug:
+            ElasticSearchStatsHelpers.print_debug_statistics()
 
+    except DeadlineExceeded as e:
+        #the check ran out of time, elasticsearch state is not known
+        return 'Unknown', OutputFormatHelpers.check_output_string('Unknown', str(e), None)
     except Exception as e:
         if debug:
             print(e)
             the_type, value, tb = sys.exc_info()
             traceback.print_tb(tb)
-        print("Error: {m}".format(m=e))
-        sys.exit(2)
+        return 'Critical', "Error: {m}".format(m=e)
+
+    return status, output
+
+
+def watch(opts):
+    """
+    Follow the cluster status with health long-polls until interrupted
+    Every transition is printed as soon as it is seen, with the time the
+    previous colour lasted. Health can only wait for a better colour, so a
+    yellow or red cluster is polled every watch degraded timeout to see it
+    get worse. Passive results are also submitted every watch timeout
+    without a transition, so the service stays fresh.
+    :param opts: options returned by parse_args
+    :type opts: optparse.Values
+    """
+    hostname = opts.hostname or ''
+    debug = opts.debug
+    host_name = opts.host_name or hostname
+
+    #None once the cluster is unreachable
+    cluster_status, nb_nodes, since, observed = None, None, monotonic(), False
+    submitted = since
+    while True:
+        start_time = time.time()
+        timeout = opts.watch_timeout
+        if cluster_status in ('yellow', 'red'):
+            timeout = min(timeout, opts.watch_degraded_timeout)
+        try:
+            health = ElasticSearchStatsHelpers.wait_for_health(
+                cluster_status,
+                nb_nodes=nb_nodes,
+                timeout=timeout,
+                scheme=opts.scheme,
+                hostname=hostname,
+                port=opts.port,
+                filter_path=WATCH_FILTER_PATH,
+                debug=debug
+            )
+            new_status = ElasticSearchStatsEvalHelpers.get_cluster_status(health)
+            nb_nodes = health.get('number_of_nodes', nb_nodes)
+            comment = "cluster status is {c}".format(c=new_status)
+            timed_out = health.get('timed_out', False)
+        except Exception as e:
+            if debug:
+                the_type, value, tb = sys.exc_info()
+                traceback.print_tb(tb)
+            new_status, timed_out = None, False
+            comment = "cluster health unreachable: {m}".format(m=e)
+
+        now = monotonic()
+        transition = not observed or new_status != cluster_status
+        if transition and observed:
+            comment += ", {p} lasted {d:.1f}s".format(p=cluster_status or 'unreachable', d=now - since)
+        if new_status is None:
+            status = 'Unknown'
+        elif new_status == 'green':
+            status = 'OK'
+        else:
+            status = 'Critical'
+        output = OutputFormatHelpers.check_output_string(status, comment, None)
+
+        if transition:
+            since = now
+            sys.stdout.write("{t} {o}\n".format(t=time.strftime('%Y-%m-%d %H:%M:%S'), o=output.strip()))
+            sys.stdout.flush()
+        if transition or (timed_out and now - submitted >= opts.watch_timeout):
+            submitted = now
+            results = [PassiveCheckResultHelpers.CheckResult(
+                host_name, opts.service, status, output, start_time, time.time()
+            )]
+            if opts.command_file:
+                PassiveCheckResultHelpers.write_command_file(opts.command_file, results)
+            if opts.spool_dir:
+                PassiveCheckResultHelpers.write_spool_file(opts.spool_dir, results)
+
+        cluster_status, observed = new_status, True
+        if new_status is None:
+            time.sleep(WATCH_RETRY_INTERVAL)
+
+
+if __name__ == '__main__':
+    # Ok first job : parse args
+    opts = parse_args()
+    ElasticSearchCheckHelpers.apply_default_parser_options(opts)
+
+    if opts.watch:
+        try:
+            watch(opts)
+        except KeyboardInterrupt:
+            sys.exit(0)
 
-    finally:
-        if status == "Critical":
-            sys.exit(2)
-        sys.exit(0)
+    status, output = check(opts)
+    print(output)
+    MetricSinkHelpers.flush()
+    sys.exit(OutputFormatHelpers.EXIT_CODES[status])
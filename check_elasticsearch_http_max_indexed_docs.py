@@ -34,7 +34,6 @@ import os
 import traceback
 
 from pprint import pprint
-from statistics import mean
 
 
 #Ok try to load our directory to load the plugin utils.
@@ -44,7 +43,8 @@ sys.path.insert(0, my_dir)
 try:
     from elasticsearch_checks import \
         ElasticSearchCheckHelpers, ElasticSearchStatsHelpers, \
-        ElasticSearchStatsEvalHelpers, OutputFormatHelpers
+        ElasticSearchStatsEvalHelpers, ElasticSearchStateHelpers, \
+        OutputFormatHelpers, MetricSinkHelpers, DeadlineExceeded
 except ImportError:
     print "ERROR : this plugin needs the local elasticsearch_checks lib. Please install it"
     sys.exit(2)
@@ -56,6 +56,13 @@ DEFAULT_WARNING = 15000
 DEFAULT_CRITICAL = 20000
 
 
+#STATS SCOPE
+#-----------
+#docs stats gather the docs section of every index only, not the cluster stats
+#of every node
+DOCS_STATS_FILTER_PATH = ['_all.primaries.docs.count']
+
+
 # OPT parsing
 # -----------
 parser = optparse.OptionParser(
@@ -76,13 +83,39 @@ parser.add_option('--sample-interval',
 parser.add_option('--max-sample',
                   dest="max_sample", type="int", default=5,
                   help='Cpu sampling number. In [number]. Default : 5')
+parser.add_option('--no-early-exit',
+                  dest="no_early_exit", default=False, action="store_true",
+                  help='Take every sample, even once the first ones settle the status')
 
-if __name__ == '__main__':
-    # Ok first job : parse args
-    opts, args = parser.parse_args()
+#add state parser
+parser = ElasticSearchCheckHelpers.add_state_parser_options(parser)
+
+
+def parse_args(argv=None):
+    """
+    Parse then validate the check arguments
+    :param argv: arguments, sys.argv[1:] when None
+    :type argv: list
+    :return: parsed options
+    """
+    opts, args = parser.parse_args(argv)
     if args:
         parser.error("Does not accept any argument.")
+    if opts.max_sample < 2 and not opts.state_file:
+        parser.error("At least two samples are needed to compute a rate.")
+    if opts.sample_interval <= 0:
+        parser.error("The sample interval must be positive.")
+    return opts
+
 
+@ElasticSearchCheckHelpers.timed_check
+def check(opts):
+    """
+    Run the check
+    :param opts: options returned by parse_args
+    :type opts: optparse.Values
+    :return: (state, output string)
+    """
     # connection parameters
     port = opts.port
     hostname = opts.hostname or ''
@@ -92,80 +125,202 @@ if __name__ == '__main__':
     #sampling parameters
     sample_interval = opts.sample_interval
     max_sample = opts.max_sample
+    state_file = opts.state_file
 
     # Try to get numeic warning/critical values
     s_warning = opts.warning or DEFAULT_WARNING
     s_critical = opts.critical or DEFAULT_CRITICAL
 
 
+    #thresholds are given for the nominal sampling window
+    measurement_time = max_sample * sample_interval
+
+    def docs_lower_bound(samples):
+        """
+        :return: (docs rate, docs count) floors of the whole window fit, None when not known
+        """
+        docs_rate = ElasticSearchStatsEvalHelpers.slope_lower_bound(
+            samples,
+            ElasticSearchStatsEvalHelpers.get_nb_indexed_docs,
+            max_sample,
+            sample_interval
+        )
+        if docs_rate is None:
+            return None
+        return docs_rate, int(round(docs_rate * measurement_time))
+
+    def settled(samples):
+        #the docs count only grows: once the least docs the whole window can
+        #be fitted with reach the critical, it can only end Critical
+        bound = docs_lower_bound(samples)
+        return bound is not None and bound[1] >= s_critical
+
     try:
         #get stats
-        stats = ElasticSearchStatsHelpers.sampled_cluster_statistics(
-            scheme=scheme,
-            hostname=hostname,
-            port=port,
-            sample_interval=sample_interval,
-            nb_sample=max_sample,
-            debug=debug
-        )
+        if state_file:
+            #single query, the previous samples come from the state file
+            stats = ElasticSearchStateHelpers.record_sample(
+                path=state_file,
+                payload=ElasticSearchStatsEvalHelpers.trim_nb_indexed_docs(
+                    ElasticSearchStatsHelpers.docs_statistics(
+                        scheme=scheme,
+                        hostname=hostname,
+                        port=port,
+                        filter_path=DOCS_STATS_FILTER_PATH,
+                        debug=debug
+                    )
+                ),
+                max_age=opts.state_max_age,
+                min_interval=opts.state_min_interval,
+                history=opts.state_history,
+                validate=ElasticSearchStatsEvalHelpers.nb_indexed_docs_not_decreasing,
+                age=ElasticSearchStatsHelpers.last_response_age()
+            )
+        else:
+            stats = ElasticSearchStatsHelpers.sampled_docs_statistics(
+                scheme=scheme,
+                hostname=hostname,
+                port=port,
+                filter_path=DOCS_STATS_FILTER_PATH,
+                sample_interval=sample_interval,
+                nb_sample=max_sample,
+                settled=None if opts.no_early_exit else settled,
+                debug=debug
+            )
 
         if debug:
             pprint(stats)
 
         #Get stats
-        nb_docs_sample = ElasticSearchStatsEvalHelpers.filter_nb_indexed_docs(stats)
+        nb_docs_sample = ElasticSearchStatsEvalHelpers.filter_nb_indexed_docs(
+            ElasticSearchStatsEvalHelpers.sample_payloads(stats)
+        )
         if debug:
             print("NB docs Sample")
             print("--------------")
             print(nb_docs_sample)
             print("--------------")
 
-        #Process data
-        measurement_time = max_sample * sample_interval
-        first = nb_docs_sample[0]
-        last = nb_docs_sample[-1]
-        nb_docs_diff = last - first
-
-        #check logic
-        status = 'OK'
-        nb_docs_message = "{l} docs indexed in {t}s ".format(
-            l=nb_docs_diff,
-            t=measurement_time
-        )
-        if nb_docs_diff >= s_warning:
-            status = 'Warning'
-        if nb_docs_diff >= s_critical:
-            status = 'Critical'
-
-
-        #Format perf data string
-        con_perf_data_string = OutputFormatHelpers.perf_data_string(
-            label="{t}s_indexed_doc".format(t=measurement_time),
-            value=nb_docs_diff,
-            warn=s_warning,
-            crit=s_critical
-        )
+        if len(stats) < 2:
+            status = 'Unknown'
+            if state_file:
+                comment = "no usable previous run in {f}, the rate is available from the next run".format(
+                    f=state_file
+                )
+            else:
+                comment = "{n} sample taken, at least two are needed to compute a rate".format(n=len(stats))
+            output = OutputFormatHelpers.check_output_string(status, comment, None)
+        else:
+            #Process data, the rate is fitted on the real sample times, so a
+            #late sample or a burst weighs little, then brought back to the
+            #nominal window the thresholds are given for
+            elapsed_time = ElasticSearchStatsEvalHelpers.sample_elapsed_time(stats)
+            rates = ElasticSearchStatsEvalHelpers.rate_analytics(
+                stats,
+                ElasticSearchStatsEvalHelpers.get_nb_indexed_docs
+            )
+            docs_rate = rates.slope
+            nb_docs_diff = int(round(docs_rate * measurement_time))
+            early_exit = not state_file and len(stats) < max_sample
+            if early_exit:
+                #the window was cut short, the status is taken on the floor that
+                #settled it, the one the whole window would have had the same status with
+                docs_rate, nb_docs_diff = docs_lower_bound(stats)
 
-        #format OUtput
-        output = OutputFormatHelpers.check_output_string(
-            status,
-            nb_docs_message,
-            [con_perf_data_string]
-        )
+            MetricSinkHelpers.record('docs_count', ElasticSearchStatsEvalHelpers.get_nb_indexed_docs(stats[-1][1]))
+            MetricSinkHelpers.record('indexed_docs', nb_docs_diff)
+            MetricSinkHelpers.record('indexing_rate', docs_rate)
+            MetricSinkHelpers.record('indexing_stalled_seconds', rates.stalled)
+            MetricSinkHelpers.record('samples', len(stats))
+
+            #check logic
+            status = 'OK'
+            nb_docs_message = "{l} docs indexed in {t}s ({r:.1f} docs/s fitted on {n} samples over {e:.2f}s, {mn:.1f} to {mx:.1f} docs/s{s}) ".format(
+                l=nb_docs_diff,
+                t=measurement_time,
+                r=docs_rate,
+                n=len(stats),
+                e=elapsed_time,
+                mn=rates.min,
+                mx=rates.max,
+                s=(", stalled {s:.1f}s".format(s=rates.stalled) if rates.stalled else '') + (
+                    ", at least, settled after {n} of {m} samples".format(n=len(stats), m=max_sample) if early_exit else ''
+                )
+            )
+            if nb_docs_diff >= s_warning:
+                status = 'Warning'
+            if nb_docs_diff >= s_critical:
+                status = 'Critical'
+
+
+            #Format perf data string
+            con_perf_data_string = OutputFormatHelpers.perf_data_string(
+                label="{t}s_indexed_doc".format(t=measurement_time),
+                value=nb_docs_diff,
+                warn=s_warning,
+                crit=s_critical
+            )
+
+            rates_perf_data_strings = [
+                OutputFormatHelpers.perf_data_string(
+                    label=label,
+                    value='{v:.1f}'.format(v=value),
+                    warn='',
+                    crit=''
+                )
+                for label, value in [
+                    ('indexing_rate', docs_rate),
+                    ('indexing_rate_min', rates.min),
+                    ('indexing_rate_p50', rates.p50),
+                    ('indexing_rate_max', rates.max),
+                ]
+            ]
+            stalled_perf_data_string = OutputFormatHelpers.perf_data_string(
+                label='indexing_stalled',
+                value='{v:.1f}'.format(v=rates.stalled),
+                warn='',
+                crit='',
+                UOM='s',
+                min=0
+            )
+            samples_perf_data_string = OutputFormatHelpers.perf_data_string(
+                label='samples',
+                value=len(stats),
+                warn='',
+                crit='',
+                min=0,
+                max=opts.state_history if state_file else max_sample
+            )
+
+            #format OUtput
+            output = OutputFormatHelpers.check_output_string(
+                status,
+                nb_docs_message,
+                [con_perf_data_string] + rates_perf_data_strings + [stalled_perf_data_string, samples_perf_data_string]
+            )
 
-        print(output)
+        if debug:
+            ElasticSearchStatsHelpers.print_debug_statistics()
 
+    except DeadlineExceeded as e:
+        #the check ran out of time, elasticsearch state is not known
+        return 'Unknown', OutputFormatHelpers.check_output_string('Unknown', str(e), None)
     except Exception as e:
         if debug:
             print(e)
             the_type, value, tb = sys.exc_info()
             traceback.print_tb(tb)
-        print("Error: {m}".format(m=e))
-        sys.exit(2)
-
-    finally:
-        if status == "Critical":
-            sys.exit(2)
-        if status == "Warning":
-            sys.exit(1)
-        sys.exit(0)
+        return 'Critical', "Error: {m}".format(m=e)
+
+    return status, output
+
+
+if __name__ == '__main__':
+    # Ok first job : parse args
+    opts = parse_args()
+    ElasticSearchCheckHelpers.apply_default_parser_options(opts)
+
+    status, output = check(opts)
+    print(output)
+    MetricSinkHelpers.flush()
+    sys.exit(OutputFormatHelpers.EXIT_CODES[status])
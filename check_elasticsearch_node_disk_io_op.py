@@ -34,7 +34,6 @@ import os
 import traceback
 
 from pprint import pprint
-from statistics import mean
 
 
 #Ok try to load our directory to load the plugin utils.
@@ -44,7 +43,8 @@ sys.path.insert(0, my_dir)
 try:
     from elasticsearch_checks import \
         ElasticSearchCheckHelpers, ElasticSearchStatsHelpers, \
-        ElasticSearchStatsEvalHelpers, OutputFormatHelpers
+        ElasticSearchStatsEvalHelpers, ElasticSearchStateHelpers, \
+        OutputFormatHelpers, MetricSinkHelpers, DeadlineExceeded
 except ImportError:
     print "ERROR : this plugin needs the local elasticsearch_checks lib. Please install it"
     sys.exit(2)
@@ -52,8 +52,19 @@ except ImportError:
 
 #DEFAULT LIMITS
 #--------------
-DEFAULT_WARNING = 80
-DEFAULT_CRITICAL = 90
+#operations per second, the counter itself was compared with 80 and 90 before
+DEFAULT_WARNING = 1000
+DEFAULT_CRITICAL = 2000
+
+
+#STATS SCOPE
+#-----------
+#disk_io_op counts operations since the node start, the jvm uptime tells
+#when the node restarted and the counter started again from zero
+NODE_STATS_METRICS = ['fs', 'jvm']
+NODE_STATS_FILTER_PATH = ['nodes.*.name', 'nodes.*.fs.total.disk_io_op', 'nodes.*.jvm.uptime_in_millis']
+DISK_IO_OP_PATH = ['fs', 'total', 'disk_io_op']
+RESET_PATH = ['jvm', 'uptime_in_millis']
 
 
 # OPT parsing
@@ -66,29 +77,65 @@ parser = ElasticSearchCheckHelpers.add_default_parser_options(parser)
 
 parser.add_option('--node-id',
                   dest="node_id",default=None,
-                  help='get this specific node stats')
+                  help='get this specific node stats. Accepts elasticsearch node filters (names, wildcards, attr:value)')
+parser.add_option('--all-nodes',
+                  dest="all_nodes", default=False, action="store_true",
+                  help='check every node selected by --node-id, all the cluster nodes by default')
 parser.add_option('-w', '--warning',
                   dest="warning", type="int",default=None,
-                  help='Warning value for heap percentage usage. Default : 80')
+                  help='Warning value for disk io operations per second. Default : 1000')
 parser.add_option('-c', '--critical',
                   dest="critical", type="int",default=None,
-                  help='Critical value for for heap percentage usage. Default : 90')
+                  help='Critical value for disk io operations per second. Default : 2000')
+parser.add_option('--sample-interval',
+                  dest="sample_interval", type="int", default=1,
+                  help='Disk io sampling interval. In [s]. Default : 1 [s]')
+parser.add_option('--max-sample',
+                  dest="max_sample", type="int", default=2,
+                  help='Disk io sampling number. In [number]. Default : 2')
 
-if __name__ == '__main__':
-    # Ok first job : parse args
-    opts, args = parser.parse_args()
+#add state parser
+parser = ElasticSearchCheckHelpers.add_state_parser_options(parser)
+
+
+def parse_args(argv=None):
+    """
+    Parse then validate the check arguments
+    :param argv: arguments, sys.argv[1:] when None
+    :type argv: list
+    :return: parsed options
+    """
+    opts, args = parser.parse_args(argv)
     if args:
         parser.error("Does not accept any argument.")
+    if opts.node_id is None and not opts.all_nodes:
+        parser.error("You must speciffy a node id.")
+    if opts.max_sample < 2 and not opts.state_file:
+        parser.error("At least two samples are needed to compute a rate.")
+    return opts
 
+
+@ElasticSearchCheckHelpers.timed_check
+def check(opts):
+    """
+    Run the check
+    :param opts: options returned by parse_args
+    :type opts: optparse.Values
+    :return: (state, output string)
+    """
     # connection parameters
     port = opts.port
     hostname = opts.hostname or ''
     scheme = opts.scheme
     debug = opts.debug
 
-    if opts.node_id is None:
-        parser.error("You must speciffy a node id.")
-    node_id = opts.node_id
+    all_nodes = opts.all_nodes
+    node_id = opts.node_id or '_all'
+
+    #sampling parameters
+    sample_interval = opts.sample_interval
+    max_sample = opts.max_sample
+    state_file = opts.state_file
 
     # Try to get numeic warning/critical values
     s_warning = opts.warning or DEFAULT_WARNING
@@ -97,76 +144,168 @@ if __name__ == '__main__':
 
     try:
         #get stats
-        stats = ElasticSearchStatsHelpers.node_statistics(
-            scheme=scheme,
-            hostname=hostname,
-            port=port,
-            node_id=node_id,
-            debug=debug
-        )
+        if state_file:
+            #single query, the previous samples come from the state file
+            stats = ElasticSearchStateHelpers.record_sample(
+                path=state_file,
+                payload=ElasticSearchStatsHelpers.node_statistics(
+                    scheme=scheme,
+                    hostname=hostname,
+                    port=port,
+                    node_id=node_id,
+                    metrics=NODE_STATS_METRICS,
+                    filter_path=NODE_STATS_FILTER_PATH,
+                    debug=debug
+                ),
+                max_age=opts.state_max_age,
+                min_interval=opts.state_min_interval,
+                history=opts.state_history,
+                age=ElasticSearchStatsHelpers.last_response_age()
+            )
+        else:
+            stats = ElasticSearchStatsHelpers.sampled_node_statistics(
+                scheme=scheme,
+                hostname=hostname,
+                port=port,
+                node_id=node_id,
+                metrics=NODE_STATS_METRICS,
+                filter_path=NODE_STATS_FILTER_PATH,
+                sample_interval=sample_interval,
+                nb_sample=max_sample,
+                debug=debug
+            )
 
         if debug:
             pprint(stats)
 
-        #Get stats
-        disk_io_op_temp = ElasticSearchStatsEvalHelpers.get_disk_io_op(stats)
-        disk_io_op = disk_io_op_temp/8388608
+        if len(stats) < 2:
+            status = 'Unknown'
+            output = OutputFormatHelpers.check_output_string(
+                status,
+                "no usable previous run in {f}, the rate is available from the next run".format(
+                    f=state_file
+                ),
+                None
+            )
+        else:
+            #operations per second of every node, across node restarts
+            disk_io_op_by_node = ElasticSearchStatsEvalHelpers.nodes_counter_rates(
+                stats,
+                DISK_IO_OP_PATH,
+                reset_path=RESET_PATH
+            )
+            if debug:
+                print("Disk io op per second by node")
+                print("-----------------------------")
+                pprint(disk_io_op_by_node)
+                print("-----------------------------")
+            MetricSinkHelpers.record_nodes('disk_io_op_rate', disk_io_op_by_node)
+
+            if all_nodes:
+                #every selected node from a single query, the worst one sets the status
+                node_status = dict(
+                    (node, ElasticSearchStatsEvalHelpers.threshold_status(value, s_warning, s_critical))
+                    for node, value in disk_io_op_by_node.items()
+                )
+                status = OutputFormatHelpers.worst_status(node_status.values())
+                if disk_io_op_by_node:
+                    disk_io_op_comment = "Disk IOps {s}".format(
+                        s=OutputFormatHelpers.nodes_summary(
+                            disk_io_op_by_node,
+                            node_status,
+                            value_template='{v:.1f} IOps'
+                        )
+                    )
+                else:
+                    disk_io_op_comment = "no node matches {n}".format(n=node_id)
+
+                #Format perf data string
+                perf_data_strings = [
+                    OutputFormatHelpers.perf_data_string(
+                        label='{n}_disk_io_op'.format(n=node),
+                        value='{v:.1f}'.format(v=value),
+                        warn=s_warning,
+                        crit=s_critical,
+                        UOM='IOps'
+                    )
+                    for node, value in disk_io_op_by_node.items()
+                ]
+
+                #format OUtput
+                output = OutputFormatHelpers.check_output_string(
+                    status,
+                    disk_io_op_comment,
+                    perf_data_strings
+                )
+            elif not disk_io_op_by_node:
+                status = 'Unknown'
+                output = OutputFormatHelpers.check_output_string(
+                    status,
+                    "no node matches {n} in two samples".format(n=node_id),
+                    None
+                )
+            else:
+                #Get stats
+                disk_io_op = list(disk_io_op_by_node.values())[0]
+
+                #check logic
+                status = 'OK'
+                comment='within the limits'
+                disk_io_op_comment_tempalte="Disk IOps {c} {v:.1f} IOps"
+
+                if disk_io_op >= s_warning:
+                    status = 'Warning'
+                    comment='too high'
+                if disk_io_op >= s_critical:
+                    status = 'Critical'
+                    comment='too hgih'
+
+                #format output
+                disk_io_op_comment=disk_io_op_comment_tempalte.format(
+                    c=comment,
+                    v=disk_io_op
+                )
+
+
+                #Format perf data string
+                con_perf_data_string = OutputFormatHelpers.perf_data_string(
+                    label='disk_io_op',
+                    value='{v:.1f}'.format(v=disk_io_op),
+                    warn=s_warning,
+                    crit=s_critical,
+                    UOM='IOps'
+                )
+
+
+                #format OUtput
+                output = OutputFormatHelpers.check_output_string(
+                    status,
+                    disk_io_op_comment,
+                    [con_perf_data_string]
+                )
+
         if debug:
-            print("Total disko io op")
-            print("--------------")
-            print(disk_io_op)
-            print("--------------")
-
-        #check logic
-        status = 'OK'
-        comment='within the limits'
-        disk_io_op_comment_tempalte="Disk IOps {c} {v}Mb/s"
-        disk_io_op_message_template="{s}: {m}"
-
-        if disk_io_op >= s_warning:
-            status = 'Warning'
-            comment='too high'
-        if disk_io_op >= s_critical:
-            status = 'Critical'
-            comment='too hgih'
-
-        #format output
-        disk_io_op_comment=disk_io_op_comment_tempalte.format(
-            c=comment,
-            v=disk_io_op
-        )
-
-
-        #Format perf data string
-        con_perf_data_string = OutputFormatHelpers.perf_data_string(
-            label='disk_io_op',
-            value=disk_io_op,
-            warn=s_warning,
-            crit=s_critical,
-            UOM='IOps'
-        )
-
-
-        #format OUtput
-        output = OutputFormatHelpers.check_output_string(
-            status,
-            disk_io_op_comment,
-            [con_perf_data_string]
-        )
-
-        print(output)
+            ElasticSearchStatsHelpers.print_debug_statistics()
 
+    except DeadlineExceeded as e:
+        #the check ran out of time, elasticsearch state is not known
+        return 'Unknown', OutputFormatHelpers.check_output_string('Unknown', str(e), None)
     except Exception as e:
         if debug:
             print(e)
             the_type, value, tb = sys.exc_info()
             traceback.print_tb(tb)
-        print("Error: {m}".format(m=e))
-        sys.exit(2)
-
-    finally:
-        if status == "Critical":
-            sys.exit(2)
-        if status == "Warning":
-            sys.exit(1)
-        sys.exit(0)
+        return 'Critical', "Error: {m}".format(m=e)
+
+    return status, output
+
+
+if __name__ == '__main__':
+    # Ok first job : parse args
+    opts = parse_args()
+    ElasticSearchCheckHelpers.apply_default_parser_options(opts)
+
+    status, output = check(opts)
+    print(output)
+    MetricSinkHelpers.flush()
+    sys.exit(OutputFormatHelpers.EXIT_CODES[status])
@@ -34,7 +34,6 @@ import os
 import traceback
 
 from pprint import pprint
-from statistics import mean
 
 
 #Ok try to load our directory to load the plugin utils.
@@ -44,7 +43,8 @@ sys.path.insert(0, my_dir)
 try:
     from elasticsearch_checks import \
         ElasticSearchCheckHelpers, ElasticSearchStatsHelpers, \
-        ElasticSearchStatsEvalHelpers, OutputFormatHelpers
+        ElasticSearchStatsEvalHelpers, NodeStatsTable, OutputFormatHelpers, \
+        MetricSinkHelpers, DeadlineExceeded
 except ImportError:
     print "ERROR : this plugin needs the local elasticsearch_checks lib. Please install it"
     sys.exit(2)
@@ -56,6 +56,13 @@ DEFAULT_WARNING = 80
 DEFAULT_CRITICAL = 90
 
 
+#STATS SCOPE
+#-----------
+NODE_STATS_METRICS = ['jvm']
+NODE_STATS_FILTER_PATH = ['nodes.*.name', 'nodes.*.jvm.mem.heap_used_percent']
+HEAP_USED_PATH = ['jvm', 'mem', 'heap_used_percent']
+
+
 # OPT parsing
 # -----------
 parser = optparse.OptionParser(
@@ -66,7 +73,10 @@ parser = ElasticSearchCheckHelpers.add_default_parser_options(parser)
 
 parser.add_option('--node-id',
                   dest="node_id",default=None,
-                  help='get this specific node stats')
+                  help='get this specific node stats. Accepts elasticsearch node filters (names, wildcards, attr:value)')
+parser.add_option('--all-nodes',
+                  dest="all_nodes", default=False, action="store_true",
+                  help='check every node selected by --node-id, all the cluster nodes by default')
 parser.add_option('-w', '--warning',
                   dest="warning", type="int",default=None,
                   help='Warning value for heap percentage usage. Default : 80')
@@ -74,21 +84,38 @@ parser.add_option('-c', '--critical',
                   dest="critical", type="int",default=None,
                   help='Critical value for for heap percentage usage. Default : 90')
 
-if __name__ == '__main__':
-    # Ok first job : parse args
-    opts, args = parser.parse_args()
+
+def parse_args(argv=None):
+    """
+    Parse then validate the check arguments
+    :param argv: arguments, sys.argv[1:] when None
+    :type argv: list
+    :return: parsed options
+    """
+    opts, args = parser.parse_args(argv)
     if args:
         parser.error("Does not accept any argument.")
+    if opts.node_id is None and not opts.all_nodes:
+        parser.error("You must speciffy a node id.")
+    return opts
 
+
+@ElasticSearchCheckHelpers.timed_check
+def check(opts):
+    """
+    Run the check
+    :param opts: options returned by parse_args
+    :type opts: optparse.Values
+    :return: (state, output string)
+    """
     # connection parameters
     port = opts.port
     hostname = opts.hostname or ''
     scheme = opts.scheme
     debug = opts.debug
 
-    if opts.node_id is None:
-        parser.error("You must speciffy a node id.")
-    node_id = opts.node_id
+    all_nodes = opts.all_nodes
+    node_id = opts.node_id or '_all'
 
     # Try to get numeic warning/critical values
     s_warning = opts.warning or DEFAULT_WARNING
@@ -102,72 +129,135 @@ if __name__ == '__main__':
             hostname=hostname,
             port=port,
             node_id=node_id,
+            metrics=NODE_STATS_METRICS,
+            filter_path=NODE_STATS_FILTER_PATH,
             debug=debug
         )
 
         if debug:
             pprint(stats)
 
-        #Get stats
-        percentage_heap_used = ElasticSearchStatsEvalHelpers.get_heap_used_percent(stats)
+        #one row per node, the thresholds are compared on the whole column
+        table = NodeStatsTable.from_node_stats(stats, [HEAP_USED_PATH])
+        heap_used_by_node = table.values(HEAP_USED_PATH)
+        node_status = dict(zip(table.names, table.threshold_states(HEAP_USED_PATH, s_warning, s_critical)))
         if debug:
-            print("Percentage heap used")
-            print("--------------")
-            print(percentage_heap_used)
-            print("--------------")
-
-        #check logic
-        status = 'OK'
-        comment='within the limits'
-        heap_used_comment_tempalte="Heap usage is {c} {v}%"
-        heap_used_message_template="{s}: {m}"
-
-        if percentage_heap_used >= s_warning:
-            status = 'Warning'
-            comment='too high'
-        if percentage_heap_used >= s_critical:
-            status = 'Critical'
-            comment='too hgih'
-
-        #format output
-        heap_usage_comment=heap_used_comment_tempalte.format(
-            c=comment,
-            v=percentage_heap_used
-        )
+            print("Percentage heap used by node")
+            print("----------------------------")
+            pprint(heap_used_by_node)
+            print("----------------------------")
+        MetricSinkHelpers.record_nodes('heap_used_percent', heap_used_by_node)
 
+        if all_nodes:
+            #every selected node from a single query, the worst one sets the status
+            status = OutputFormatHelpers.worst_status(node_status.values())
+            if heap_used_by_node:
+                heap_usage_comment = "Heap usage {s}".format(
+                    s=OutputFormatHelpers.nodes_summary(
+                        heap_used_by_node,
+                        node_status,
+                        value_template='{v:g}%'
+                    )
+                )
+            else:
+                heap_usage_comment = "no node matches {n}".format(n=node_id)
 
-        #Format perf data string
-        con_perf_data_string = OutputFormatHelpers.perf_data_string(
-            label='heap_used',
-            value=percentage_heap_used,
-            warn=s_warning,
-            crit=s_critical,
-            min=0,
-            max=100,
-            UOM='%'
-        )
+            #Format perf data string, a node without the metric has none
+            perf_data_strings = [
+                OutputFormatHelpers.perf_data_string(
+                    label='{n}_heap_used'.format(n=node),
+                    value='{v:g}'.format(v=value),
+                    warn=s_warning,
+                    crit=s_critical,
+                    min=0,
+                    max=100,
+                    UOM='%'
+                )
+                for node, value in heap_used_by_node.items()
+                if value == value
+            ]
 
+            #format OUtput
+            output = OutputFormatHelpers.check_output_string(
+                status,
+                heap_usage_comment,
+                perf_data_strings
+            )
+        elif not heap_used_by_node:
+            status = 'Unknown'
+            output = OutputFormatHelpers.check_output_string(
+                status,
+                "no node matches {n}".format(n=node_id),
+                None
+            )
+        elif node_status[table.names[0]] == 'Unknown':
+            status = 'Unknown'
+            output = OutputFormatHelpers.check_output_string(
+                status,
+                "node {n} reports no heap usage".format(n=table.names[0]),
+                None
+            )
+        else:
+            #Get stats
+            percentage_heap_used = table.column(HEAP_USED_PATH)[0]
+            status = node_status[table.names[0]]
 
-        #format OUtput
-        output = OutputFormatHelpers.check_output_string(
-            status,
-            heap_usage_comment,
-            [con_perf_data_string]
-        )
+            #check logic
+            comment = {
+                'OK': 'within the limits',
+                'Warning': 'too high',
+                'Critical': 'too hgih'
+            }[status]
+            heap_used_comment_tempalte="Heap usage is {c} {v:g}%"
+
+            #format output
+            heap_usage_comment=heap_used_comment_tempalte.format(
+                c=comment,
+                v=percentage_heap_used
+            )
 
-        print(output)
 
+            #Format perf data string
+            con_perf_data_string = OutputFormatHelpers.perf_data_string(
+                label='heap_used',
+                value='{v:g}'.format(v=percentage_heap_used),
+                warn=s_warning,
+                crit=s_critical,
+                min=0,
+                max=100,
+                UOM='%'
+            )
+
+
+            #format OUtput
+            output = OutputFormatHelpers.check_output_string(
+                status,
+                heap_usage_comment,
+                [con_perf_data_string]
+            )
+
+        if debug:
+            ElasticSearchStatsHelpers.print_debug_statistics()
+
+    except DeadlineExceeded as e:
+        #the check ran out of time, elasticsearch state is not known
+        return 'Unknown', OutputFormatHelpers.check_output_string('Unknown', str(e), None)
     except Exception as e:
         if debug:
             print(e)
             the_type, value, tb = sys.exc_info()
             traceback.print_tb(tb)
-        print("Error: {m}".format(m=e))
-        sys.exit(2)
-
-    finally:
-        if status == "Critical":
-            sys.exit(2)
-        if status == "Warning":
-            sys.exit(1)
-        sys.exit(0)
+        return 'Critical', "Error: {m}".format(m=e)
+
+    return status, output
+
+
+if __name__ == '__main__':
+    # Ok first job : parse args
+    opts = parse_args()
+    ElasticSearchCheckHelpers.apply_default_parser_options(opts)
+
+    status, output = check(opts)
+    print(output)
+    MetricSinkHelpers.flush()
+    sys.exit(OutputFormatHelpers.EXIT_CODES[status])
@@ -0,0 +1,248 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2013:
+#     Sébastien Pasche, sebastien.pasche@leshop.ch
+#     Raphael Anthamatten  raphael.anthamatten@leshop.ch
+#
+# Permission is hereby granted, free of charge, to any person obtaining a
+# copy of this software and associated documentation files (the "Software"),
+# to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.
+#
+
+"""
+Run the checks of many clusters in one process and submit the results as
+passive check results.
+
+The config file holds one section per cluster, named "cluster <host_name>"
+where host_name is the monitored host the results are attached to. Keys
+named after a check (cluster-status, min-docs, max-docs, heap, disk-io)
+enable it with the given options:
+
+    [cluster es-prod-a]
+    hostname = es-a.example.com
+    port = 9200
+    scheme = http
+    heap = --all-nodes -w 80 -c 90
+    disk-io = --all-nodes
+    cluster-status =
+    min-docs = --state-file /var/tmp/es-prod-a_min_docs.state
+"""
+
+author = "Sebastien Pasche"
+maintainer = "Sebastien Pasche"
+version = "0.0.1"
+
+import optparse
+import os
+import shlex
+import sys
+import time
+
+try:
+    import configparser
+except ImportError:
+    import ConfigParser as configparser
+
+
+#Ok try to load our directory to load the plugin utils.
+my_dir = os.path.dirname(__file__)
+sys.path.insert(0, my_dir)
+
+try:
+    from elasticsearch_checks import \
+        ElasticSearchCheckHelpers, ElasticSearchStatsHelpers, \
+        ElasticSearchConcurrentStatsHelpers, PassiveCheckResultHelpers, \
+        MetricSinkHelpers
+except ImportError:
+    print("ERROR : this plugin needs the local elasticsearch_checks lib. Please install it")
+    sys.exit(2)
+
+
+#DEFAULTS
+#--------
+CLUSTER_SECTION_PREFIX = 'cluster '
+DEFAULT_SERVICE_TEMPLATE = 'elasticsearch {check}'
+
+
+# OPT parsing
+# -----------
+parser = optparse.OptionParser(
+    "%prog [options]", version="%prog " + version)
+
+parser.add_option('-f', '--config',
+                  dest="config", default=None,
+                  help='Clusters and checks to run')
+parser.add_option('--command-file',
+                  dest="command_file", default=None,
+                  help='Submit results to this external command file')
+parser.add_option('--spool-dir',
+                  dest="spool_dir", default=None,
+                  help='Submit results as a file in this check result spool directory')
+parser.add_option('--service-template',
+                  dest="service_template", default=DEFAULT_SERVICE_TEMPLATE,
+                  help='Service description of a check result. Default : elasticsearch {check}')
+parser.add_option('--workers',
+                  dest="workers", type="int",
+                  default=ElasticSearchConcurrentStatsHelpers.DEFAULT_WORKERS,
+                  help='Number of checks running at once. Default : 16')
+parser.add_option('--per-cluster',
+                  dest="per_cluster", type="int",
+                  default=ElasticSearchConcurrentStatsHelpers.DEFAULT_PER_HOST,
+                  help='Number of checks running at once against a cluster. Default : 4')
+parser.add_option('--deadline',
+                  dest="deadline", type="int", default=None,
+                  help='Time given to all the checks, late ones are reported Unknown. In [s]. Default : no limit')
+parser.add_option('--debug',
+                  dest="debug", default=False, action="store_true",
+                  help='Enable debug')
+
+#add process parser, cached responses are shared by the checks of a cluster
+parser = ElasticSearchCheckHelpers.add_process_parser_options(parser)
+
+
+def load_checks(path, service_template):
+    """
+    Read the config file then parse the options of every check
+    :param path: config file path
+    :type path: str
+    :param service_template: service description format, gets the check name as check
+    :type service_template: str
+    :return: list of (host_name, service, check module, parsed options)
+    """
+    config = configparser.RawConfigParser()
+    if not config.read(path):
+        raise Exception('Can not read config file {f}'.format(f=path))
+
+    checks = []
+    for section in config.sections():
+        if not section.startswith(CLUSTER_SECTION_PREFIX):
+            continue
+        host_name = section[len(CLUSTER_SECTION_PREFIX):].strip()
+        connection = [
+            '-H', config.get(section, 'hostname'),
+            '-p', config.get(section, 'port') if config.has_option(section, 'port') else '9200',
+            '-s', config.get(section, 'scheme') if config.has_option(section, 'scheme') else 'http',
+        ]
+
+        for name in ElasticSearchCheckHelpers.CHECK_MODULES:
+            if not config.has_option(section, name):
+                continue
+            module = ElasticSearchCheckHelpers.check_module(name)
+            argv = connection + shlex.split(config.get(section, name))
+            try:
+                opts = module.parse_args(argv)
+            except SystemExit:
+                raise Exception('Invalid {c} options for {h}'.format(c=name, h=host_name))
+            #metrics are tagged with the monitored host unless told otherwise
+            if opts.metrics_cluster is None:
+                opts.metrics_cluster = host_name
+            checks.append((
+                host_name,
+                service_template.format(check=name),
+                module,
+                opts
+            ))
+
+    return checks
+
+
+def share_node_statistics(checks):
+    """
+    Make the node checks of a cluster ask its node stats with one request
+    :param checks: list of (host_name, service, check module, parsed options)
+    :type checks: list
+    """
+    for host_name, service, module, check_opts in checks:
+        ElasticSearchStatsHelpers.share_node_statistics(
+            scheme=check_opts.scheme,
+            hostname=check_opts.hostname,
+            port=check_opts.port,
+            node_id=getattr(check_opts, 'node_id', None) or '_all',
+            metrics=getattr(module, 'NODE_STATS_METRICS', None),
+            filter_path=getattr(module, 'NODE_STATS_FILTER_PATH', None)
+        )
+
+
+def timed_check(module, opts):
+    """
+    Run a check, keeping its start and finish times
+    :return: (state, output, start time, finish time)
+    """
+    start_time = time.time()
+    status, output = module.check(opts)
+    return status, output, start_time, time.time()
+
+
+if __name__ == '__main__':
+    # Ok first job : parse args
+    opts, args = parser.parse_args()
+    if args:
+        parser.error("Does not accept any argument.")
+    if opts.config is None:
+        parser.error("You must specify a config file.")
+
+    ElasticSearchCheckHelpers.apply_default_parser_options(opts, memory_cache=True)
+
+    try:
+        checks = load_checks(opts.config, opts.service_template)
+    except Exception as e:
+        print("Error: {m}".format(m=e))
+        sys.exit(3)
+    share_node_statistics(checks)
+
+    #checks of a cluster share its slots, so a cluster sees a few requests at once
+    jobs = dict(
+        (index, (
+            '{h}:{p}'.format(h=check_opts.hostname, p=check_opts.port),
+            lambda module=module, check_opts=check_opts: timed_check(module, check_opts)
+        ))
+        for index, (host_name, service, module, check_opts) in enumerate(checks)
+    )
+    start_time = time.time()
+    outcomes = ElasticSearchConcurrentStatsHelpers.run(
+        jobs,
+        workers=opts.workers,
+        per_host=opts.per_cluster,
+        deadline=opts.deadline
+    )
+
+    results = []
+    for index, (host_name, service, module, check_opts) in enumerate(checks):
+        outcome = outcomes[index]
+        if isinstance(outcome, Exception):
+            outcome = ('Unknown', "Unknown: {m}".format(m=outcome), start_time, time.time())
+        status, output, check_start, check_finish = outcome
+        results.append(PassiveCheckResultHelpers.CheckResult(
+            host_name, service, status, output, check_start, check_finish
+        ))
+
+    if opts.command_file:
+        PassiveCheckResultHelpers.write_command_file(opts.command_file, results)
+    if opts.spool_dir:
+        PassiveCheckResultHelpers.write_spool_file(opts.spool_dir, results)
+    if not (opts.command_file or opts.spool_dir):
+        sys.stdout.write(PassiveCheckResultHelpers.command_file_lines(results))
+
+    #every check queued its batch, the sinks write them together
+    MetricSinkHelpers.flush()
+    if opts.debug:
+        ElasticSearchStatsHelpers.print_debug_statistics()
+
+    #checks cut by the deadline may still be running, do not wait for them
+    sys.stdout.flush()
+    os._exit(0)
@@ -29,14 +29,441 @@ author = "Sebastien Pasche"
 maintainer = "Sebastien Pasche"
 version = "0.0.1"
 
+import array
 import collections
+import contextlib
+import decimal
+import errno
+import fcntl
+import fnmatch
+import functools
+import hashlib
+import importlib
+import json
+import os
+import socket
+import sys
+import tempfile
+import threading
 import time
 
-from requests import Request, Session
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+try:
+    from urllib.parse import urlencode, urlparse
+except ImportError:
+    from urllib import urlencode
+    from urlparse import urlparse
+
 from pprint import pprint
 
+# requests is only imported once a query is sent, it weighs more than the
+# rest of the check startup and cached or daemon served checks never need it
+
+#Linux CLOCK_MONOTONIC, for python 2 which has no time.monotonic
+CLOCK_MONOTONIC = 1
+
+
+def _monotonic_clock():
+    """
+    Get a clock which never goes back, unlike the wall clock
+    Python 2 reads clock_gettime through ctypes on Linux. Only where neither
+    is available the wall clock is used.
+    :return: callable returning a time in [s]
+    """
+    if hasattr(time, 'monotonic'):
+        return time.monotonic
+    if not sys.platform.startswith('linux'):
+        return time.time
+
+    try:
+        import ctypes
+        import ctypes.util
+
+        class timespec(ctypes.Structure):
+            _fields_ = [('tv_sec', ctypes.c_long), ('tv_nsec', ctypes.c_long)]
+
+        librt = ctypes.CDLL(ctypes.util.find_library('rt') or 'librt.so.1', use_errno=True)
+        clock_gettime = librt.clock_gettime
+        clock_gettime.argtypes = [ctypes.c_int, ctypes.POINTER(timespec)]
+    except (ImportError, OSError, AttributeError):
+        return time.time
+
+    def clock_monotonic():
+        now = timespec()
+        if clock_gettime(CLOCK_MONOTONIC, ctypes.byref(now)) != 0:
+            raise OSError(ctypes.get_errno(), 'clock_gettime failed')
+        return now.tv_sec + now.tv_nsec * 1e-9
+
+    try:
+        clock_monotonic()
+    except OSError:
+        return time.time
+    return clock_monotonic
+
+
+monotonic = _monotonic_clock()
+
+
+class DeadlineExceeded(Exception):
+    """
+        The time budget of a query ran out
+    """
+
+
+class SampleTime(collections.namedtuple('SampleTime', ['sent', 'received'])):
+    """
+        Monotonic times at which a sample request went out and its response came back
+    """
+    __slots__ = ()
+
+    @property
+    def timestamp(self):
+        """
+        Best estimate of the instant the sample was taken on the server
+        :return: middle of the request round trip
+        """
+        return (self.sent + self.received) / 2.0
+
+
+class RateAnalytics(collections.namedtuple('RateAnalytics', [
+        'slope', 'mean', 'min', 'max', 'p10', 'p50', 'p90', 'stalled'])):
+    """
+        Rates of a counter over a sampled series, per [s]
+        slope is the least squares fit of the counter against time, mean the
+        overall increase over the elapsed time, min to p90 describe the rates
+        between consecutive samples and stalled is the longest time in [s]
+        the counter did not grow faster than the stall rate.
+    """
+    __slots__ = ()
+
+
+class JsonPathExtractor(object):
+    """
+        Keeps the parts of a JSON document matching filter_path like patterns,
+        dotted keys where * matches any key and arrays are gone through.
+        Works on a decoded document, or on the events of an incremental
+        parser so the rest of the document is never built.
+    """
+
+    #incremental parser backends, fastest first
+    IJSON_BACKENDS = ['yajl2_c', 'yajl2_cffi', 'yajl2', 'python']
+    _ijson_module = None
+
+    def __init__(self, paths):
+        """
+        :param paths: dotted paths to keep, such as nodes.*.jvm.mem.heap_used_percent
+        :type paths: list
+        """
+        self.patterns = [path.split('.') for path in paths]
+
+    @classmethod
+    def ijson(
+            cls
+    ):
+        """
+        :return: fastest ijson backend installed, None when ijson is not installed
+        """
+        if cls._ijson_module is None:
+            cls._ijson_module = False
+            for backend in cls.IJSON_BACKENDS:
+                try:
+                    cls._ijson_module = importlib.import_module('ijson.backends.' + backend)
+                    break
+                except ImportError:
+                    continue
+        return cls._ijson_module or None
+
+    @classmethod
+    def _matching(
+            cls,
+            key,
+            patterns
+    ):
+        """
+        :return: what is left of the patterns whose first key matches key
+        """
+        return [
+            pattern[1:] for pattern in patterns
+            if pattern[0] == key or ('*' in pattern[0] and fnmatch.fnmatchcase(key, pattern[0]))
+        ]
+
+    def extract(self, document):
+        """
+        :param document: decoded JSON document
+        :return: matching parts of the document, {} when nothing matches
+        """
+        kept = self._extract_value(document, self.patterns)
+        return {} if kept is None else kept
+
+    def _extract_value(self, value, patterns):
+        if any(not pattern for pattern in patterns):
+            return value
+        if isinstance(value, dict):
+            kept = {}
+            for key, item in value.items():
+                sub_patterns = self._matching(key, patterns)
+                if sub_patterns:
+                    item = self._extract_value(item, sub_patterns)
+                    if item is not None:
+                        kept[key] = item
+            return kept or None
+        if isinstance(value, list):
+            kept = [item for item in (self._extract_value(item, patterns) for item in value) if item is not None]
+            return kept or None
+        return None
+
+    def extract_stream(self, stream, buf_size=65536):
+        """
+        Parse a JSON document incrementally, keeping only the matching parts
+        :param stream: file like object the document is read from
+        :param buf_size: bytes read at once
+        :type buf_size: int
+        :return: matching parts of the document, {} when nothing matches
+        """
+        ijson = self.ijson()
+        if ijson is None:
+            raise Exception('Streaming JSON extraction needs the ijson module')
+        events = ijson.basic_parse(stream, buf_size=buf_size)
+        event, value = next(events)
+        kept = self._extract_events(events, event, value, self.patterns)
+        return {} if kept is None else kept
+
+    def _extract_events(self, events, event, value, patterns):
+        """
+        Consume the events of the value starting with (event, value)
+        :return: its matching parts, None when nothing matches
+        """
+        if any(not pattern for pattern in patterns):
+            return self._build(events, event, value)
+        if event == 'start_map':
+            kept = {}
+            for event, key in events:
+                if event == 'end_map':
+                    break
+                sub_patterns = self._matching(key, patterns)
+                event, value = next(events)
+                if sub_patterns:
+                    item = self._extract_events(events, event, value, sub_patterns)
+                    if item is not None:
+                        kept[key] = item
+                else:
+                    self._skip(events, event)
+            return kept or None
+        if event == 'start_array':
+            kept = []
+            for event, value in events:
+                if event == 'end_array':
+                    break
+                item = self._extract_events(events, event, value, patterns)
+                if item is not None:
+                    kept.append(item)
+            return kept or None
+        return None
+
+    @classmethod
+    def _build(cls, events, event, value):
+        """
+        Build the whole value starting with (event, value)
+        """
+        if event == 'start_map':
+            built = {}
+            for event, key in events:
+                if event == 'end_map':
+                    return built
+                event, value = next(events)
+                built[key] = cls._build(events, event, value)
+        if event == 'start_array':
+            built = []
+            for event, value in events:
+                if event == 'end_array':
+                    return built
+                built.append(cls._build(events, event, value))
+        if isinstance(value, decimal.Decimal):
+            return float(value)
+        return value
+
+    @classmethod
+    def _skip(cls, events, event):
+        """
+        Consume the events of the value starting with event
+        """
+        if event not in ('start_map', 'start_array'):
+            return
+        depth = 1
+        for event, value in events:
+            if event in ('start_map', 'start_array'):
+                depth += 1
+            elif event in ('end_map', 'end_array'):
+                depth -= 1
+                if not depth:
+                    return
+
+
+class TimedReader(object):
+    """
+        File like view of a response body counting the bytes read and the
+        time spent waiting for them
+    """
+
+    def __init__(self, raw):
+        self.raw = raw
+        self.nb_bytes = 0
+        self.elapsed = 0
+
+    def read(self, size=-1):
+        start = monotonic()
+        data = self.raw.read(size) if size is not None and size >= 0 else self.raw.read()
+        self.elapsed += monotonic() - start
+        self.nb_bytes += len(data)
+        return data
+
+
+class TimedConnectionMixin(object):
+    """
+        Reports the time spent opening a connection, then in the TLS handshake
+        when handshake_phase is set, to the phase timings of the current thread
+    """
+    handshake_phase = None
+
+    def _new_conn(self):
+        start = monotonic()
+        conn = super(TimedConnectionMixin, self)._new_conn()
+        self._connect_time = monotonic() - start
+        ElasticSearchStatsHelpers.add_phase_time('connect', self._connect_time)
+        return conn
+
+    def connect(self):
+        self._connect_time = 0
+        start = monotonic()
+        super(TimedConnectionMixin, self).connect()
+        if self.handshake_phase:
+            ElasticSearchStatsHelpers.add_phase_time(
+                self.handshake_phase,
+                monotonic() - start - self._connect_time
+            )
+
+
 class ElasticSearchCheckHelpers(object):
 
+    #check name -> module implementing it
+    CHECK_MODULES = collections.OrderedDict([
+        ('cluster-status', 'check_elasticsearch_http_cluster_status'),
+        ('min-docs', 'check_elasticsearch_http_min_indexed_docs'),
+        ('max-docs', 'check_elasticsearch_http_max_indexed_docs'),
+        ('heap', 'check_elasticsearch_node_percentage_heap_used'),
+        ('disk-io', 'check_elasticsearch_node_disk_io_op'),
+    ])
+
+    @classmethod
+    def check_module(
+            cls,
+            name
+    ):
+        """
+        Import the module of a check, exposing parse_args(argv) and check(opts)
+        :param name: check name, one of CHECK_MODULES
+        :type name: str
+        :return: check module
+        """
+        if name not in cls.CHECK_MODULES:
+            raise Exception('Unknown check {n}, choose one of {c}'.format(
+                n=name,
+                c=', '.join(cls.CHECK_MODULES)
+            ))
+        return importlib.import_module(cls.CHECK_MODULES[name])
+
+    @classmethod
+    def run_check(
+            cls,
+            name,
+            argv,
+            prog=None
+    ):
+        """
+        Run a check as its script would, only its module gets imported
+        :param name: check name, one of CHECK_MODULES
+        :type name: str
+        :param argv: check arguments
+        :type argv: list
+        :param prog: program name shown in usage messages
+        :type prog: str
+        :return: (state, output string)
+        """
+        module = cls.check_module(name)
+        if prog is not None:
+            module.parser.prog = prog
+        opts = module.parse_args(argv)
+        cls.apply_default_parser_options(opts)
+        return module.check(opts)
+
+    @classmethod
+    def check_name(
+            cls,
+            path
+    ):
+        """
+        Get the check name of a check script
+        :param path: check script or module path
+        :type path: str
+        :return: name in CHECK_MODULES, the module name for other scripts
+        """
+        module = os.path.splitext(os.path.basename(path))[0]
+        for name, check_module in cls.CHECK_MODULES.items():
+            if check_module == module:
+                return name
+        return module
+
+    @classmethod
+    def timed_check(
+            cls,
+            check
+    ):
+        """
+        Decorate the check function of a script so it runs within --timeout
+        with the hedging policy of its options, and the time spent in every
+        query phase is measured, then added to its perf data on --phase-perfdata
+        The metrics recorded by the check are handed to the metric sinks
+        as one batch, with its state and duration.
+        :param check: function taking the parsed options, returning (state, output string)
+        :type check: callable
+        :return: decorated check function
+        """
+        #the script may run as __main__, its file tells which check it is
+        check_name = cls.check_name(check.__code__.co_filename)
+
+        @functools.wraps(check)
+        def timed(opts):
+            timings = ElasticSearchStatsHelpers.start_phase_timings()
+            MetricSinkHelpers.start_batch([
+                ('cluster', getattr(opts, 'metrics_cluster', None) or (opts.hostname or '').split(',')[0]),
+                ('check', check_name)
+            ])
+            start = monotonic()
+            with ElasticSearchStatsHelpers.deadline(getattr(opts, 'timeout', None)), \
+                    ElasticSearchStatsHelpers.hedging(
+                        delay=getattr(opts, 'hedge_delay', None),
+                        state_file=getattr(opts, 'hedge_state_file', None)
+                    ):
+                status, output = check(opts)
+            timings['total'] = monotonic() - start
+            MetricSinkHelpers.record('check_state', OutputFormatHelpers.EXIT_CODES[status])
+            MetricSinkHelpers.record('check_duration_seconds', timings['total'])
+            MetricSinkHelpers.submit_batch()
+            if getattr(opts, 'phase_perfdata', False):
+                if '|' not in output:
+                    output = output.rstrip() + ' |'
+                output += ''.join(
+                    ' {s} '.format(s=data)
+                    for data in OutputFormatHelpers.phase_perf_data_strings(timings)
+                )
+            return status, output
+
+        return timed
+
     @classmethod
     def add_default_parser_options(
             cls,
@@ -44,7 +471,7 @@ class ElasticSearchCheckHelpers(object):
     ):
         parser.add_option('-H', '--hostname',
                           dest="hostname",
-                          help='Hostname to connect to')
+                          help='Hostname to connect to, or comma separated seed hosts queries are hedged across, each host[:port]')
         parser.add_option('-p', '--port',
                           dest="port", type="int", default=9200,
                           help='ElasticSearch HTTP port to connect to. Default : HTTPS - 9200')
@@ -54,6 +481,126 @@ class ElasticSearchCheckHelpers(object):
         parser.add_option('--debug',
                           dest="debug", default=False, action="store_true",
                           help='Enable debug')
+        parser.add_option('--phase-perfdata',
+                          dest="phase_perfdata", default=False, action="store_true",
+                          help='Add the time spent in every query phase to the perf data')
+        parser.add_option('--timeout',
+                          dest="timeout", type="float", default=None,
+                          help='Time given to the whole check, its queries and sampling waits. In [s]. Default : no limit')
+        parser.add_option('--hedge-delay',
+                          dest="hedge_delay", type="float", default=None,
+                          help='Send a query to the next seed host when the previous ones did not answer in this time. In [s]. Default : 0.5 [s]')
+        parser.add_option('--hedge-state-file',
+                          dest="hedge_state_file", default=None,
+                          help='Learn the query latency across runs in this file, then hedge after its 95th percentile')
+        parser.add_option('--metrics-cluster',
+                          dest="metrics_cluster", default=None,
+                          help='Cluster tag of the metrics sent to the metric sinks. Default : the first seed host')
+
+        return cls.add_process_parser_options(parser)
+
+    @classmethod
+    def add_process_parser_options(
+            cls,
+            parser
+    ):
+        parser.add_option('--pool-size',
+                          dest="pool_size", type="int",
+                          default=ElasticSearchStatsHelpers.DEFAULT_POOL_SIZE,
+                          help='Number of keep-alive connections kept per host. Default : 10')
+        parser.add_option('--stream-json',
+                          dest="stream_json", default=False, action="store_true",
+                          help='Parse responses as they arrive and keep only the fields the check uses, with ijson when installed')
+        parser.add_option('--no-compression',
+                          dest="no_compression", default=False, action="store_true",
+                          help='Ask for uncompressed responses, by default gzip or deflate are accepted')
+        parser.add_option('--cache-dir',
+                          dest="cache_dir", default=None,
+                          help='Share responses between check processes through this directory. Default : no cache')
+        parser.add_option('--cache-ttl',
+                          dest="cache_ttl", type="int", default=None,
+                          help='Cached responses lifetime for every endpoint. In [s]. Default : per endpoint')
+        parser.add_option('--cache-max-size',
+                          dest="cache_max_size", type="int",
+                          default=ElasticSearchResponseCache.DEFAULT_MAX_SIZE,
+                          help='Cache directory size above which oldest responses are evicted. In [bytes]. Default : 67108864')
+        parser.add_option('--coalesce-timeout',
+                          dest="coalesce_timeout", type="int",
+                          default=ElasticSearchResponseCache.DEFAULT_COALESCE_TIMEOUT,
+                          help='Time to wait for the same request in flight in another process. In [s]. Default : 5 [s]')
+        parser.add_option('--graphite',
+                          dest="graphite", default=None,
+                          help='Send the metrics of every check run to this Graphite plaintext host[:port]')
+        parser.add_option('--influx-url',
+                          dest="influx_url", default=None,
+                          help='POST the metrics of every check run to this Influx write url, e.g. http://influx:8086/write?db=es')
+        parser.add_option('--prometheus-textfile',
+                          dest="prometheus_textfile", default=None,
+                          help='Write the metrics of the last check runs to this node-exporter textfile collector file')
+        parser.add_option('--metrics-prefix',
+                          dest="metrics_prefix", default=MetricSinkHelpers.DEFAULT_PREFIX,
+                          help='Prefix of the metric names sent to the metric sinks. Default : elasticsearch')
+        parser.add_option('--metrics-flush-timeout',
+                          dest="metrics_flush_timeout", type="float",
+                          default=MetricSinkHelpers.DEFAULT_FLUSH_TIMEOUT,
+                          help='Time a check process waits for the metric sinks once its result is out. In [s]. Default : 1 [s]')
+
+        return parser
+
+    @classmethod
+    def apply_default_parser_options(
+            cls,
+            opts,
+            memory_cache=False
+    ):
+        """
+        Configure the stats helpers from the parsed process options
+        :param opts: options returned by the parser
+        :type opts: optparse.Values
+        :param memory_cache: keep responses in memory, for long running processes
+        :type memory_cache: bool
+        """
+        ElasticSearchStatsHelpers.configure(
+            pool_size=opts.pool_size,
+            stream_json=opts.stream_json,
+            compression=not opts.no_compression
+        )
+        ElasticSearchResponseCache.configure(
+            directory=opts.cache_dir,
+            memory=memory_cache,
+            ttl=opts.cache_ttl,
+            max_size=opts.cache_max_size,
+            coalesce_timeout=opts.coalesce_timeout
+        )
+        MetricSinkHelpers.configure(
+            graphite=opts.graphite,
+            influx_url=opts.influx_url,
+            prometheus_textfile=opts.prometheus_textfile,
+            prefix=opts.metrics_prefix,
+            flush_timeout=opts.metrics_flush_timeout,
+            debug=opts.debug
+        )
+
+    @classmethod
+    def add_state_parser_options(
+            cls,
+            parser
+    ):
+        parser.add_option('--state-file',
+                          dest="state_file", default=None,
+                          help='Compute rates against the previous run saved in this file instead of sampling')
+        parser.add_option('--state-max-age',
+                          dest="state_max_age", type="int",
+                          default=ElasticSearchStateHelpers.DEFAULT_MAX_AGE,
+                          help='Previous run older than this is ignored. In [s]. Default : 3600 [s]')
+        parser.add_option('--state-min-interval',
+                          dest="state_min_interval", type="int",
+                          default=ElasticSearchStateHelpers.DEFAULT_MIN_INTERVAL,
+                          help='Previous run younger than this is not used for rates. In [s]. Default : 1 [s]')
+        parser.add_option('--state-history',
+                          dest="state_history", type="int",
+                          default=ElasticSearchStateHelpers.DEFAULT_HISTORY,
+                          help='Number of runs, this one included, rates are computed over. Default : 2')
 
         return parser
 
@@ -66,336 +613,3269 @@ class ElasticSearchStatsHelpers(object):
     URI_TEMPLATE = "{scheme}://{host}:{port}{url}"
     URL_NODE_STATS_TEMPLATE = "/_nodes/{node_id}/stats"
     URL_CLUSTER_STATS_TEMPLATE = "/_cluster/stats"
+    #answered from the master cluster state, no fan out to the nodes
+    URL_CLUSTER_HEALTH = "/_cluster/health"
+    #docs section of the index stats only
+    URL_DOCS_STATS = "/_stats/docs"
+
+    #cluster colours, worst first
+    HEALTH_STATUSES = ['red', 'yellow', 'green']
+    #a health long-poll answers 408 when its wait times out
+    DEFAULT_LONG_POLL_TIMEOUT = 30
+    LONG_POLL_MARGIN = 5
+
+    #connection pool, shared by every query of the process
+    DEFAULT_POOL_SIZE = 10
+    _pool_size = DEFAULT_POOL_SIZE
+    #parse responses incrementally, keeping only their filter_path
+    _stream_json = False
+    #node stats asked once for all the checks of a cluster, by (scheme, hostname, port, node_id)
+    _node_statistics_shares = {}
+    _sessions = {}
+    _sessions_lock = threading.Lock()
+    _connection_statistics = {
+        'new': 0,
+        'reused': 0
+    }
+    #queries of many threads count their connections at once
+    _connection_statistics_lock = threading.Lock()
+    #bytes are counted on the wire, before the response is decompressed,
+    #then once decompressed
+    _transfer_statistics = {
+        'requests': 0,
+        'bytes': 0,
+        'decoded_bytes': 0
+    }
+    #the last requests, one Transfer each
+    TRANSFER_LOG_SIZE = 100
+    Transfer = collections.namedtuple(
+        'Transfer',
+        ['uri', 'encoding', 'bytes', 'decoded_bytes', 'decode_time']
+    )
+    _transfer_log = collections.deque(maxlen=TRANSFER_LOG_SIZE)
+    _transfer_lock = threading.Lock()
+    #ask for gzip or deflate compressed responses
+    _compression = True
+
+    #hedging across seed hosts, the learned delay needs enough past latencies
+    DEFAULT_HEDGE_DELAY = 0.5
+    HEDGE_PERCENTILE = 95
+    HEDGE_HISTORY = 100
+    HEDGE_MIN_HISTORY = 20
+    _hedge_statistics = {
+        'hedged': 0,
+        'won': 0
+    }
+    #queries of many threads hedge at once
+    _hedge_statistics_lock = threading.Lock()
+
+    #query phases timed in each thread, in their order of occurence
+    PHASES = ['connect', 'tls', 'wait', 'download', 'decode', 'sleep', 'cache', 'total']
+    _timed_connection_classes = {}
+
+    #details about the last query of each thread
+    _last_query = threading.local()
+    #query settings of each thread
+    _context = threading.local()
 
     @classmethod
-    def _cluster_statistics_uri(
+    def configure(
             cls,
-            scheme='http',
-            hostname='127.0.0.1',
-            port=9200
+            pool_size=DEFAULT_POOL_SIZE,
+            stream_json=False,
+            compression=True
     ):
         """
-        Generate cluster stats uri from params
-        :param scheme: HTTP scheme to use
-        :type scheme: str
-        :param hostname: Hostname where to execute the query
-        :type hostname: str
-        :param port: Port to connect to
-        :type port : int
-        :return: Complete query as a string
+        Configure the shared connection pool and the response parsing
+        :param pool_size: Number of keep-alive connections kept per host
+        :type pool_size: int
+        :param stream_json: parse responses incrementally, keeping only their filter_path
+        :type stream_json: bool
+        :param compression: ask for gzip or deflate compressed responses
+        :type compression: bool
         """
-        url = cls.URL_CLUSTER_STATS_TEMPLATE
-        uri = cls.URI_TEMPLATE.format(
-            scheme=scheme,
-            host=hostname,
-            port=port,
-            url=url
-        )
-        return uri
+        if pool_size < 1:
+            raise Exception('Pool size must be at least 1')
 
+        if pool_size != cls._pool_size:
+            cls.close_sessions()
+        cls._pool_size = pool_size
+        cls._stream_json = stream_json
+        cls._compression = compression
 
     @classmethod
-    def _node_statistics_uri(
+    def close_sessions(
+            cls
+    ):
+        """
+        Close every pooled session and forget them
+        """
+        for session in cls._sessions.values():
+            session.close()
+        cls._sessions.clear()
+
+    @classmethod
+    def _session(
             cls,
-            scheme='http',
-            hostname='127.0.0.1',
-            port=9200,
-            node_id='127.0.0.1'
+            uri
     ):
         """
-        Generate node stats uri from params
-        :param scheme: HTTP scheme to use
-        :type scheme: str
-        :param hostname: Hostname where to execute the query
-        :type hostname: str
-        :param port: Port to connect to
-        :type port : int
-        :param node_id: target node id
-        :type node_id : str
-        :type port : int
-        :return: Complete query as a string
+        Get the keep-alive session dedicated to the (scheme, host, port) of an uri
+        :param uri: complete uri to query
+        :type uri: str
+        :return: pooled requests Session
         """
-        url = cls.URL_NODE_STATS_TEMPLATE.format(node_id=node_id)
-        uri = cls.URI_TEMPLATE.format(
-            scheme=scheme,
-            host=hostname,
-            port=port,
-            url=url
+        parsed = urlparse(uri)
+        port = parsed.port or (443 if parsed.scheme == 'https' else 80)
+        key = (parsed.scheme, parsed.hostname, port)
+
+        with cls._sessions_lock:
+            session = cls._sessions.get(key)
+            if session is None:
+                from requests import Session
+                from requests.adapters import HTTPAdapter
+                adapter = HTTPAdapter(
+                    pool_connections=1,
+                    pool_maxsize=cls._pool_size
+                )
+                session = Session()
+                session.headers['Connection'] = 'keep-alive'
+                session.mount('{s}://'.format(s=parsed.scheme), adapter)
+                cls._sessions[key] = session
+
+        return session
+
+    @classmethod
+    def connection_statistics(
+            cls
+    ):
+        """
+        Get the number of new and reused connections since process start
+        :return: dict with 'new' and 'reused' counters
+        """
+        with cls._connection_statistics_lock:
+            return dict(cls._connection_statistics)
+
+    @classmethod
+    def transfer_statistics(
+            cls
+    ):
+        """
+        Get the number of requests and response body bytes since process start
+        :return: dict with 'requests', 'bytes' as transferred and 'decoded_bytes' counters
+        """
+        with cls._transfer_lock:
+            return dict(cls._transfer_statistics)
+
+    @classmethod
+    def transfer_log(
+            cls
+    ):
+        """
+        Get the accounting of the last requests of the process
+        :return: list of Transfer, oldest first
+        """
+        with cls._transfer_lock:
+            return list(cls._transfer_log)
+
+    @classmethod
+    def _compressed(
+            cls,
+            uri,
+            filter_path=None
+    ):
+        """
+        Tell if a query is worth a compressed response
+        Responses of a bounded size, the cluster health or a filter_path
+        without wildcard, are a few dozen bytes the gzip header and
+        trailer would make bigger.
+        :param uri: complete uri to query
+        :type uri: str
+        :param filter_path: filter_path of the query
+        :type filter_path: list
+        :return: bool
+        """
+        if not cls._compression:
+            return False
+        if urlparse(uri).path == cls.URL_CLUSTER_HEALTH:
+            return False
+        return not filter_path or any('*' in path for path in filter_path)
+
+    @classmethod
+    def _record_transfer(
+            cls,
+            transfer
+    ):
+        with cls._transfer_lock:
+            cls._transfer_log.append(transfer)
+            cls._transfer_statistics['requests'] += 1
+            cls._transfer_statistics['bytes'] += transfer.bytes
+            cls._transfer_statistics['decoded_bytes'] += transfer.decoded_bytes
+
+    @classmethod
+    @contextlib.contextmanager
+    def request_timeout(
+            cls,
+            timeout
+    ):
+        """
+        Bound the queries of the current thread
+        :param timeout: time in [s] to connect and to wait for the response, None for no limit
+        :type timeout: float
+        """
+        previous = getattr(cls._context, 'timeout', None)
+        cls._context.timeout = timeout
+        try:
+            yield
+        finally:
+            cls._context.timeout = previous
+
+    @classmethod
+    @contextlib.contextmanager
+    def deadline(
+            cls,
+            timeout
+    ):
+        """
+        Bound the queries and sampling waits of the current thread as a whole
+        An enclosing deadline closer than this one still applies.
+        :param timeout: time in [s] from now, None for no limit
+        :type timeout: float
+        """
+        previous = getattr(cls._context, 'deadline', None)
+        if timeout is not None:
+            end = monotonic() + timeout
+            if previous is None or end < previous:
+                cls._context.deadline = end
+        try:
+            yield
+        finally:
+            cls._context.deadline = previous
+
+    @classmethod
+    def remaining_time(
+            cls
+    ):
+        """
+        Time left before the deadline of the current thread
+        :return: time in [s], negative once passed, None without deadline
+        """
+        end = getattr(cls._context, 'deadline', None)
+        if end is None:
+            return None
+        return end - monotonic()
+
+    @classmethod
+    def last_response_age(
+            cls
+    ):
+        """
+        Age of the response returned by the last query of this thread
+        :return: time in [s] since the response was received from elasticsearch,
+        0 when it was not served from the cache
+        """
+        return getattr(cls._last_query, 'age', 0)
+
+    @classmethod
+    def start_phase_timings(
+            cls
+    ):
+        """
+        Start timing the query phases of the current thread from zero
+        :return: dict phase -> time in [s], filled by the following queries
+        """
+        cls._context.timings = collections.OrderedDict(
+            (phase, 0.0) for phase in cls.PHASES
+        )
+        return cls._context.timings
+
+    @classmethod
+    def add_phase_time(
+            cls,
+            phase,
+            duration
+    ):
+        """
+        Account time to a query phase of the current thread, if it is timed
+        :param phase: one of PHASES
+        :type phase: str
+        :param duration: time in [s]
+        :type duration: float
+        """
+        timings = getattr(cls._context, 'timings', None)
+        if timings is not None:
+            timings[phase] += duration
+
+    @classmethod
+    @contextlib.contextmanager
+    def _timed(
+            cls,
+            phase
+    ):
+        """
+        Account the time spent in the block to a query phase
+        """
+        start = monotonic()
+        try:
+            yield
+        finally:
+            cls.add_phase_time(phase, monotonic() - start)
+
+    @classmethod
+    def _time_connections(
+            cls,
+            pool
+    ):
+        """
+        Make the connections of an urllib3 pool report their connect and TLS times
+        :param pool: connection pool serving a query
+        """
+        base = pool.ConnectionCls
+        if issubclass(base, TimedConnectionMixin):
+            return
+
+        timed = cls._timed_connection_classes.get(base)
+        if timed is None:
+            timed = type('Timed' + base.__name__, (TimedConnectionMixin, base), {
+                'handshake_phase': 'tls' if pool.scheme == 'https' else None
+            })
+            cls._timed_connection_classes[base] = timed
+        pool.ConnectionCls = timed
+
+    @classmethod
+    @contextlib.contextmanager
+    def hedging(
+            cls,
+            delay=None,
+            state_file=None
+    ):
+        """
+        Set the hedging policy of the queries of the current thread
+        The delay is the 95th percentile of the latencies learned in state_file
+        once it holds enough of them, else the given delay. Latencies of the
+        hedged queries are added to state_file on exit.
+        :param delay: time in [s] before querying the next seed host, None for the default
+        :type delay: float
+        :param state_file: file keeping the latencies of previous runs, None to not learn
+        :type state_file: str
+        """
+        latencies = []
+        if state_file:
+            state = ElasticSearchStateHelpers.load(state_file) or {}
+            latencies = [
+                latency for latency in state.get('latencies', [])
+                if isinstance(latency, (int, float))
+            ]
+        if len(latencies) >= cls.HEDGE_MIN_HISTORY:
+            ranked = sorted(latencies)
+            delay = ranked[int(len(ranked) * cls.HEDGE_PERCENTILE / 100.0 + 0.5) - 1]
+        elif delay is None:
+            delay = cls.DEFAULT_HEDGE_DELAY
+
+        previous = getattr(cls._context, 'hedging', None)
+        cls._context.hedging = {'delay': delay, 'latencies': []}
+        try:
+            yield
+        finally:
+            learned = cls._context.hedging['latencies']
+            cls._context.hedging = previous
+            if state_file and learned:
+                with ElasticSearchStateHelpers.locked(state_file):
+                    state = ElasticSearchStateHelpers.load(state_file) or {}
+                    state['latencies'] = (state.get('latencies', []) + learned)[-cls.HEDGE_HISTORY:]
+                    ElasticSearchStateHelpers.save(state_file, state)
+
+    @classmethod
+    def hedge_statistics(
+            cls
+    ):
+        """
+        Get the number of hedged queries, and how many the hedge answered first
+        :return: dict with 'hedged' and 'won' counters
+        """
+        with cls._hedge_statistics_lock:
+            return dict(cls._hedge_statistics)
+
+    @classmethod
+    def _seed_hosts(
+            cls,
+            hostname,
+            port=9200
+    ):
+        """
+        :param hostname: host name, or comma separated seed hosts, each with an optional :port
+        :type hostname: str
+        :param port: port of the seed hosts giving none
+        :type port: int
+        :return: list of (host name, port), in the order they are queried
+        """
+        seeds = []
+        for seed in hostname.split(','):
+            seed = seed.strip()
+            if not seed:
+                continue
+            host, separator, seed_port = seed.rpartition(':')
+            #a bare IPv6 address has colons of its own, with a port it is in brackets
+            if separator and seed_port.isdigit() and (':' not in host or host.startswith('[')):
+                seeds.append((host, int(seed_port)))
+            else:
+                seeds.append((seed, port))
+        return seeds or [(hostname, port)]
+
+    @classmethod
+    def print_debug_statistics(
+            cls
+    ):
+        """
+        Print the process wide query statistics
+        """
+        print("Connection statistics")
+        print("---------------------")
+        pprint(cls.connection_statistics())
+        print("---------------------")
+        print("Transfer statistics")
+        print("-------------------")
+        pprint(cls.transfer_statistics())
+        print("-------------------")
+        hedge_statistics = cls.hedge_statistics()
+        if hedge_statistics['hedged']:
+            print("Hedge statistics")
+            print("----------------")
+            pprint(hedge_statistics)
+            print("----------------")
+        if ElasticSearchResponseCache.enabled():
+            print("Cache statistics")
+            print("----------------")
+            pprint(ElasticSearchResponseCache.statistics())
+            print("----------------")
+
+    @classmethod
+    def _query_string(
+            cls,
+            filter_path=None,
+            params=None
+    ):
+        """
+        Generate the query string of a stats uri
+        :param filter_path: response fields to keep, all when empty
+        :type filter_path: list
+        :param params: other query parameters
+        :type params: dict
+        :return: query string, empty or starting with '?'
+        """
+        query = []
+        if filter_path:
+            query.append('filter_path={f}'.format(f=','.join(filter_path)))
+        if params:
+            query.append(urlencode(sorted(params.items())))
+        if not query:
+            return ''
+        return '?' + '&'.join(query)
+
+    @classmethod
+    def _endpoint_uri(
+            cls,
+            url,
+            scheme='http',
+            hostname='127.0.0.1',
+            port=9200,
+            filter_path=None,
+            params=None
+    ):
+        """
+        Generate the uri of an endpoint taking no path parameter
+        :param url: endpoint path, such as /_cluster/health
+        :type url: str
+        :param params: query parameters other than filter_path
+        :type params: dict
+        :return: Complete query as a string
+        """
+        return cls.URI_TEMPLATE.format(
+            scheme=scheme,
+            host=hostname,
+            port=port,
+            url=url + cls._query_string(filter_path, params)
+        )
+
+
+    @classmethod
+    def _node_statistics_uri(
+            cls,
+            scheme='http',
+            hostname='127.0.0.1',
+            port=9200,
+            node_id='127.0.0.1',
+            metrics=None,
+            filter_path=None
+    ):
+        """
+        Generate node stats uri from params
+        :param scheme: HTTP scheme to use
+        :type scheme: str
+        :param hostname: Hostname where to execute the query
+        :type hostname: str
+        :param port: Port to connect to
+        :type port : int
+        :param node_id: target node id
+        :type node_id : str
+        :param metrics: metric groups to get (jvm, fs, ...), all when empty
+        :type metrics: list
+        :param filter_path: response fields to keep, all when empty
+        :type filter_path: list
+        :return: Complete query as a string
+        """
+        url = cls.URL_NODE_STATS_TEMPLATE.format(node_id=node_id)
+        if metrics:
+            url = '{u}/{m}'.format(u=url, m=','.join(metrics))
+        url += cls._query_string(filter_path)
+        uri = cls.URI_TEMPLATE.format(
+            scheme=scheme,
+            host=hostname,
+            port=port,
+            url=url
+        )
+        return uri
+
+
+    @classmethod
+    def cluster_statistics(
+            cls,
+            scheme='http',
+            hostname='127.0.0.1',
+            port=9200,
+            filter_path=None,
+            cache=True,
+            debug=False
+    ):
+        """
+        Get cluster stats from hostname
+        :param scheme: HTTP scheme to use
+        :type scheme: str
+        :param hostname: Hostname where to execute the query, or comma separated seed hosts
+        :type hostname: str
+        :param port: Port to connect to
+        :type port : int
+        :param filter_path: response fields to keep, all when empty
+        :type filter_path: list
+        :param cache: may the response come from the response cache
+        :type cache: bool
+        :param debug: is debug enabled
+        :type port : bool
+        :return: JSON stats
+        """
+        return cls._endpoint_statistics(
+            url=cls.URL_CLUSTER_STATS_TEMPLATE,
+            scheme=scheme,
+            hostname=hostname,
+            port=port,
+            filter_path=filter_path,
+            cache=cache,
+            debug=debug
+        )
+
+    @classmethod
+    def cluster_health(
+            cls,
+            scheme='http',
+            hostname='127.0.0.1',
+            port=9200,
+            filter_path=None,
+            cache=True,
+            debug=False
+    ):
+        """
+        Get the cluster health from hostname, status included
+        Unlike the cluster stats it does not ask every node for its stats.
+        :param hostname: Hostname where to execute the query, or comma separated seed hosts
+        :type hostname: str
+        :param filter_path: response fields to keep, all when empty
+        :type filter_path: list
+        :param cache: may the response come from the response cache
+        :type cache: bool
+        :return: JSON health
+        """
+        return cls._endpoint_statistics(
+            url=cls.URL_CLUSTER_HEALTH,
+            scheme=scheme,
+            hostname=hostname,
+            port=port,
+            filter_path=filter_path,
+            cache=cache,
+            debug=debug
+        )
+
+    @classmethod
+    def docs_statistics(
+            cls,
+            scheme='http',
+            hostname='127.0.0.1',
+            port=9200,
+            filter_path=None,
+            cache=True,
+            debug=False
+    ):
+        """
+        Get the docs stats of every index from hostname, _all.primaries.docs.count included
+        Only the docs section of the index stats is gathered.
+        :param hostname: Hostname where to execute the query, or comma separated seed hosts
+        :type hostname: str
+        :param filter_path: response fields to keep, all when empty
+        :type filter_path: list
+        :param cache: may the response come from the response cache
+        :type cache: bool
+        :return: JSON stats
+        """
+        return cls._endpoint_statistics(
+            url=cls.URL_DOCS_STATS,
+            scheme=scheme,
+            hostname=hostname,
+            port=port,
+            filter_path=filter_path,
+            cache=cache,
+            debug=debug
+        )
+
+    @classmethod
+    def wait_for_health(
+            cls,
+            status,
+            nb_nodes=None,
+            timeout=DEFAULT_LONG_POLL_TIMEOUT,
+            scheme='http',
+            hostname='127.0.0.1',
+            port=9200,
+            filter_path=None,
+            debug=False
+    ):
+        """
+        Long-poll the cluster health until it may have left status, or timeout goes by
+        The health API only waits for a colour at least as good as the one
+        asked, so red and yellow wait for the next better colour. Green can
+        not get better, it waits for a node to leave, the usual way out of
+        green. Any other change shows when the wait times out.
+        The long-poll is never cached nor hedged, a failing seed host is
+        replaced by the next one.
+        :param status: last known cluster colour, None to answer at once
+        :type status: str
+        :param nb_nodes: last known number of nodes
+        :type nb_nodes: int
+        :param timeout: longest wait in [s]
+        :type timeout: int
+        :param hostname: Hostname where to execute the query, or comma separated seed hosts
+        :type hostname: str
+        :param filter_path: response fields to keep, all when empty
+        :type filter_path: list
+        :return: JSON health, timed_out tells the wait ran out
+        """
+        params = {'timeout': '{t}s'.format(t=timeout)}
+        if status in cls.HEALTH_STATUSES[:-1]:
+            params['wait_for_status'] = cls.HEALTH_STATUSES[cls.HEALTH_STATUSES.index(status) + 1]
+        elif status == 'green' and nb_nodes:
+            params['wait_for_nodes'] = '<{n}'.format(n=nb_nodes)
+        else:
+            params = None
+
+        error = None
+        with cls.request_timeout(timeout + cls.LONG_POLL_MARGIN):
+            for host, host_port in cls._seed_hosts(hostname, port):
+                uri = cls._endpoint_uri(
+                    url=cls.URL_CLUSTER_HEALTH,
+                    scheme=scheme,
+                    hostname=host,
+                    port=host_port,
+                    filter_path=filter_path,
+                    params=params
+                )
+                try:
+                    return cls._send_query(uri, allowed_statuses=(408,), debug=debug)
+                except DeadlineExceeded:
+                    raise
+                except Exception as e:
+                    error = e
+        raise error
+
+    @classmethod
+    def _endpoint_statistics(
+            cls,
+            url,
+            scheme='http',
+            hostname='127.0.0.1',
+            port=9200,
+            filter_path=None,
+            cache=True,
+            debug=False
+    ):
+        """
+        Query an endpoint taking no parameter but filter_path
+        :param url: endpoint path, such as /_cluster/health
+        :type url: str
+        :return: JSON stats
+        """
+        uris = [
+            cls._endpoint_uri(
+                url=url,
+                scheme=scheme,
+                hostname=host,
+                port=host_port,
+                filter_path=filter_path
+            )
+            for host, host_port in cls._seed_hosts(hostname, port)
+        ]
+
+        stats =  cls._http_query(
+            uri=uris[0],
+            hedge_uris=uris[1:],
+            extract=filter_path,
+            cache=cache,
+            debug=debug
+        )
+
+        if debug:
+            print("Stats")
+            print("-----")
+            pprint(stats)
+            print("-----")
+
+        return stats
+
+    @classmethod
+    def share_node_statistics(
+            cls,
+            scheme='http',
+            hostname='127.0.0.1',
+            port=9200,
+            node_id='127.0.0.1',
+            metrics=None,
+            filter_path=None
+    ):
+        """
+        Ask the node stats of a cluster with the union of the metrics and
+        filter_path of every check of the process
+        A cached node_statistics query whose metrics and filter_path are
+        shared is sent as the union one, then pruned to its filter_path, so the
+        response cache answers every check with one request.
+        :param node_id: target node id
+        :type node_id: str
+        :param metrics: metric groups of a check
+        :type metrics: list
+        :param filter_path: response fields of a check
+        :type filter_path: list
+        """
+        if not metrics or not filter_path:
+            return
+        key = (scheme, hostname, port, node_id)
+        shared_metrics, shared_filter_path = cls._node_statistics_shares.get(key, ([], []))
+        cls._node_statistics_shares[key] = (
+            shared_metrics + [m for m in metrics if m not in shared_metrics],
+            shared_filter_path + [f for f in filter_path if f not in shared_filter_path]
+        )
+
+    @classmethod
+    def node_statistics(
+            cls,
+            scheme='http',
+            hostname='127.0.0.1',
+            port=9200,
+            node_id='127.0.0.1',
+            metrics=None,
+            filter_path=None,
+            cache=True,
+            debug=False
+    ):
+        """
+        Get cluster stats from hostname for a given node_id
+        :param scheme: HTTP scheme to use
+        :type scheme: str
+        :param hostname: Hostname where to execute the query, or comma separated seed hosts
+        :type hostname: str
+        :param port: Port to connect to
+        :type port : int
+        :param debug: is debug enabled
+        :type port : bool
+        :param node_id: target node_id
+        :type node_id: str
+        :param metrics: metric groups to get (jvm, fs, ...), all when empty
+        :type metrics: list
+        :param filter_path: response fields to keep, all when empty
+        :type filter_path: list
+        :param cache: may the response come from the response cache
+        :type cache: bool
+        :return:JSON stats
+        """
+        requested = filter_path
+        shared = cls._node_statistics_shares.get((scheme, hostname, port, node_id)) if cache else None
+        if shared and metrics and filter_path \
+                and set(metrics) <= set(shared[0]) and set(filter_path) <= set(shared[1]):
+            metrics, filter_path = shared
+
+        uris = [
+            cls._node_statistics_uri(
+                scheme=scheme,
+                hostname=host,
+                port=host_port,
+                node_id=node_id,
+                metrics=metrics,
+                filter_path=filter_path
+            )
+            for host, host_port in cls._seed_hosts(hostname, port)
+        ]
+
+        stats =  cls._http_query(
+            uri=uris[0],
+            hedge_uris=uris[1:],
+            extract=filter_path,
+            cache=cache,
+            debug=debug
+        )
+        if filter_path is not requested:
+            stats = JsonPathExtractor(requested).extract(stats)
+
+        if debug:
+            print("Stats")
+            print("-----")
+            pprint(stats)
+            print("-----")
+
+        return stats
+
+    @classmethod
+    def _http_query(
+            cls,
+            uri,
+            hedge_uris=(),
+            extract=None,
+            cache=True,
+            debug=False
+    ):
+        """
+        Execute the stats query then return the complete stats json object
+        :param url: complete url to query, the response is cached under it
+        :type url : str
+        :param hedge_uris: same query on the other seed hosts
+        :type hedge_uris: list
+        :param extract: filter_path of the query, kept on the client side too when streaming
+        :type extract: list
+        :param cache: may the response come from the response cache
+        :type cache: bool
+        :return: json object
+        """
+        cls._last_query.age = 0
+        if not (cache and ElasticSearchResponseCache.enabled()):
+            return cls._hedged_query([uri] + list(hedge_uris), extract=extract, debug=debug)
+
+        with cls._timed('cache'):
+            cached = ElasticSearchResponseCache.get(uri)
+        if cached is None:
+            #single flight: the first process to miss fetches the response,
+            #the others wait for it on the lock then find it in the cache
+            waiting = monotonic()
+            with ElasticSearchResponseCache.in_flight(uri, timeout=cls.remaining_time()) as held:
+                with cls._timed('cache'):
+                    cls.add_phase_time('cache', monotonic() - waiting)
+                    cached = ElasticSearchResponseCache.get(uri, coalesced=True)
+                if cached is None:
+                    if debug and not held:
+                        print("timeout while waiting for an in flight request")
+                    stats = cls._hedged_query([uri] + list(hedge_uris), extract=extract, debug=debug)
+                    with cls._timed('cache'):
+                        ElasticSearchResponseCache.put(uri, stats)
+                    return stats
+
+        stats, cls._last_query.age = cached
+        if debug:
+            print("cache hit")
+            print("---------")
+            pprint(uri)
+            print("{a:.3f}s old".format(a=cls._last_query.age))
+            print("---------")
+        return stats
+
+    @classmethod
+    def _hedged_query(
+            cls,
+            uris,
+            extract=None,
+            debug=False
+    ):
+        """
+        Send a query to the first seed host, then to the next one each time
+        the hedge delay goes by without an answer, or right away on an error
+        The first response wins, the slower requests are left to finish on
+        their own.
+        :param uris: same query on every seed host, in the order to try them
+        :type uris: list
+        :param extract: filter_path of the query, kept on the client side too when streaming
+        :type extract: list
+        :return: json object
+        """
+        if len(uris) == 1:
+            return cls._send_query(uris[0], extract=extract, debug=debug)
+
+        #hedges run in their own threads, under the limits of this one
+        context = dict(
+            (name, getattr(cls._context, name, None))
+            for name in ('timeout', 'deadline')
+        )
+        #each hedge times its own phases, only the winner's are accounted
+        timings = getattr(cls._context, 'timings', None)
+        hedging = getattr(cls._context, 'hedging', None)
+        delay = hedging['delay'] if hedging else cls.DEFAULT_HEDGE_DELAY
+        responses = queue.Queue()
+
+        def send(index, uri):
+            for name, value in context.items():
+                setattr(cls._context, name, value)
+            cls._context.timings = None if timings is None else collections.OrderedDict(
+                (phase, 0.0) for phase in timings
+            )
+            try:
+                responses.put((index, cls._send_query(uri, extract=extract, debug=debug), None, cls._context.timings))
+            except Exception as e:
+                responses.put((index, None, e, cls._context.timings))
+
+        def hedge(index):
+            if debug and index:
+                print("hedging to {u}".format(u=uris[index]))
+            thread = threading.Thread(target=send, args=(index, uris[index]))
+            thread.daemon = True
+            thread.start()
+
+        start = monotonic()
+        hedge(0)
+        nb_sent, pending, error = 1, 1, None
+        while pending:
+            try:
+                if nb_sent < len(uris):
+                    index, stats, error, hedge_timings = responses.get(True, delay)
+                else:
+                    index, stats, error, hedge_timings = responses.get()
+            except queue.Empty:
+                hedge(nb_sent)
+                nb_sent, pending = nb_sent + 1, pending + 1
+                with cls._hedge_statistics_lock:
+                    cls._hedge_statistics['hedged'] += 1
+                continue
+
+            pending -= 1
+            if error is None:
+                if timings is not None:
+                    for phase, duration in hedge_timings.items():
+                        timings[phase] += duration
+                if index:
+                    with cls._hedge_statistics_lock:
+                        cls._hedge_statistics['won'] += 1
+                if hedging:
+                    hedging['latencies'].append(monotonic() - start)
+                return stats
+            if nb_sent < len(uris):
+                hedge(nb_sent)
+                nb_sent, pending = nb_sent + 1, pending + 1
+
+        raise error
+
+    @classmethod
+    def _send_query(
+            cls,
+            uri,
+            extract=None,
+            allowed_statuses=(),
+            debug=False
+    ):
+        """
+        Send the stats query to elasticsearch
+        :param uri: complete uri to query
+        :type uri : str
+        :param extract: filter_path of the query, kept on the client side too when streaming
+        :type extract: list
+        :param allowed_statuses: HTTP error statuses whose body is returned anyway
+        :type allowed_statuses: tuple
+        :return: json object
+        """
+        from requests import Request
+        from requests.exceptions import Timeout
+
+        #ask for stats
+        s = cls._session(uri)
+        req = Request(
+            method='GET',
+            url=uri,
+            headers={'Accept-Encoding': 'gzip, deflate' if cls._compressed(uri, extract) else 'identity'}
+        )
+        prepared_request = s.prepare_request(req)
+
+        if debug:
+            print("uri")
+            print("-------")
+            pprint(uri)
+            print("-------")
+
+        #the pool counts every connection it opens, so a request which
+        #did not increase the count went through a reused socket
+        pool = s.get_adapter(uri).get_connection(uri)
+        cls._time_connections(pool)
+        nb_connections = pool.num_connections
+
+        #connect and read timeouts come from what is left of the deadline
+        timeout = getattr(cls._context, 'timeout', None)
+        remaining = cls.remaining_time()
+        bounded_by_deadline = remaining is not None and (timeout is None or remaining < timeout)
+        if bounded_by_deadline:
+            if remaining <= 0:
+                raise DeadlineExceeded('Deadline reached before querying {u}'.format(u=uri))
+            timeout = remaining
+
+        #the response is streamed so the wait for the headers, the server
+        #time, is told apart from the body download
+        timings = getattr(cls._context, 'timings', None)
+        handshake = timings['connect'] + timings['tls'] if timings else 0
+        sent = monotonic()
+        try:
+            response = s.send(
+                prepared_request,
+                timeout=timeout,
+                stream=True
+            )
+        except Timeout:
+            if bounded_by_deadline:
+                raise DeadlineExceeded('Deadline reached while querying {u}'.format(u=uri))
+            raise
+        headers_received = monotonic()
+        if timings:
+            handshake = timings['connect'] + timings['tls'] - handshake
+        cls.add_phase_time('wait', headers_received - sent - handshake)
+
+        #streamed responses are parsed as they are downloaded, elasticsearch
+        #versions ignoring filter_path do not make the check build the whole
+        #document; without ijson the document is decoded then pruned
+        streamed = cls._stream_json and extract and response.ok
+        extractor = JsonPathExtractor(extract) if streamed else None
+        if streamed and extractor.ijson() is not None:
+            response.raw.decode_content = True
+            reader = TimedReader(response.raw)
+            decoding = monotonic()
+            stats = extractor.extract_stream(reader)
+            decode_time = monotonic() - decoding - reader.elapsed
+            cls.add_phase_time('download', reader.elapsed)
+            cls.add_phase_time('decode', decode_time)
+            content = None
+            nb_bytes = reader.nb_bytes
+        else:
+            content = response.content
+            cls.add_phase_time('download', monotonic() - headers_received)
+            nb_bytes = len(content)
+
+        with cls._connection_statistics_lock:
+            if pool.num_connections > nb_connections:
+                cls._connection_statistics['new'] += 1
+            else:
+                cls._connection_statistics['reused'] += 1
+
+        #check for http error
+        if response.status_code not in allowed_statuses:
+            response.raise_for_status()
+
+        #get the result back
+        if content is not None:
+            decoding = monotonic()
+            with cls._timed('decode'):
+                stats = response.json()
+                if extractor:
+                    stats = extractor.extract(stats)
+            decode_time = monotonic() - decoding
+
+        #the raw response counts the bytes read from the socket, before
+        #they are decompressed
+        transfer = cls.Transfer(
+            uri=uri,
+            encoding=response.headers.get('Content-Encoding', 'identity'),
+            bytes=response.raw.tell(),
+            decoded_bytes=nb_bytes,
+            decode_time=decode_time
+        )
+        cls._record_transfer(transfer)
+
+        if debug:
+            print("response")
+            print("---------")
+            pprint(response)
+            print("{n} bytes {e}, {d} bytes decoded{s}, decoded in {t:.4f}s".format(
+                n=transfer.bytes,
+                e=transfer.encoding,
+                d=transfer.decoded_bytes,
+                s=', streamed' if content is None else '',
+                t=transfer.decode_time
+            ))
+            print("---------")
+
+        return stats
+
+
+    @classmethod
+    def _sampled(
+            cls,
+            fetch,
+            sample_interval=1,
+            nb_sample=5,
+            settled=None
+    ):
+        """
+        Call fetch at fixed deadlines of a monotonic clock
+        Request latency does not shift the following deadlines and no time is
+        spent waiting after the last sample.
+        :param fetch: callable returning a JSON stats object
+        :type fetch: callable
+        :param sample_interval: time in [s] between two deadlines
+        :type sample_interval: int
+        :param nb_sample: Number of sample to get
+        :type nb_sample : int
+        :param settled: called with the samples so far from the second one on,
+        sampling stops early once it returns True
+        :type settled: callable
+        :return: list of (SampleTime, JSON stats) pairs
+        """
+        samples = []
+        start = monotonic()
+        for index in range(nb_sample):
+            delay = start + index * sample_interval - monotonic()
+            #do not wait for a sample the deadline would not let us take
+            remaining = cls.remaining_time()
+            if remaining is not None and remaining <= max(delay, 0):
+                raise DeadlineExceeded(cls._sampling_progress(samples, nb_sample, start))
+            if delay > 0:
+                with cls._timed('sleep'):
+                    time.sleep(delay)
+
+            sent = monotonic()
+            try:
+                payload = fetch()
+            except DeadlineExceeded:
+                raise DeadlineExceeded(cls._sampling_progress(samples, nb_sample, start))
+            received = monotonic()
+            samples.append((SampleTime(sent, received), payload))
+            if settled is not None and 1 < len(samples) < nb_sample and settled(samples):
+                break
+
+        return samples
+
+    @classmethod
+    def _sampling_progress(
+            cls,
+            samples,
+            nb_sample,
+            start
+    ):
+        return 'Deadline reached after {n} of {t} samples in {e:.2f}s'.format(
+            n=len(samples),
+            t=nb_sample,
+            e=monotonic() - start
+        )
+
+
+    @classmethod
+    def sampled_node_statistics(
+            cls,
+            scheme='http',
+            hostname='127.0.0.1',
+            port=9200,
+            node_id='127.0.0.1',
+            metrics=None,
+            filter_path=None,
+            sample_interval=1,
+            nb_sample=5,
+            settled=None,
+            debug=False
+    ):
+        """
+        Query sampled node stats
+        :param scheme: HTTP scheme to use
+        :type scheme: str
+        :param hostname: Hostname where to execute the query
+        :type hostname: str
+        :param port: Port to connect to
+        :type port : int
+        :param debug: is debug enabled
+        :type port : bool
+        :param node_id: target node_id
+        :type node_id: str
+        :param metrics: metric groups to get (jvm, fs, ...), all when empty
+        :type metrics: list
+        :param filter_path: response fields to keep, all when empty
+        :type filter_path: list
+        :param sample_interval: time in [s] between to probe
+        :type sample_interval: int
+        :param nb_sample: Number of sample to get
+        :type nb_sample : int
+        :param settled: called with the samples so far, sampling stops early once it returns True
+        :type settled: callable
+        :return: list of (SampleTime, JSON stats) pairs
+        """
+        return cls._sampled(
+            fetch=lambda: cls.node_statistics(
+                scheme=scheme,
+                hostname=hostname,
+                port=port,
+                node_id=node_id,
+                metrics=metrics,
+                filter_path=filter_path,
+                cache=False,
+                debug=debug
+            ),
+            sample_interval=sample_interval,
+            nb_sample=nb_sample,
+            settled=settled
+        )
+
+    @classmethod
+    def sampled_cluster_statistics(
+            cls,
+            scheme='http',
+            hostname='127.0.0.1',
+            port=9200,
+            filter_path=None,
+            sample_interval=1,
+            nb_sample=5,
+            settled=None,
+            debug=False
+    ):
+        """
+        Query sampled cluster stats
+        :param scheme: HTTP scheme to use
+        :type scheme: str
+        :param hostname: Hostname where to execute the query
+        :type hostname: str
+        :param port: Port to connect to
+        :type port : int
+        :param debug: is debug enabled
+        :type port : bool
+        :param filter_path: response fields to keep, all when empty
+        :type filter_path: list
+        :param sample_interval: time in [s] between to probe
+        :type sample_interval: int
+        :param nb_sample: Number of sample to get
+        :type nb_sample : int
+        :param settled: called with the samples so far, sampling stops early once it returns True
+        :type settled: callable
+        :return: list of (SampleTime, JSON stats) pairs
+        """
+        return cls._sampled(
+            fetch=lambda: cls.cluster_statistics(
+                scheme=scheme,
+                hostname=hostname,
+                port=port,
+                filter_path=filter_path,
+                cache=False,
+                debug=debug
+            ),
+            sample_interval=sample_interval,
+            nb_sample=nb_sample,
+            settled=settled
+        )
+
+    @classmethod
+    def sampled_docs_statistics(
+            cls,
+            scheme='http',
+            hostname='127.0.0.1',
+            port=9200,
+            filter_path=None,
+            sample_interval=1,
+            nb_sample=5,
+            settled=None,
+            debug=False
+    ):
+        """
+        Query sampled docs stats
+        :param filter_path: response fields to keep, all when empty
+        :type filter_path: list
+        :param sample_interval: time in [s] between to probe
+        :type sample_interval: int
+        :param nb_sample: Number of sample to get
+        :type nb_sample : int
+        :param settled: called with the samples so far, sampling stops early once it returns True
+        :type settled: callable
+        :return: list of (SampleTime, JSON stats) pairs
+        """
+        return cls._sampled(
+            fetch=lambda: cls.docs_statistics(
+                scheme=scheme,
+                hostname=hostname,
+                port=port,
+                filter_path=filter_path,
+                cache=False,
+                debug=debug
+            ),
+            sample_interval=sample_interval,
+            nb_sample=nb_sample,
+            settled=settled
+        )
+
+
+class ElasticSearchConcurrentStatsHelpers(object):
+    """
+        Run stats queries against many clusters or nodes concurrently on a
+        bounded pool of threads, results keep the ElasticSearchStatsHelpers shapes
+    """
+
+    DEFAULT_WORKERS = 16
+    DEFAULT_PER_HOST = 4
+
+    @classmethod
+    def run(
+            cls,
+            jobs,
+            workers=DEFAULT_WORKERS,
+            per_host=DEFAULT_PER_HOST,
+            timeout=None,
+            deadline=None
+    ):
+        """
+        Run jobs concurrently
+        :param jobs: dict key -> (host, callable without argument)
+        :type jobs: dict
+        :param workers: number of threads
+        :type workers: int
+        :param per_host: number of jobs running at once against a host
+        :type per_host: int
+        :param timeout: time in [s] given to each request, None for no limit
+        :type timeout: float
+        :param deadline: time in [s] given to all the jobs, None for no limit
+        :type deadline: float
+        :return: dict key -> job result, or the exception it raised
+        """
+        end = monotonic() + deadline if deadline is not None else None
+        tasks = queue.Queue()
+        for key, (host, job) in jobs.items():
+            tasks.put((key, host, job))
+
+        results = {}
+        finished = threading.Condition()
+        slots_lock = threading.Lock()
+        slots = {}
+
+        def worker():
+            while True:
+                try:
+                    key, host, job = tasks.get_nowait()
+                except queue.Empty:
+                    return
+
+                with slots_lock:
+                    slot = slots.setdefault(host, threading.Semaphore(per_host))
+                with slot:
+                    remaining = end - monotonic() if end is not None else None
+                    if remaining is not None and remaining <= 0:
+                        result = DeadlineExceeded('Deadline reached before querying {h}'.format(h=host))
+                    else:
+                        try:
+                            with ElasticSearchStatsHelpers.request_timeout(timeout), \
+                                    ElasticSearchStatsHelpers.deadline(remaining):
+                                result = job()
+                        except Exception as e:
+                            result = e
+
+                with finished:
+                    results[key] = result
+                    finished.notify()
+
+        for index in range(min(workers, len(jobs))):
+            thread = threading.Thread(target=worker)
+            thread.daemon = True
+            thread.start()
+
+        with finished:
+            while len(results) < len(jobs):
+                if end is None:
+                    finished.wait(1)
+                else:
+                    remaining = end - monotonic()
+                    if remaining <= 0:
+                        break
+                    finished.wait(remaining)
+
+            return dict(
+                (key, results.get(key, DeadlineExceeded('Deadline reached while querying {h}'.format(h=host))))
+                for key, (host, job) in jobs.items()
+            )
+
+    @classmethod
+    def _fan_out(
+            cls,
+            fetch,
+            targets,
+            run_options,
+            **fetch_options
+    ):
+        jobs = dict(
+            (key, (target['hostname'], functools.partial(fetch, **dict(fetch_options, **target))))
+            for key, target in targets.items()
+        )
+        return cls.run(jobs, **run_options)
+
+    @classmethod
+    def cluster_statistics(
+            cls,
+            targets,
+            filter_path=None,
+            debug=False,
+            **run_options
+    ):
+        """
+        Get cluster stats from many clusters
+        :param targets: dict key -> dict(scheme=, hostname=, port=)
+        :type targets: dict
+        :param filter_path: response fields to keep, all when empty
+        :type filter_path: list
+        :param run_options: workers, per_host, timeout and deadline given to run
+        :return: dict key -> JSON stats, or the exception raised
+        """
+        return cls._fan_out(
+            ElasticSearchStatsHelpers.cluster_statistics,
+            targets,
+            run_options,
+            filter_path=filter_path,
+            debug=debug
+        )
+
+    @classmethod
+    def cluster_health(
+            cls,
+            targets,
+            filter_path=None,
+            debug=False,
+            **run_options
+    ):
+        """
+        Get the cluster health of many clusters
+        :param targets: dict key -> dict(scheme=, hostname=, port=)
+        :type targets: dict
+        :param run_options: workers, per_host, timeout and deadline given to run
+        :return: dict key -> JSON health, or the exception raised
+        """
+        return cls._fan_out(
+            ElasticSearchStatsHelpers.cluster_health,
+            targets,
+            run_options,
+            filter_path=filter_path,
+            debug=debug
+        )
+
+    @classmethod
+    def docs_statistics(
+            cls,
+            targets,
+            filter_path=None,
+            debug=False,
+            **run_options
+    ):
+        """
+        Get the docs stats of many clusters
+        :param targets: dict key -> dict(scheme=, hostname=, port=)
+        :type targets: dict
+        :param run_options: workers, per_host, timeout and deadline given to run
+        :return: dict key -> JSON stats, or the exception raised
+        """
+        return cls._fan_out(
+            ElasticSearchStatsHelpers.docs_statistics,
+            targets,
+            run_options,
+            filter_path=filter_path,
+            debug=debug
+        )
+
+    @classmethod
+    def node_statistics(
+            cls,
+            targets,
+            metrics=None,
+            filter_path=None,
+            debug=False,
+            **run_options
+    ):
+        """
+        Get node stats from many clusters or nodes
+        :param targets: dict key -> dict(scheme=, hostname=, port=, node_id=)
+        :type targets: dict
+        :param metrics: metric groups to get (jvm, fs, ...), all when empty
+        :type metrics: list
+        :param filter_path: response fields to keep, all when empty
+        :type filter_path: list
+        :param run_options: workers, per_host, timeout and deadline given to run
+        :return: dict key -> JSON stats, or the exception raised
+        """
+        return cls._fan_out(
+            ElasticSearchStatsHelpers.node_statistics,
+            targets,
+            run_options,
+            metrics=metrics,
+            filter_path=filter_path,
+            debug=debug
+        )
+
+    @classmethod
+    def sampled_cluster_statistics(
+            cls,
+            targets,
+            filter_path=None,
+            sample_interval=1,
+            nb_sample=5,
+            debug=False,
+            **run_options
+    ):
+        """
+        Query sampled cluster stats from many clusters, all series run at once
+        :param targets: dict key -> dict(scheme=, hostname=, port=)
+        :type targets: dict
+        :param run_options: workers, per_host, timeout and deadline given to run
+        :return: dict key -> list of (SampleTime, JSON stats) pairs, or the exception raised
+        """
+        return cls._fan_out(
+            ElasticSearchStatsHelpers.sampled_cluster_statistics,
+            targets,
+            run_options,
+            filter_path=filter_path,
+            sample_interval=sample_interval,
+            nb_sample=nb_sample,
+            debug=debug
+        )
+
+    @classmethod
+    def sampled_node_statistics(
+            cls,
+            targets,
+            metrics=None,
+            filter_path=None,
+            sample_interval=1,
+            nb_sample=5,
+            debug=False,
+            **run_options
+    ):
+        """
+        Query sampled node stats from many clusters or nodes, all series run at once
+        :param targets: dict key -> dict(scheme=, hostname=, port=, node_id=)
+        :type targets: dict
+        :param run_options: workers, per_host, timeout and deadline given to run
+        :return: dict key -> list of (SampleTime, JSON stats) pairs, or the exception raised
+        """
+        return cls._fan_out(
+            ElasticSearchStatsHelpers.sampled_node_statistics,
+            targets,
+            run_options,
+            metrics=metrics,
+            filter_path=filter_path,
+            sample_interval=sample_interval,
+            nb_sample=nb_sample,
+            debug=debug
+        )
+
+
+class NodeStatsTable(object):
+    """
+        Columnar view of a node stats object: one row per node, sorted by
+        name, and one array of doubles per metric path. Missing values are NaN.
+    """
+
+    STATES = ['OK', 'Warning', 'Critical', 'Unknown']
+
+    def __init__(self, ids, names, columns):
+        self.ids = ids
+        self.names = names
+        self.columns = columns
+
+    @classmethod
+    def from_node_stats(
+            cls,
+            stats,
+            paths
+    ):
+        """
+        Build the table of some metrics of a node stats object
+        :param stats: JSON node stats
+        :param paths: keys leading to every metric inside a node
+        :type paths: list of list
+        :return: NodeStatsTable
+        """
+        nodes = sorted(
+            stats.get('nodes', {}).items(),
+            key=lambda item: item[1].get('name', item[0])
+        )
+        columns = dict(
+            (cls.column_name(path), array.array('d', (cls._lookup(node, path) for node_id, node in nodes)))
+            for path in paths
+        )
+        return cls(
+            [node_id for node_id, node in nodes],
+            [node.get('name', node_id) for node_id, node in nodes],
+            columns
+        )
+
+    @classmethod
+    def column_name(
+            cls,
+            path
+    ):
+        return '.'.join(path)
+
+    @classmethod
+    def _lookup(
+            cls,
+            node,
+            path
+    ):
+        value = node
+        try:
+            for key in path:
+                value = value[key]
+            return float(value)
+        except (KeyError, TypeError, ValueError):
+            return float('nan')
+
+    def __len__(self):
+        return len(self.ids)
+
+    def column(self, path):
+        """
+        :param path: keys leading to the metric inside a node
+        :type path: list
+        :return: array of the metric values, in row order
+        """
+        return self.columns[self.column_name(path)]
+
+    def values(self, path):
+        """
+        :param path: keys leading to the metric inside a node
+        :type path: list
+        :return: OrderedDict node name -> value, sorted by name
+        """
+        return collections.OrderedDict(zip(self.names, self.column(path)))
+
+    def threshold_states(self, path, warning, critical):
+        """
+        Compare a metric of every node to thresholds where higher is worse
+        Nodes without the metric are Unknown.
+        :param path: keys leading to the metric inside a node
+        :type path: list
+        :return: list of states, in row order
+        """
+        column = self.column(path)
+        numpy = ElasticSearchStatsEvalHelpers._numpy()
+        if numpy is not None and len(column) >= ElasticSearchStatsEvalHelpers.NUMPY_MIN_SAMPLES:
+            values = numpy.frombuffer(column, dtype=numpy.float64)
+            levels = numpy.where(
+                numpy.isnan(values),
+                3,
+                (values >= warning).astype(int) + (values >= critical)
+            ).tolist()
+        else:
+            levels = [
+                3 if value != value else (value >= warning) + (value >= critical)
+                for value in column
+            ]
+        return [self.STATES[level] for level in levels]
+
+    @classmethod
+    def counter_rates(
+            cls,
+            tables,
+            times,
+            path,
+            reset_path=None
+    ):
+        """
+        Per second rate of a cumulative counter of every node over a series of tables
+        A node is followed by id, over the tables it reports the counter in.
+        Nodes seen in a single table have no rate.
+        :param tables: NodeStatsTable of every sample, oldest first
+        :type tables: list
+        :param times: time in [s] of every sample
+        :type times: list
+        :param path: keys leading to the counter inside a node
+        :type path: list
+        :param reset_path: keys leading to a marker of the counter resets, such as the jvm uptime
+        :type reset_path: list
+        :return: OrderedDict node name -> rate per [s], sorted by name
+        """
+        if len(tables) >= 2 and all(table.ids == tables[0].ids for table in tables[1:]):
+            #same nodes in every sample, the usual case: whole columns at once
+            increases = cls._aligned_increases(tables, path, reset_path)
+            if increases is not None:
+                elapsed = times[-1] - times[0]
+                if elapsed <= 0:
+                    raise Exception('Samples are not ordered in time')
+                return collections.OrderedDict(
+                    (name, increase / elapsed) for name, increase in zip(tables[-1].names, increases)
+                )
+
+        series = collections.OrderedDict()
+        for table, sample_time in zip(tables, times):
+            counters = table.column(path)
+            markers = table.column(reset_path) if reset_path else None
+            for row, node_id in enumerate(table.ids):
+                if counters[row] != counters[row]:
+                    #NaN, the node does not report the counter
+                    continue
+                series.setdefault(node_id, []).append((
+                    sample_time,
+                    table.names[row],
+                    counters[row],
+                    markers[row] if markers is not None else None
+                ))
+
+        rates = {}
+        for node_id, points in series.items():
+            if len(points) < 2:
+                continue
+            elapsed = points[-1][0] - points[0][0]
+            if elapsed <= 0:
+                raise Exception('Samples are not ordered in time')
+            increase = ElasticSearchStatsEvalHelpers.counter_increase(
+                [point[2] for point in points],
+                [point[3] for point in points] if reset_path else None
+            )
+            rates[points[-1][1]] = increase / elapsed
+
+        return collections.OrderedDict(sorted(rates.items()))
+
+    @classmethod
+    def _aligned_increases(
+            cls,
+            tables,
+            path,
+            reset_path=None
+    ):
+        """
+        Counter increase of every row of tables holding the same nodes in the same order
+        Same reset rules as ElasticSearchStatsEvalHelpers.counter_increase.
+        :return: list of increases in row order, None when a node misses a counter value
+        """
+        numpy = ElasticSearchStatsEvalHelpers._numpy()
+        if numpy is not None and len(tables[0]) >= ElasticSearchStatsEvalHelpers.NUMPY_MIN_SAMPLES:
+            values = numpy.array([numpy.frombuffer(table.column(path), dtype=numpy.float64) for table in tables])
+            if numpy.isnan(values).any():
+                return None
+            reset = values[1:] < values[:-1]
+            if reset_path:
+                markers = numpy.array([numpy.frombuffer(table.column(reset_path), dtype=numpy.float64) for table in tables])
+                reset |= markers[1:] < markers[:-1]
+            return numpy.where(reset, values[1:], values[1:] - values[:-1]).sum(axis=0).tolist()
+
+        columns = [table.column(path) for table in tables]
+        if any(value != value for column in columns for value in column):
+            return None
+        markers = [table.column(reset_path) for table in tables] if reset_path else None
+        increases = [0.0] * len(tables[0])
+        for index in range(1, len(columns)):
+            previous, current = columns[index - 1], columns[index]
+            for row in range(len(increases)):
+                reset = current[row] < previous[row]
+                if markers is not None:
+                    reset = reset or markers[index][row] < markers[index - 1][row]
+                increases[row] += current[row] if reset else current[row] - previous[row]
+        return increases
+
+
+class ElasticSearchStatsEvalHelpers(object):
+
+    #numpy is optional, and only worth its import and call overhead on long series
+    NUMPY_MIN_SAMPLES = 256
+    _numpy_module = None
+
+    @classmethod
+    def get_nb_indexed_docs(
+            cls,
+            stats
+    ):
+        """
+        :param stats: JSON cluster stats, or JSON docs stats
+        :return: docs count of the primary shards
+        """
+        if '_all' in stats:
+            return stats['_all']['primaries']['docs']['count']
+        return stats['indices']['docs']['count']
+
+    @classmethod
+    def get_cluster_status(
+            cls,
+            stats
+    ):
+        return stats['status']
+
+    @classmethod
+    def get_heap_used_percent(
+            cls,
+            stats
+    ):
+        return cls._get_first_node_value(stats, ['jvm', 'mem', 'heap_used_percent'])
+
+    @classmethod
+    def get_disk_io_op(
+            cls,
+            stats
+    ):
+        return cls._get_first_node_value(stats, ['fs', 'total', 'disk_io_op'])
+
+    @classmethod
+    def _get_first_node_value(
+            cls,
+            stats,
+            path
+    ):
+        """
+        Get a value of the first node, by name, of a node stats object
+        :param stats: JSON node stats
+        :param path: keys leading to the value inside a node
+        :type path: list
+        :return: the value, NaN when the node does not report it, None without any node
+        """
+        table = NodeStatsTable.from_node_stats(stats, [path])
+        return table.column(path)[0] if len(table) else None
+
+    @classmethod
+    def get_nodes_value(
+            cls,
+            stats,
+            path
+    ):
+        """
+        Get a value of every node of a node stats object
+        :param stats: JSON node stats
+        :param path: keys leading to the value inside a node
+        :type path: list
+        :return: OrderedDict node name -> value, sorted by name
+        """
+        values = {}
+        for node_id, node in stats.get('nodes', {}).items():
+            values[node.get('name', node_id)] = cls._get_path(node, path)
+
+        return collections.OrderedDict(sorted(values.items()))
+
+    @classmethod
+    def _get_path(
+            cls,
+            stats,
+            path
+    ):
+        value = stats
+        for key in path:
+            value = value[key]
+        return value
+
+    @classmethod
+    def get_nodes_heap_used_percent(
+            cls,
+            stats
+    ):
+        return cls.get_nodes_value(stats, ['jvm', 'mem', 'heap_used_percent'])
+
+    @classmethod
+    def get_nodes_disk_io_op(
+            cls,
+            stats
+    ):
+        return cls.get_nodes_value(stats, ['fs', 'total', 'disk_io_op'])
+
+    @classmethod
+    def threshold_status(
+            cls,
+            value,
+            warning,
+            critical
+    ):
+        """
+        Compare a value to thresholds where higher is worse
+        :return: 'OK', 'Warning' or 'Critical'
+        """
+        if value >= critical:
+            return 'Critical'
+        if value >= warning:
+            return 'Warning'
+        return 'OK'
+
+    @classmethod
+    def filter_nb_indexed_docs(
+            cls,
+            stats
+    ):
+        if not isinstance(stats, collections.Iterable):
+            raise Exception('Provided input is not an Iterable')
+
+        return [
+            cls.get_nb_indexed_docs(element) for element in stats
+        ]
+
+    @classmethod
+    def trim_nb_indexed_docs(
+            cls,
+            stats
+    ):
+        """
+        Keep only the indexed docs count of a stats object
+        :param stats: JSON stats
+        :return: JSON stats holding the docs count only
+        """
+        return {'indices': {'docs': {'count': cls.get_nb_indexed_docs(stats)}}}
+
+    @classmethod
+    def nb_indexed_docs_not_decreasing(
+            cls,
+            previous,
+            current
+    ):
+        """
+        Tell if a docs count could have grown from previous to current
+        Deleted indices make the count go down, no rate can be computed across.
+        :param previous: JSON stats
+        :param current: JSON stats
+        :return: bool
+        """
+        return cls.get_nb_indexed_docs(previous) <= cls.get_nb_indexed_docs(current)
+
+    @classmethod
+    def sample_payloads(
+            cls,
+            samples
+    ):
+        """
+        Drop the timestamps of a sampled series
+        :param samples: list of (SampleTime, JSON stats) pairs
+        :return: list of JSON stats
+        """
+        return [payload for sample_time, payload in samples]
+
+    @classmethod
+    def sample_elapsed_time(
+            cls,
+            samples
+    ):
+        """
+        Real time elapsed between the first and the last sample
+        :param samples: list of (SampleTime, JSON stats) pairs
+        :return: elapsed time in [s]
+        """
+        if len(samples) < 2:
+            raise Exception('At least two samples are needed to measure a time')
+
+        return samples[-1][0].timestamp - samples[0][0].timestamp
+
+    @classmethod
+    def indexed_docs_rate(
+            cls,
+            samples
+    ):
+        """
+        Average indexing rate over a sampled series
+        :param samples: list of (SampleTime, JSON stats) pairs
+        :return: indexed docs per [s]
+        """
+        nb_docs_sample = cls.filter_nb_indexed_docs(
+            cls.sample_payloads(samples)
+        )
+        elapsed = cls.sample_elapsed_time(samples)
+        if elapsed <= 0:
+            raise Exception('Samples are not ordered in time')
+
+        return (nb_docs_sample[-1] - nb_docs_sample[0]) / float(elapsed)
+
+    @classmethod
+    def _numpy(
+            cls
+    ):
+        """
+        :return: numpy module, None when it is not installed
+        """
+        if cls._numpy_module is None:
+            try:
+                import numpy
+                cls._numpy_module = numpy
+            except ImportError:
+                cls._numpy_module = False
+        return cls._numpy_module or None
+
+    @classmethod
+    def rate_analytics(
+            cls,
+            samples,
+            get_value,
+            stall_rate=0
+    ):
+        """
+        Analyze the rates of a counter over a sampled series in one pass
+        :param samples: list of (SampleTime, JSON stats) pairs, oldest first
+        :param get_value: callable returning the counter of a JSON stats object
+        :type get_value: callable
+        :param stall_rate: rate per [s] at or below which the counter is stalled
+        :type stall_rate: float
+        :return: RateAnalytics
+        """
+        if len(samples) < 2:
+            raise Exception('At least two samples are needed to compute rates')
+
+        times = [sample_time.timestamp for sample_time, payload in samples]
+        values = [float(get_value(payload)) for sample_time, payload in samples]
+        if times[-1] <= times[0]:
+            raise Exception('Samples are not ordered in time')
+
+        numpy = cls._numpy()
+        if numpy is not None and len(samples) >= cls.NUMPY_MIN_SAMPLES:
+            return cls._numpy_rate_analytics(numpy, times, values, stall_rate)
+        return cls._python_rate_analytics(times, values, stall_rate)
+
+    @classmethod
+    def _numpy_rate_analytics(
+            cls,
+            numpy,
+            times,
+            values,
+            stall_rate
+    ):
+        times = numpy.asarray(times, dtype=float)
+        values = numpy.asarray(values, dtype=float)
+
+        durations = numpy.diff(times)
+        increases = numpy.diff(values)
+        ordered = durations > 0
+        rates = increases[ordered] / durations[ordered]
+
+        centered = times - times.mean()
+        slope = (centered * (values - values.mean())).sum() / (centered * centered).sum()
+
+        #longest run of stalled intervals: time stalled so far, minus the
+        #time stalled when the last not stalled interval ended
+        stalled = rates <= stall_rate
+        stalled_time = numpy.cumsum(numpy.where(stalled, durations[ordered], 0))
+        stalled_run = stalled_time - numpy.maximum.accumulate(numpy.where(stalled, 0, stalled_time))
+        p10, p50, p90 = numpy.percentile(rates, [10, 50, 90])
+
+        return RateAnalytics(
+            slope=float(slope),
+            mean=float((values[-1] - values[0]) / (times[-1] - times[0])),
+            min=float(rates.min()),
+            max=float(rates.max()),
+            p10=float(p10),
+            p50=float(p50),
+            p90=float(p90),
+            stalled=float(stalled_run.max())
+        )
+
+    @classmethod
+    def _python_rate_analytics(
+            cls,
+            times,
+            values,
+            stall_rate
+    ):
+        nb = len(times)
+        mean_time = sum(times) / nb
+        mean_value = sum(values) / nb
+
+        rates = []
+        covariance = variance = 0.0
+        stalled = longest_stall = 0.0
+        for index in range(nb):
+            centered = times[index] - mean_time
+            covariance += centered * (values[index] - mean_value)
+            variance += centered * centered
+            if index == 0:
+                continue
+            duration = times[index] - times[index - 1]
+            if duration <= 0:
+                continue
+            rate = (values[index] - values[index - 1]) / duration
+            rates.append(rate)
+            stalled = stalled + duration if rate <= stall_rate else 0.0
+            longest_stall = max(longest_stall, stalled)
+
+        rates.sort()
+        return RateAnalytics(
+            slope=covariance / variance,
+            mean=(values[-1] - values[0]) / (times[-1] - times[0]),
+            min=rates[0],
+            max=rates[-1],
+            p10=cls._percentile(rates, 10),
+            p50=cls._percentile(rates, 50),
+            p90=cls._percentile(rates, 90),
+            stalled=longest_stall
+        )
+
+    @classmethod
+    def _percentile(
+            cls,
+            ranked,
+            rank
+    ):
+        """
+        Percentile of sorted values, interpolated between the closest ranks as numpy does
+        """
+        position = (len(ranked) - 1) * rank / 100.0
+        lower = int(position)
+        upper = min(lower + 1, len(ranked) - 1)
+        return ranked[lower] + (ranked[upper] - ranked[lower]) * (position - lower)
+
+    @classmethod
+    def slope_lower_bound(
+            cls,
+            samples,
+            get_value,
+            nb_sample,
+            sample_interval
+    ):
+        """
+        Least slope rate_analytics can fit on a whole sampling window, from its first samples
+        A counter which never went down keeps at least its last value: the
+        slope of the whole window is the least when the samples left to take
+        stay at it, the least squares weights of the last samples being
+        positive. They are placed on the remaining sampling deadlines.
+        :param samples: list of (SampleTime, JSON stats) pairs, oldest first
+        :param get_value: callable getting the counter from a JSON stats
+        :type get_value: callable
+        :param nb_sample: number of samples of the whole window
+        :type nb_sample: int
+        :param sample_interval: time in [s] between two sampling deadlines
+        :type sample_interval: float
+        :return: slope per [s], None when the counter went down
+        """
+        values = [get_value(payload) for payload in cls.sample_payloads(samples)]
+        if any(current < previous for previous, current in zip(values, values[1:])):
+            return None
+
+        first_time = samples[0][0]
+        last_time, last_payload = samples[-1]
+        padded = list(samples)
+        for index in range(len(samples), nb_sample):
+            timestamp = max(first_time.timestamp + index * sample_interval, last_time.timestamp)
+            padded.append((SampleTime(timestamp, timestamp), last_payload))
+        return cls.rate_analytics(padded, get_value).slope
+
+    @classmethod
+    def counter_increase(
+            cls,
+            values,
+            markers=None
+    ):
+        """
+        Increase of a cumulative counter over a series, across its resets
+        A counter going down, or a marker such as the node uptime going down,
+        tells the counter restarted from zero: the increase since the reset
+        is its new value.
+        :param values: counter values, oldest first
+        :type values: list
+        :param markers: values growing as long as the counter is not reset, None to rely on the counter only
+        :type markers: list
+        :return: total increase
+        """
+        increase = 0
+        for index in range(1, len(values)):
+            reset = values[index] < values[index - 1]
+            if markers is not None:
+                reset = reset or markers[index] < markers[index - 1]
+            if reset:
+                increase += values[index]
+            else:
+                increase += values[index] - values[index - 1]
+        return increase
+
+    @classmethod
+    def counter_rate(
+            cls,
+            samples,
+            path,
+            reset_path=None
+    ):
+        """
+        Per second rate of a cumulative counter of a sampled stats object
+        :param samples: list of (SampleTime, JSON stats) pairs, oldest first
+        :param path: keys leading to the counter
+        :type path: list
+        :param reset_path: keys leading to a marker of the counter resets, such as an uptime
+        :type reset_path: list
+        :return: rate per [s]
+        """
+        elapsed = cls.sample_elapsed_time(samples)
+        if elapsed <= 0:
+            raise Exception('Samples are not ordered in time')
+
+        payloads = cls.sample_payloads(samples)
+        increase = cls.counter_increase(
+            [cls._get_path(payload, path) for payload in payloads],
+            [cls._get_path(payload, reset_path) for payload in payloads] if reset_path else None
+        )
+        return increase / float(elapsed)
+
+    @classmethod
+    def nodes_counter_rates(
+            cls,
+            samples,
+            path,
+            reset_path=None
+    ):
+        """
+        Per second rate of a cumulative counter of every node of sampled node stats
+        A node is followed by id, over the samples it appears in. Nodes seen
+        in a single sample have no rate.
+        :param samples: list of (SampleTime, JSON node stats) pairs, oldest first
+        :param path: keys leading to the counter inside a node
+        :type path: list
+        :param reset_path: keys leading to a marker of the counter resets inside a node, such as the jvm uptime
+        :type reset_path: list
+        :return: OrderedDict node name -> rate per [s], sorted by name
+        """
+        paths = [path, reset_path] if reset_path else [path]
+        return NodeStatsTable.counter_rates(
+            [NodeStatsTable.from_node_stats(stats, paths) for sample_time, stats in samples],
+            [sample_time.timestamp for sample_time, stats in samples],
+            path,
+            reset_path
+        )
+
+
+class ElasticSearchStateHelpers(object):
+    """
+        Keep timestamped samples between check invocations in a state file
+    """
+
+    DEFAULT_MAX_AGE = 3600
+    DEFAULT_MIN_INTERVAL = 1
+    DEFAULT_HISTORY = 2
+    LOCK_TIMEOUT = 5
+    BOOT_ID_PATH = '/proc/sys/kernel/random/boot_id'
+
+    @classmethod
+    def _boot_id(
+            cls
+    ):
+        """
+        Identify the current boot, monotonic times are only comparable within one
+        :return: boot id or None when the system does not expose it
+        """
+        try:
+            with open(cls.BOOT_ID_PATH) as boot_id_file:
+                return boot_id_file.read().strip()
+        except (IOError, OSError):
+            return None
+
+    @classmethod
+    @contextlib.contextmanager
+    def locked(
+            cls,
+            path,
+            timeout=LOCK_TIMEOUT,
+            required=True
+    ):
+        """
+        Hold an exclusive lock on a state file
+        The lock lives in a side file since the state file itself is replaced
+        on every save.
+        :param path: state file path
+        :type path: str
+        :param timeout: time in [s] to wait for the lock
+        :type timeout: int
+        :param required: raise on timeout, else go on without the lock
+        :type required: bool
+        :return: context yielding whether the lock is held
+        """
+        lock_file = open(path + '.lock', 'a')
+        try:
+            deadline = monotonic() + timeout
+            held = False
+            while not held:
+                try:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    held = True
+                except IOError as e:
+                    if e.errno not in (errno.EAGAIN, errno.EACCES):
+                        raise
+                    if monotonic() > deadline:
+                        if required:
+                            raise Exception('Timeout while locking state file {f}'.format(f=path))
+                        break
+                    time.sleep(0.01)
+            yield held
+        finally:
+            lock_file.close()
+
+    @classmethod
+    def load(
+            cls,
+            path
+    ):
+        """
+        Read a state file
+        :param path: state file path
+        :type path: str
+        :return: state dict, None when missing or unreadable
+        """
+        try:
+            with open(path) as state_file:
+                state = json.load(state_file)
+        except (IOError, OSError, ValueError):
+            return None
+
+        if not isinstance(state, dict):
+            return None
+        return state
+
+    @classmethod
+    def save(
+            cls,
+            path,
+            state
+    ):
+        """
+        Atomically replace a state file
+        :param path: state file path
+        :type path: str
+        :param state: JSON serializable state
+        :type state: dict
+        """
+        directory = os.path.dirname(os.path.abspath(path))
+        fd, temp_path = tempfile.mkstemp(
+            dir=directory,
+            prefix='.' + os.path.basename(path)
+        )
+        try:
+            with os.fdopen(fd, 'w') as temp_file:
+                json.dump(state, temp_file)
+                temp_file.flush()
+                os.fsync(temp_file.fileno())
+            os.rename(temp_path, path)
+        except Exception:
+            os.unlink(temp_path)
+            raise
+
+    @classmethod
+    def _elapsed(
+            cls,
+            previous,
+            current
+    ):
+        """
+        Time elapsed between two stored entries
+        :return: elapsed time in [s], monotonic when both come from the same boot
+        """
+        if previous.get('boot_id') and previous.get('boot_id') == current.get('boot_id'):
+            return current['monotonic'] - previous['monotonic']
+        return current['wall'] - previous['wall']
+
+    @classmethod
+    def record_sample(
+            cls,
+            path,
+            payload,
+            max_age=DEFAULT_MAX_AGE,
+            min_interval=DEFAULT_MIN_INTERVAL,
+            history=DEFAULT_HISTORY,
+            validate=None,
+            age=0
+    ):
+        """
+        Store payload as the newest sample of a state file and return the
+        stored series, usable wherever sampled stats are expected
+        Entries older than max_age or refused by validate are dropped.
+        Entries younger than min_interval, or newer than payload since a
+        concurrent run got its response later, are kept in the file but
+        left out of the returned series. The file holds the newest history
+        entries old enough to give a rate, the younger and newer ones and
+        payload, oldest first.
+        :param path: state file path
+        :type path: str
+        :param payload: JSON serializable stats
+        :param max_age: time in [s] after which an entry is stale
+        :type max_age: int
+        :param min_interval: minimal time in [s] between the current and an entry
+        :type min_interval: int
+        :param history: number of entries of the returned series
+        :type history: int
+        :param validate: callable(previous_payload, payload) telling if an entry is usable
+        :type validate: callable
+        :param age: time in [s] since payload was received from elasticsearch
+        :type age: float
+        :return: list of (SampleTime, payload) pairs, oldest first, ending with payload
+        """
+        current = {
+            'monotonic': monotonic() - age,
+            'wall': time.time() - age,
+            'boot_id': cls._boot_id(),
+            'payload': payload
+        }
+
+        with cls.locked(path):
+            state = cls.load(path) or {}
+            entries = []
+            newer = []
+            for entry in state.get('entries', []):
+                try:
+                    elapsed = cls._elapsed(entry, current)
+                except (KeyError, TypeError):
+                    continue
+                if abs(elapsed) > max_age:
+                    continue
+                if elapsed <= 0:
+                    #saved by a concurrent run while this one waited for the lock
+                    newer.append((elapsed, entry))
+                    continue
+                if validate is not None and not validate(entry['payload'], payload):
+                    continue
+                entries.append((elapsed, entry))
+
+            #entries too young to give a rate are kept for the next runs
+            usable = [
+                (elapsed, entry) for elapsed, entry in entries
+                if elapsed >= min_interval
+            ][-max(history - 1, 1):]
+            young = [
+                (elapsed, entry) for elapsed, entry in entries
+                if elapsed < min_interval
+            ]
+            newer.sort(key=lambda pair: pair[0], reverse=True)
+            cls.save(path, {
+                'entries': [entry for elapsed, entry in usable + young] + [current] + [
+                    entry for elapsed, entry in newer
+                ]
+            })
+
+        # express every entry on the monotonic clock of this process
+        return [
+            (SampleTime(current['monotonic'] - elapsed, current['monotonic'] - elapsed), entry['payload'])
+            for elapsed, entry in usable
+        ] + [
+            (SampleTime(current['monotonic'], current['monotonic']), payload)
+        ]
+
+
+class ElasticSearchResponseCache(object):
+    """
+        Share stats responses between check processes through a directory,
+        and between the threads of a long running process through memory
+    """
+
+    DEFAULT_TTL = 10
+    DEFAULT_MAX_SIZE = 64 * 1024 * 1024
+    DEFAULT_MEMORY_ENTRIES = 256
+    DEFAULT_COALESCE_TIMEOUT = 5
+    #lifetime in [s] by url prefix, the longest matching prefix wins
+    ENDPOINT_TTLS = {
+        '/_cluster/stats': 15,
+        '/_cluster/health': 5,
+        '/_stats': 10,
+        '/_nodes': 10,
+    }
+
+    _directory = None
+    _memory = None
+    _memory_entries = DEFAULT_MEMORY_ENTRIES
+    _memory_lock = threading.Lock()
+    _flight_locks = {}
+    _ttl = None
+    _max_size = DEFAULT_MAX_SIZE
+    _coalesce_timeout = DEFAULT_COALESCE_TIMEOUT
+    _statistics = {
+        'hits': 0,
+        'misses': 0,
+        'coalesced': 0,
+        'evictions': 0
+    }
+
+    @classmethod
+    def configure(
+            cls,
+            directory=None,
+            memory=False,
+            ttl=None,
+            max_size=DEFAULT_MAX_SIZE,
+            memory_entries=DEFAULT_MEMORY_ENTRIES,
+            coalesce_timeout=DEFAULT_COALESCE_TIMEOUT
+    ):
+        """
+        Configure the response cache
+        :param directory: where to store responses, None for no shared cache
+        :type directory: str
+        :param memory: keep responses in memory too
+        :type memory: bool
+        :param ttl: lifetime in [s] of every response, None for the per endpoint lifetimes
+        :type ttl: int
+        :param max_size: directory size in [bytes] above which oldest responses are evicted
+        :type max_size: int
+        :param memory_entries: number of responses kept in memory
+        :type memory_entries: int
+        :param coalesce_timeout: time in [s] to wait for a request in flight in another process
+        :type coalesce_timeout: int
+        """
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        cls._directory = directory
+        cls._memory = collections.OrderedDict() if memory else None
+        cls._memory_entries = memory_entries
+        cls._ttl = ttl
+        cls._max_size = max_size
+        cls._coalesce_timeout = coalesce_timeout
+
+    @classmethod
+    def enabled(
+            cls
+    ):
+        return cls._directory is not None or cls._memory is not None
+
+    @classmethod
+    def statistics(
+            cls
+    ):
+        """
+        Get the cache hits, misses, coalesced requests and evictions since process start
+        :return: dict of counters
+        """
+        with cls._memory_lock:
+            return dict(cls._statistics)
+
+    @classmethod
+    def _count(
+            cls,
+            name
+    ):
+        """
+        Increment a statistics counter, lookups and evictions run in many threads
+        :param name: counter name
+        :type name: str
+        """
+        with cls._memory_lock:
+            cls._statistics[name] += 1
+
+    @classmethod
+    def ttl(
+            cls,
+            uri
+    ):
+        """
+        Lifetime of the response of an uri
+        :param uri: complete uri
+        :type uri: str
+        :return: lifetime in [s]
+        """
+        if cls._ttl is not None:
+            return cls._ttl
+
+        path = urlparse(uri).path
+        prefixes = [prefix for prefix in cls.ENDPOINT_TTLS if path.startswith(prefix)]
+        if not prefixes:
+            return cls.DEFAULT_TTL
+        return cls.ENDPOINT_TTLS[max(prefixes, key=len)]
+
+    @classmethod
+    def _path(
+            cls,
+            uri
+    ):
+        key = hashlib.sha1(uri.encode('utf-8')).hexdigest()
+        return os.path.join(cls._directory, key + '.json')
+
+    @classmethod
+    def get(
+            cls,
+            uri,
+            coalesced=False
+    ):
+        """
+        Get a fresh cached response
+        :param uri: complete uri
+        :type uri: str
+        :param coalesced: lookup made after waiting for a request in flight,
+        counted as coalesced on hit and not counted on miss
+        :type coalesced: bool
+        :return: (JSON stats, age in [s]) or None on miss
+        """
+        entry = None
+        if cls._memory is not None:
+            with cls._memory_lock:
+                entry = cls._memory.get(uri)
+        if entry is None and cls._directory is not None:
+            entry = ElasticSearchStateHelpers.load(cls._path(uri))
+            if entry is not None and entry.get('uri') == uri:
+                cls._remember(uri, entry)
+
+        if entry is not None and entry.get('uri') == uri:
+            age = time.time() - entry.get('stored', 0)
+            if 0 <= age < cls.ttl(uri):
+                cls._count('coalesced' if coalesced else 'hits')
+                return entry['payload'], age
+
+        if not coalesced:
+            cls._count('misses')
+        return None
+
+    @classmethod
+    def in_flight(
+            cls,
+            uri,
+            timeout=None
+    ):
+        """
+        Lock an uri while its response is fetched
+        Processes, or threads, missing the same uri wait on the lock, at most
+        the coalesce timeout, then go on without it.
+        :param uri: complete uri
+        :type uri: str
+        :param timeout: time in [s] left to the caller, shortens the coalesce timeout
+        :type timeout: float
+        :return: context yielding whether the lock is held
+        """
+        if timeout is None or timeout > cls._coalesce_timeout:
+            timeout = cls._coalesce_timeout
+        if cls._directory is not None:
+            return ElasticSearchStateHelpers.locked(
+                cls._path(uri),
+                timeout=max(timeout, 0),
+                required=False
+            )
+        return cls._thread_locked(uri, timeout)
+
+    @classmethod
+    @contextlib.contextmanager
+    def _thread_locked(
+            cls,
+            uri,
+            timeout
+    ):
+        with cls._memory_lock:
+            lock = cls._flight_locks.setdefault(uri, threading.Lock())
+
+        deadline = monotonic() + timeout
+        held = lock.acquire(False)
+        while not held and monotonic() < deadline:
+            time.sleep(0.01)
+            held = lock.acquire(False)
+        try:
+            yield held
+        finally:
+            if held:
+                lock.release()
+
+    @classmethod
+    def put(
+            cls,
+            uri,
+            stats
+    ):
+        """
+        Store a response, then evict the oldest ones above the size limits
+        :param uri: complete uri
+        :type uri: str
+        :param stats: JSON stats
+        """
+        entry = {
+            'uri': uri,
+            'stored': time.time(),
+            'payload': stats
+        }
+        cls._remember(uri, entry)
+        if cls._directory is not None:
+            ElasticSearchStateHelpers.save(cls._path(uri), entry)
+            cls._evict()
+
+    @classmethod
+    def _remember(
+            cls,
+            uri,
+            entry
+    ):
+        if cls._memory is None:
+            return
+
+        with cls._memory_lock:
+            cls._memory.pop(uri, None)
+            cls._memory[uri] = entry
+            while len(cls._memory) > cls._memory_entries:
+                cls._memory.popitem(last=False)
+                cls._statistics['evictions'] += 1
+
+    @classmethod
+    def _evict(
+            cls
+    ):
+        entries = []
+        for name in os.listdir(cls._directory):
+            if not name.endswith('.json'):
+                continue
+            path = os.path.join(cls._directory, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+
+        size = sum(entry[1] for entry in entries)
+        for mtime, entry_size, path in sorted(entries):
+            if size <= cls._max_size:
+                break
+            try:
+                os.unlink(path)
+                cls._count('evictions')
+            except OSError as e:
+                if e.errno != errno.ENOENT:
+                    raise
+            size -= entry_size
+
+
+class PassiveCheckResultHelpers(object):
+    """
+        Hand check results to Nagios/Icinga as passive results
+    """
+
+    CheckResult = collections.namedtuple(
+        'CheckResult',
+        ['host_name', 'service', 'status', 'output', 'start_time', 'finish_time']
+    )
+
+    SPOOL_TEMPLATE = (
+        "### Nagios Service Check Result ###\n"
+        "# Time: {ctime}\n"
+        "host_name={host_name}\n"
+        "service_description={service}\n"
+        "check_type=1\n"
+        "check_options=0\n"
+        "scheduled_check=0\n"
+        "reschedule_check=0\n"
+        "latency=0\n"
+        "start_time={start_time:.6f}\n"
+        "finish_time={finish_time:.6f}\n"
+        "early_timeout=0\n"
+        "exited_ok=1\n"
+        "return_code={code}\n"
+        "output={output}\n"
+        "\n"
+    )
+
+    @classmethod
+    def _escape(
+            cls,
+            output
+    ):
+        return output.strip().replace('\\', '\\\\').replace('\n', '\\n')
+
+    @classmethod
+    def command_file_lines(
+            cls,
+            results
+    ):
+        """
+        Format results as external commands
+        :param results: list of CheckResult
+        :return: string of PROCESS_SERVICE_CHECK_RESULT lines
+        """
+        return ''.join(
+            "[{t}] PROCESS_SERVICE_CHECK_RESULT;{h};{s};{c};{o}\n".format(
+                t=int(result.finish_time),
+                h=result.host_name,
+                s=result.service,
+                c=OutputFormatHelpers.EXIT_CODES[result.status],
+                o=cls._escape(result.output)
+            )
+            for result in results
         )
-        return uri
 
+    @classmethod
+    def write_command_file(
+            cls,
+            path,
+            results
+    ):
+        """
+        Submit results through the external command file in a single write
+        :param path: command file (named pipe) path
+        :type path: str
+        :param results: list of CheckResult
+        """
+        lines = cls.command_file_lines(results)
+        if not lines:
+            return
+        with open(path, 'a') as command_file:
+            command_file.write(lines)
 
     @classmethod
-    def cluster_statistics(
+    def write_spool_file(
             cls,
-            scheme='http',
-            hostname='127.0.0.1',
-            port=9200,
-            debug=False
+            directory,
+            results
     ):
         """
-        Get cluster stats from hostname
-        :param scheme: HTTP scheme to use
-        :type scheme: str
-        :param hostname: Hostname where to execute the query
-        :type hostname: str
-        :param port: Port to connect to
-        :type port : int
-        :param debug: is debug enabled
-        :type port : bool
-        :return: JSON stats
+        Drop results in one file of the check result spool directory
+        The file is only picked up once its .ok marker exists.
+        :param directory: check_result_path of the monitoring core
+        :type directory: str
+        :param results: list of CheckResult
+        :return: path of the written result file
         """
-        uri = cls._cluster_statistics_uri(
-            scheme=scheme,
-            hostname=hostname,
-            port=port
-        )
+        fd, path = tempfile.mkstemp(dir=directory, prefix='c')
+        with os.fdopen(fd, 'w') as spool_file:
+            spool_file.write("### Passive Check Result File ###\nfile_time={t}\n\n".format(
+                t=int(time.time())
+            ))
+            for result in results:
+                spool_file.write(cls.SPOOL_TEMPLATE.format(
+                    host_name=result.host_name,
+                    service=result.service,
+                    start_time=result.start_time,
+                    finish_time=result.finish_time,
+                    ctime=time.ctime(result.finish_time),
+                    code=OutputFormatHelpers.EXIT_CODES[result.status],
+                    output=cls._escape(result.output)
+                ))
+        open(path + '.ok', 'w').close()
+        return path
 
-        stats =  cls._http_query(
-            uri=uri,
-            debug=debug
-        )
 
-        if debug:
-            print("Stats")
-            print("-----")
-            pprint(stats)
-            print("-----")
+class Metric(collections.namedtuple('Metric', ['name', 'value', 'kind', 'tags', 'timestamp'])):
+    """
+        One metric evaluated by a check run
+        kind is gauge or counter, tags a tuple of (key, value) pairs, the
+        cluster and check first, and timestamp the wall clock start of the run in [s].
+    """
+    __slots__ = ()
 
-        return stats
 
-    @classmethod
-    def node_statistics(
-            cls,
-            scheme='http',
-            hostname='127.0.0.1',
-            port=9200,
-            node_id='127.0.0.1',
-            debug=False
-    ):
+class MetricSink(object):
+    """
+        Write metric batches from a background thread, so a slow or down
+        target never delays check results. The batches queued while a write
+        runs go out together in the next one, the oldest are dropped once
+        more than max_pending metrics wait.
+    """
+
+    DEFAULT_MAX_PENDING = 100000
+    #time given to a single write, in [s]
+    WRITE_TIMEOUT = 5
+
+    def __init__(self, prefix, max_pending=DEFAULT_MAX_PENDING):
+        self.prefix = prefix
+        self.max_pending = max_pending
+        self.statistics = {
+            'batches': 0,
+            'writes': 0,
+            'metrics': 0,
+            'dropped': 0,
+            'errors': 0
+        }
+        self._pending = collections.deque()
+        self._nb_pending = 0
+        self._writing = False
+        self._closed = False
+        self._condition = threading.Condition()
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def submit(self, source, metrics):
         """
-        Get cluster stats from hostname for a given node_id
-        :param scheme: HTTP scheme to use
-        :type scheme: str
-        :param hostname: Hostname where to execute the query
-        :type hostname: str
-        :param port: Port to connect to
-        :type port : int
-        :param debug: is debug enabled
-        :type port : bool
-        :param node_id: target node_id
-        :type node_id: str
-        :return:JSON stats
+        Queue the batch of a check run, never blocks
+        :param source: (key, value) pairs identifying the run, its cluster and check
+        :type source: tuple
+        :param metrics: list of Metric
+        :type metrics: list
         """
-        uri = cls._node_statistics_uri(
-            scheme=scheme,
-            hostname=hostname,
-            port=port,
-            node_id=node_id
-        )
+        with self._condition:
+            self._pending.append((source, metrics))
+            self._nb_pending += len(metrics)
+            self.statistics['batches'] += 1
+            while self._nb_pending > self.max_pending and len(self._pending) > 1:
+                dropped_source, dropped = self._pending.popleft()
+                self._nb_pending -= len(dropped)
+                self.statistics['dropped'] += len(dropped)
+            self._condition.notify_all()
 
-        stats =  cls._http_query(
-            uri=uri,
-            debug=debug
-        )
+    def flush(self, timeout):
+        """
+        Wait for the queued batches to be written
+        :param timeout: time to wait in [s]
+        :type timeout: float
+        :return: True when nothing is left to write
+        """
+        end = monotonic() + timeout
+        with self._condition:
+            while self._pending or self._writing:
+                remaining = end - monotonic()
+                if remaining <= 0:
+                    return False
+                self._condition.wait(remaining)
+        return True
 
-        if debug:
-            print("Stats")
-            print("-----")
-            pprint(stats)
-            print("-----")
+    def close(self):
+        """
+        Stop the writer thread once the queued batches are written
+        """
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
 
-        return stats
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._pending and not self._closed:
+                    self._condition.wait()
+                if not self._pending:
+                    return
+                batches = list(self._pending)
+                self._pending.clear()
+                self._nb_pending = 0
+                self._writing = True
 
-    @classmethod
-    def _http_query(
-            cls,
-            uri,
-            debug=False
-    ):
+            try:
+                self.write(self.format(batches))
+                self.statistics['writes'] += 1
+                self.statistics['metrics'] += sum(len(metrics) for source, metrics in batches)
+            except Exception:
+                self.statistics['errors'] += 1
+            finally:
+                with self._condition:
+                    self._writing = False
+                    self._condition.notify_all()
+
+    def format(self, batches):
         """
-        Execute the stats query then return the complete stats json object
-        :param url: complete url to query
-        :type url : str
-        :return: json object
+        :param batches: list of (source, list of Metric), oldest first
+        :return: payload written at once
         """
-        #ask for stats
-        s = Session()
-        req = Request(
-            method='GET',
-            url=uri,
-        )
-        prepared_request = req.prepare()
+        raise NotImplementedError
 
-        if debug:
-            print("uri")
-            print("-------")
-            pprint(uri)
-            print("-------")
+    def write(self, payload):
+        raise NotImplementedError
 
-        response = s.send(prepared_request)
 
-        #check for http error
-        response.raise_for_status()
+class GraphiteSink(MetricSink):
+    """
+        Graphite plaintext protocol, one connection per write
+        prefix.<tag values>.name value timestamp
+    """
 
-        if debug:
-            print("response")
-            print("---------")
-            pprint(response)
-            print("---------")
+    DEFAULT_PORT = 2003
 
-        #get the result back
-        stats = response.json()
+    def __init__(self, host, port=DEFAULT_PORT, prefix='elasticsearch', max_pending=MetricSink.DEFAULT_MAX_PENDING):
+        self.host = host
+        self.port = port
+        super(GraphiteSink, self).__init__(prefix, max_pending)
+
+    @classmethod
+    def _node(cls, value):
+        return ''.join(char if char.isalnum() or char in '-_' else '_' for char in str(value))
 
+    def format(self, batches):
+        lines = []
+        for source, metrics in batches:
+            for metric in metrics:
+                path = [self.prefix] + [self._node(value) for key, value in metric.tags] + [metric.name]
+                lines.append('{p} {v!r} {t}\n'.format(
+                    p='.'.join(path),
+                    v=float(metric.value),
+                    t=int(metric.timestamp)
+                ))
+        return ''.join(lines).encode('utf-8')
 
+    def write(self, payload):
+        connection = socket.create_connection((self.host, self.port), self.WRITE_TIMEOUT)
+        try:
+            connection.sendall(payload)
+        finally:
+            connection.close()
 
-        return stats
 
+class InfluxSink(MetricSink):
+    """
+        Influx line protocol POSTed to a write url, the metrics of a node or
+        cluster sharing tags and a timestamp are the fields of a single line
+        prefix,<tags> name=value,... timestamp
+    """
+
+    def __init__(self, url, prefix='elasticsearch', max_pending=MetricSink.DEFAULT_MAX_PENDING):
+        self.url = url
+        super(InfluxSink, self).__init__(prefix, max_pending)
 
     @classmethod
-    def _delayed(
-            cls,
-            results,
-            delay,
-    ):
-        """
-        Just a delay
-        :param results: result to forward
-        :rype results: json object
-        :param delay: time to wait in [s]
-        :type delay: int
-        :return: intput result
-        """
-        time.sleep(delay)
-        return results
+    def _escape(cls, value):
+        return str(value).replace('\\', '\\\\').replace(',', '\\,').replace('=', '\\=').replace(' ', '\\ ')
+
+    def format(self, batches):
+        points = collections.OrderedDict()
+        for source, metrics in batches:
+            for metric in metrics:
+                key = (metric.tags, int(metric.timestamp * 1e9))
+                points.setdefault(key, []).append(metric)
+
+        return ''.join(
+            '{m}{t} {f} {n}\n'.format(
+                m=self._escape(self.prefix),
+                t=''.join(',{k}={v}'.format(k=self._escape(key), v=self._escape(value)) for key, value in tags),
+                f=','.join('{k}={v!r}'.format(k=self._escape(metric.name), v=float(metric.value)) for metric in metrics),
+                n=nanoseconds
+            )
+            for (tags, nanoseconds), metrics in points.items()
+        ).encode('utf-8')
+
+    def write(self, payload):
+        import requests
+        response = requests.post(self.url, data=payload, timeout=self.WRITE_TIMEOUT)
+        response.raise_for_status()
+
+
+class PrometheusTextfileSink(MetricSink):
+    """
+        node-exporter textfile collector file, written aside then renamed over
+        the previous one so the collector never reads it half written. The
+        file holds the last batch of every cluster and check, whatever process
+        ran it: the batches are kept in a side state file, merged under its
+        lock, and a run replaces all the series of the previous run of its
+        check. A check not run for SOURCE_MAX_AGE is dropped.
+    """
 
+    SOURCE_MAX_AGE = 3600
+
+    def __init__(self, path, prefix='elasticsearch', max_pending=MetricSink.DEFAULT_MAX_PENDING):
+        self.path = path
+        #the collector only reads *.prom files, the side files are not ones
+        self.state_path = path + '.batches'
+        super(PrometheusTextfileSink, self).__init__(prefix, max_pending)
 
     @classmethod
-    def sampled_node_statistics(
-            cls,
-            scheme='http',
-            hostname='127.0.0.1',
-            port=9200,
-            node_id='127.0.0.1',
-            sample_interval=1,
-            nb_sample=5,
-            debug=False
-    ):
+    def _name(cls, value):
+        return ''.join(char if char.isalnum() or char == '_' else '_' for char in value)
+
+    @classmethod
+    def _escape(cls, value):
+        return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+    @classmethod
+    def render(cls, prefix, metrics):
         """
-        Query sampled node stats
-        :param scheme: HTTP scheme to use
-        :type scheme: str
-        :param hostname: Hostname where to execute the query
-        :type hostname: str
-        :param port: Port to connect to
-        :type port : int
-        :param debug: is debug enabled
-        :type port : bool
-        :param node_id: target node_id
-        :type node_id: str
-        :param sample_interval: time in [s] between to probe
-        :type sample_interval: int
-        :param nb_sample: Number of sample to get
-        :type nb_sample : int
-        :return: JSON stats array
+        Render metrics in the Prometheus text format
+        :param prefix: metric names prefix
+        :type prefix: str
+        :param metrics: iterable of Metric
+        :return: page bytes, metrics of a name grouped under its TYPE line
         """
-        stats = [
-            cls._delayed(
-                results=cls.node_statistics(
-                    scheme=scheme,
-                    hostname=hostname,
-                    port=port,
-                    node_id=node_id,
-                    debug=debug
-                ),
-                delay=sample_interval
+        families = collections.OrderedDict()
+        for metric in metrics:
+            families.setdefault((metric.name, metric.kind), []).append(metric)
+
+        lines = []
+        for (name, kind), metrics in families.items():
+            name = cls._name('{p}_{n}'.format(p=prefix, n=name))
+            lines.append('# TYPE {n} {k}\n'.format(n=name, k=kind))
+            for metric in metrics:
+                lines.append('{n}{{{t}}} {v!r}\n'.format(
+                    n=name,
+                    t=','.join('{k}="{v}"'.format(k=cls._name(key), v=cls._escape(value)) for key, value in metric.tags),
+                    v=float(metric.value)
+                ))
+        return ''.join(lines).encode('utf-8')
+
+    def format(self, batches):
+        #merged with the other processes batches at write time, under the lock
+        return batches
+
+    def write(self, batches):
+        with ElasticSearchStateHelpers.locked(self.state_path):
+            state = ElasticSearchStateHelpers.load(self.state_path) or {}
+            for source, metrics in batches:
+                state[json.dumps(source)] = [list(metric) for metric in metrics]
+
+            #a source timestamp is the one of its run
+            oldest = time.time() - self.SOURCE_MAX_AGE
+            state = dict(
+                (source, metrics) for source, metrics in state.items()
+                if metrics and metrics[0][4] >= oldest
             )
-            for element in range(nb_sample)
-        ]
-        return stats
+            payload = self.render(self.prefix, (
+                Metric(name, value, kind, tuple(tuple(tag) for tag in tags), timestamp)
+                for source, metrics in sorted(state.items())
+                for name, value, kind, tags, timestamp in metrics
+            ))
+            self._replace(payload)
+            ElasticSearchStateHelpers.save(self.state_path, state)
+
+    def _replace(self, payload):
+        directory, name = os.path.split(os.path.abspath(self.path))
+        fd, temporary = tempfile.mkstemp(dir=directory, prefix='.' + name, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as textfile:
+                textfile.write(payload)
+            os.chmod(temporary, 0o644)
+            os.rename(temporary, self.path)
+        except Exception:
+            os.unlink(temporary)
+            raise
+
+
+class MetricSinkHelpers(object):
+    """
+        Collect the metrics a check run evaluates, then hand the run to the
+        configured sinks as a single batch
+    """
+
+    DEFAULT_PREFIX = 'elasticsearch'
+    DEFAULT_FLUSH_TIMEOUT = 1
+    METRIC_KINDS = ['gauge', 'counter']
+
+    _sinks = []
+    _flush_timeout = DEFAULT_FLUSH_TIMEOUT
+    _debug = False
+    #batch of the check run of each thread
+    _context = threading.local()
 
     @classmethod
-    def sampled_cluster_statistics(
+    def configure(
             cls,
-            scheme='http',
-            hostname='127.0.0.1',
-            port=9200,
-            sample_interval=1,
-            nb_sample=5,
+            graphite=None,
+            influx_url=None,
+            prometheus_textfile=None,
+            prefix=DEFAULT_PREFIX,
+            flush_timeout=DEFAULT_FLUSH_TIMEOUT,
+            max_pending=MetricSink.DEFAULT_MAX_PENDING,
             debug=False
     ):
         """
-        Query sampled cluster stats
-        :param scheme: HTTP scheme to use
-        :type scheme: str
-        :param hostname: Hostname where to execute the query
-        :type hostname: str
-        :param port: Port to connect to
-        :type port : int
-        :param debug: is debug enabled
-        :type port : bool
-        :param sample_interval: time in [s] between to probe
-        :type sample_interval: int
-        :param nb_sample: Number of sample to get
-        :type nb_sample : int
-        :return: JSON stats array
+        Configure the metric sinks, none by default
+        :param graphite: Graphite plaintext host[:port]
+        :type graphite: str
+        :param influx_url: Influx write url, database included
+        :type influx_url: str
+        :param prometheus_textfile: node-exporter textfile collector file
+        :type prometheus_textfile: str
+        :param prefix: metric names prefix
+        :type prefix: str
+        :param flush_timeout: time a flush waits for the sinks by default, in [s]
+        :type flush_timeout: float
+        :param max_pending: metrics waiting for a sink above which the oldest are dropped
+        :type max_pending: int
+        :param debug: print the sink statistics after every flush
+        :type debug: bool
         """
-        stats = [
-            cls._delayed(
-                results=cls.cluster_statistics(
-                    scheme=scheme,
-                    hostname=hostname,
-                    port=port,
-                    debug=debug
-                ),
-                delay=sample_interval
-            )
-            for element in range(nb_sample)
-        ]
-        return stats
+        for sink in cls._sinks:
+            sink.close()
 
+        sinks = []
+        if graphite:
+            host, separator, port = graphite.partition(':')
+            sinks.append(GraphiteSink(host, int(port or GraphiteSink.DEFAULT_PORT), prefix, max_pending))
+        if influx_url:
+            sinks.append(InfluxSink(influx_url, prefix, max_pending))
+        if prometheus_textfile:
+            sinks.append(PrometheusTextfileSink(prometheus_textfile, prefix, max_pending))
+        cls._sinks = sinks
+        cls._flush_timeout = flush_timeout
+        cls._debug = debug
 
-class ElasticSearchStatsEvalHelpers(object):
+    @classmethod
+    def enabled(
+            cls
+    ):
+        return bool(cls._sinks)
 
     @classmethod
-    def get_nb_indexed_docs(
+    def start_batch(
             cls,
-            stats
+            tags
     ):
-        return stats['indices']['docs']['count']
+        """
+        Start collecting the metrics of the check run of the current thread
+        :param tags: (key, value) pairs of every metric of the run, cluster and check
+        :type tags: tuple
+        """
+        cls._context.tags = tuple(tags)
+        cls._context.batch = [] if cls._sinks else None
+        #the metrics of a run share its timestamp, a node is one Influx line
+        cls._context.timestamp = time.time()
 
     @classmethod
-    def get_cluster_status(
+    def record(
             cls,
-            stats
+            name,
+            value,
+            tags=None,
+            kind='gauge'
     ):
-        return stats['status']
+        """
+        Add a metric to the batch of the current thread, if one is collected
+        :param name: metric name, without prefix
+        :type name: str
+        :param value: numeric value, None when it is not known
+        :param tags: dict of tags of this metric only, the node for instance
+        :type tags: dict
+        :param kind: one of METRIC_KINDS
+        :type kind: str
+        """
+        batch = getattr(cls._context, 'batch', None)
+        #NaN stands for a node missing the metric, as None does
+        if batch is None or value is None or value != value:
+            return
+        batch.append(Metric(
+            name,
+            value,
+            kind,
+            cls._context.tags + tuple(sorted((tags or {}).items())),
+            cls._context.timestamp
+        ))
 
     @classmethod
-    def get_heap_used_percent(
+    def record_nodes(
             cls,
-            stats
+            name,
+            values,
+            kind='gauge'
     ):
-        return stats['nodes'].values()[0]['jvm']['mem']['heap_used_percent']
+        """
+        Add a metric of every node to the batch of the current thread
+        :param values: dict node name -> value
+        :type values: dict
+        """
+        for node, value in values.items():
+            cls.record(name, value, tags={'node': node}, kind=kind)
 
     @classmethod
-    def get_disk_io_op(
-            cls,
-            stats
+    def submit_batch(
+            cls
     ):
-        return stats['nodes'].values()[0]['fs']['total']['disk_io_op']
+        """
+        Queue the batch of the current thread to every sink, never blocks
+        """
+        batch = getattr(cls._context, 'batch', None)
+        cls._context.batch = None
+        if not batch:
+            return
+        for sink in cls._sinks:
+            sink.submit(cls._context.tags, batch)
 
     @classmethod
-    def filter_nb_indexed_docs(
+    def flush(
             cls,
-            stats
+            timeout=None
     ):
-        if not isinstance(stats, collections.Iterable):
-            raise Exception('Provided input is not an Iterable')
+        """
+        Wait for the sinks to write what they were given, short lived
+        processes call it once their result is out
+        Under debug the sink statistics are printed once the sinks are done,
+        before they would not count the run yet.
+        :param timeout: time given to all the sinks in [s], the configured one when None
+        :type timeout: float
+        :return: True when every sink is done
+        """
+        if timeout is None:
+            timeout = cls._flush_timeout
+        end = monotonic() + timeout
+        done = all([sink.flush(end - monotonic()) for sink in cls._sinks])
+        if cls._debug and cls._sinks:
+            print("Metric sink statistics")
+            print("----------------------")
+            pprint(cls.statistics())
+            print("----------------------")
+        return done
 
-        return [
-            cls.get_nb_indexed_docs(element) for element in stats
-        ]
+    @classmethod
+    def statistics(
+            cls
+    ):
+        """
+        Get the batches, writes and dropped metrics of every sink since process start
+        :return: dict sink class name -> dict of counters
+        """
+        return dict(
+            (sink.__class__.__name__, dict(sink.statistics))
+            for sink in cls._sinks
+        )
 
 
 class OutputFormatHelpers(object):
@@ -440,6 +3920,90 @@ class OutputFormatHelpers(object):
             max=max
         )
 
+    @classmethod
+    def phase_perf_data_strings(
+            cls,
+            timings
+    ):
+        """
+        Generate perf data strings of query phase timings
+        :param timings: dict phase -> time in [s], as filled by the stats helpers
+        :type timings: dict
+        :return: list of perf data strings, one per phase
+        """
+        return [
+            cls.perf_data_string(
+                label='phase_{p}'.format(p=phase),
+                value='{t:.4f}'.format(t=duration),
+                warn='',
+                crit='',
+                UOM='s',
+                min=0
+            )
+            for phase, duration in timings.items()
+        ]
+
+    #check states from the best to the worst
+    STATES = ['OK', 'Unknown', 'Warning', 'Critical']
+    EXIT_CODES = {
+        'OK': 0,
+        'Warning': 1,
+        'Critical': 2,
+        'Unknown': 3
+    }
+
+    @classmethod
+    def worst_status(
+            cls,
+            states
+    ):
+        """
+        Get the worst of several check states
+        :param states: iterable of states in ['Critical', 'Warning', 'OK', 'Unknown']
+        :return: worst state, 'Unknown' when states is empty
+        """
+        states = list(states)
+        if not states:
+            return 'Unknown'
+        return max(states, key=cls.STATES.index)
+
+    @classmethod
+    def nodes_summary(
+            cls,
+            values,
+            states,
+            value_template='{v}'
+    ):
+        """
+        Summarize per node states, worst nodes first
+        :param values: dict node name -> measured value
+        :type values: dict
+        :param states: dict node name -> state
+        :type states: dict
+        :param value_template: format of a value, gets it as v
+        :type value_template: str
+        :return: summary string
+        """
+        parts = []
+        for state in reversed(cls.STATES[1:]):
+            nodes = [node for node in values if states[node] == state]
+            if nodes:
+                parts.append('{s}: {n}'.format(
+                    s=state,
+                    n=', '.join(
+                        #NaN stands for a node missing the metric
+                        '{n} ({v})'.format(
+                            n=node,
+                            v=value_template.format(v=values[node]) if values[node] == values[node] else 'no value'
+                        )
+                        for node in nodes
+                    )
+                ))
+
+        if not parts:
+            return 'within the limits on {n} nodes'.format(n=len(values))
+        return 'on {n} nodes, {p}'.format(n=len(values), p=' - '.join(parts))
+
     @classmethod
     def check_output_string(
             cls,
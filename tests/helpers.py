@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2013:
+#     Sébastien Pasche, sebastien.pasche@leshop.ch
+#     Raphael Anthamatten  raphael.anthamatten@leshop.ch
+#
+# Permission is hereby granted, free of charge, to any person obtaining a
+# copy of this software and associated documentation files (the "Software"),
+# to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.
+#
+
+"""
+Shared fixtures of the tests: repository imports, a fake clock and scripted
+stats responses.
+"""
+
+import os
+import sys
+import time
+
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(TESTS_DIR)
+sys.path.insert(0, REPO_DIR)
+sys.path.insert(0, os.path.join(REPO_DIR, 'benchmarks'))
+
+import elasticsearch_checks
+
+
+class FakeClock(object):
+    """
+        Monotonic clock of the lib and time.sleep, moved by hand and by sleeps
+    """
+
+    def __init__(self, start=1000.0):
+        self.now = start
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, duration):
+        self.now += max(duration, 0)
+
+    def install(self, test):
+        """
+        Replace the lib clock and time.sleep until the end of a test
+        :param test: unittest.TestCase
+        """
+        monotonic, sleep = elasticsearch_checks.monotonic, time.sleep
+        elasticsearch_checks.monotonic, time.sleep = self, self.sleep
+
+        def restore():
+            elasticsearch_checks.monotonic, time.sleep = monotonic, sleep
+        test.addCleanup(restore)
+        return self
+
+
+def docs_stats(count):
+    """
+    :return: /_stats/docs response with the primaries filter_path
+    """
+    return {'_all': {'primaries': {'docs': {'count': count}}}}
+
+
+def scripted_docs_statistics(test, clock, counts, latency=0.01):
+    """
+    Make the docs stats queries answer counts one after the other
+    :return: list of the counts served, to tell how many queries were sent
+    """
+    served = []
+    helpers = elasticsearch_checks.ElasticSearchStatsHelpers
+    original = helpers.__dict__['docs_statistics']
+
+    def docs_statistics(cls, **options):
+        clock.sleep(latency)
+        count = counts[len(served)]
+        served.append(count)
+        return docs_stats(count)
+
+    helpers.docs_statistics = classmethod(docs_statistics)
+    test.addCleanup(setattr, helpers, 'docs_statistics', original)
+    return served
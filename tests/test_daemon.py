@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2013:
+#     Sébastien Pasche, sebastien.pasche@leshop.ch
+#     Raphael Anthamatten  raphael.anthamatten@leshop.ch
+#
+# Permission is hereby granted, free of charge, to any person obtaining a
+# copy of this software and associated documentation files (the "Software"),
+# to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.
+#
+
+"""
+Daemon socket and state file confinement.
+"""
+
+import optparse
+import os
+import shutil
+import socket
+import tempfile
+import unittest
+
+import helpers
+
+import check_elasticsearch_daemon
+from check_elasticsearch_daemon import confine_files, prepare_socket, run_check
+
+
+class PrepareSocketTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir)
+        self.path = os.path.join(self.dir, 'daemon.sock')
+
+    def test_previous_socket_removed(self):
+        server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        server.bind(self.path)
+        server.close()
+        prepare_socket(self.path)
+        self.assertFalse(os.path.lexists(self.path))
+
+    def test_other_file_kept(self):
+        with open(self.path, 'w') as f:
+            f.write('precious')
+        self.assertRaises(Exception, prepare_socket, self.path)
+        self.assertTrue(os.path.exists(self.path))
+
+    def test_symlink_kept(self):
+        target = os.path.join(self.dir, 'target')
+        open(target, 'w').close()
+        os.symlink(target, self.path)
+        self.assertRaises(Exception, prepare_socket, self.path)
+        self.assertTrue(os.path.islink(self.path))
+
+    def test_shared_directory_refused(self):
+        os.chmod(self.dir, 0o777)
+        self.assertRaises(Exception, prepare_socket, self.path)
+
+    def test_default_directory_created_private(self):
+        run_dir = os.path.join(self.dir, 'run')
+        path = os.path.join(run_dir, 'check_elasticsearch.sock')
+        default = check_elasticsearch_daemon.DEFAULT_SOCKET
+        check_elasticsearch_daemon.DEFAULT_SOCKET = path
+        self.addCleanup(setattr, check_elasticsearch_daemon, 'DEFAULT_SOCKET', default)
+        prepare_socket(path)
+        self.assertEqual(os.stat(run_dir).st_mode & 0o777, 0o700)
+
+
+class ConfineFilesTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir)
+
+    def test_relative_name_in_state_dir(self):
+        opts = optparse.Values({'state_file': 'docs.state', 'hedge_state_file': None})
+        confine_files(opts, self.dir)
+        self.assertEqual(opts.state_file, os.path.join(os.path.realpath(self.dir), 'docs.state'))
+        self.assertIsNone(opts.hedge_state_file)
+
+    def test_outside_paths_refused(self):
+        for path in ['/etc/passwd', '../docs.state', 'sub/../../docs.state']:
+            opts = optparse.Values({'state_file': None, 'hedge_state_file': path})
+            self.assertRaises(Exception, confine_files, opts, self.dir)
+
+    def test_symlink_out_refused(self):
+        os.symlink('/tmp', os.path.join(self.dir, 'out'))
+        opts = optparse.Values({'state_file': 'out/docs.state'})
+        self.assertRaises(Exception, confine_files, opts, self.dir)
+
+    def test_no_state_dir_refuses_files(self):
+        opts = optparse.Values({'state_file': os.path.join(self.dir, 'docs.state')})
+        self.assertRaises(Exception, confine_files, opts, None)
+
+    def test_check_with_state_file_refused(self):
+        self.assertRaises(Exception, run_check, 'min-docs', ['-H', 'localhost', '--state-file', '/etc/passwd'], self.dir)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,131 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2013:
+#     Sébastien Pasche, sebastien.pasche@leshop.ch
+#     Raphael Anthamatten  raphael.anthamatten@leshop.ch
+#
+# Permission is hereby granted, free of charge, to any person obtaining a
+# copy of this software and associated documentation files (the "Software"),
+# to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.
+#
+
+"""
+Disk io check: counter rates across node restarts and its exits under --debug.
+"""
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+try:
+    from StringIO import StringIO
+except ImportError:
+    from io import StringIO
+
+from helpers import FakeClock
+
+import check_elasticsearch_node_disk_io_op
+from elasticsearch_checks import \
+    ElasticSearchStatsEvalHelpers, ElasticSearchStatsHelpers, SampleTime
+
+
+def node_stats(nodes):
+    """
+    :param nodes: dict node name -> (disk io op counter, jvm uptime in [ms])
+    :return: node stats response with the disk io check filter_path
+    """
+    return {'nodes': dict(
+        ('id-' + name, {
+            'name': name,
+            'fs': {'total': {'disk_io_op': counter}},
+            'jvm': {'uptime_in_millis': uptime},
+        })
+        for name, (counter, uptime) in nodes.items()
+    )}
+
+
+class CounterRatesTest(unittest.TestCase):
+
+    def rates(self, *samples):
+        return ElasticSearchStatsEvalHelpers.nodes_counter_rates(
+            [(SampleTime(10.0 * index, 10.0 * index), node_stats(nodes)) for index, nodes in enumerate(samples)],
+            check_elasticsearch_node_disk_io_op.DISK_IO_OP_PATH,
+            reset_path=check_elasticsearch_node_disk_io_op.RESET_PATH
+        )
+
+    def test_rate_per_node(self):
+        rates = self.rates({'a': (100, 1000), 'b': (0, 1000)}, {'a': (600, 11000), 'b': (50, 11000)})
+        self.assertEqual(list(rates.keys()), ['a', 'b'])
+        self.assertAlmostEqual(rates['a'], 50.0)
+        self.assertAlmostEqual(rates['b'], 5.0)
+
+    def test_restart_never_negative(self):
+        #the node restarted between the samples, its counter started again from zero
+        rates = self.rates({'a': (100000, 900000)}, {'a': (300, 3000)})
+        self.assertTrue(rates['a'] >= 0)
+
+    def test_single_sample_node_has_no_rate(self):
+        rates = self.rates({'a': (100, 1000)}, {'a': (600, 11000), 'b': (50, 11000)})
+        self.assertNotIn('b', rates)
+
+
+class DiskIoCheckTest(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock().install(self)
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.path = os.path.join(directory, 'disk_io.state')
+
+        self.responses = []
+        original = ElasticSearchStatsHelpers.__dict__['node_statistics']
+        ElasticSearchStatsHelpers.node_statistics = classmethod(lambda cls, **options: self.responses.pop(0))
+        self.addCleanup(setattr, ElasticSearchStatsHelpers, 'node_statistics', original)
+
+        self.debug_statistics = []
+        original_debug = ElasticSearchStatsHelpers.__dict__['print_debug_statistics']
+        ElasticSearchStatsHelpers.print_debug_statistics = classmethod(lambda cls: self.debug_statistics.append(1))
+        self.addCleanup(setattr, ElasticSearchStatsHelpers, 'print_debug_statistics', original_debug)
+
+        stdout = sys.stdout
+        sys.stdout = StringIO()
+        self.addCleanup(setattr, sys, 'stdout', stdout)
+
+    def check(self, nodes):
+        self.responses.append(node_stats(nodes))
+        opts = check_elasticsearch_node_disk_io_op.parse_args(
+            ['-H', 'es', '--all-nodes', '--state-file', self.path, '--debug']
+        )
+        return check_elasticsearch_node_disk_io_op.check(opts)
+
+    def test_every_exit_prints_debug_statistics(self):
+        status, output = self.check({'a': (100, 1000)})
+        self.assertEqual(status, 'Unknown')
+        self.assertEqual(len(self.debug_statistics), 1)
+
+        self.clock.sleep(10)
+        status, output = self.check({'a': (15100, 11000)})
+        self.assertEqual(status, 'Warning')
+        self.assertIn("'a_disk_io_op'=1500.0[IOps];1000;2000", output)
+        self.assertEqual(len(self.debug_statistics), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
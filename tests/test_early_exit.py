@@ -0,0 +1,123 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2013:
+#     Sébastien Pasche, sebastien.pasche@leshop.ch
+#     Raphael Anthamatten  raphael.anthamatten@leshop.ch
+#
+# Permission is hereby granted, free of charge, to any person obtaining a
+# copy of this software and associated documentation files (the "Software"),
+# to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.
+#
+
+import unittest
+
+from helpers import FakeClock, docs_stats, scripted_docs_statistics
+
+from elasticsearch_checks import ElasticSearchStatsEvalHelpers, SampleTime
+import check_elasticsearch_http_max_indexed_docs as max_docs
+import check_elasticsearch_http_min_indexed_docs as min_docs
+
+
+#a burst right away, then nothing indexed for the rest of the window
+BURST_THEN_IDLE = [0] + [25000] * 9
+STEADY = [index * 25000 for index in range(10)]
+
+
+class SlopeLowerBoundTest(unittest.TestCase):
+
+    def samples(self, counts, interval=1.0):
+        return [
+            (SampleTime(index * interval, index * interval + 0.01), docs_stats(count))
+            for index, count in enumerate(counts)
+        ]
+
+    def test_never_above_the_whole_window_slope(self):
+        get = ElasticSearchStatsEvalHelpers.get_nb_indexed_docs
+        for counts in (BURST_THEN_IDLE, STEADY, [0, 10, 10, 500, 600, 600, 9000, 9001, 9001, 20000]):
+            samples = self.samples(counts)
+            whole = ElasticSearchStatsEvalHelpers.rate_analytics(samples, get).slope
+            for taken in range(2, len(counts)):
+                bound = ElasticSearchStatsEvalHelpers.slope_lower_bound(samples[:taken], get, len(counts), 1.0)
+                self.assertLessEqual(bound, whole + 1e-6, (counts, taken))
+
+    def test_burst_is_not_extrapolated(self):
+        bound = ElasticSearchStatsEvalHelpers.slope_lower_bound(
+            self.samples(BURST_THEN_IDLE[:2]),
+            ElasticSearchStatsEvalHelpers.get_nb_indexed_docs,
+            10,
+            1.0
+        )
+        self.assertLess(bound * 10, 15000)
+
+    def test_decreasing_counter_has_no_bound(self):
+        self.assertIsNone(ElasticSearchStatsEvalHelpers.slope_lower_bound(
+            self.samples([10, 5]),
+            ElasticSearchStatsEvalHelpers.get_nb_indexed_docs,
+            10,
+            1.0
+        ))
+
+
+class EarlyExitTest(unittest.TestCase):
+    """
+        A check stopped early ends with the status of the whole window
+    """
+
+    def run_check(self, module, counts, argv):
+        clock = FakeClock().install(self)
+        served = scripted_docs_statistics(self, clock, counts)
+        opts = module.parse_args(['-H', '127.0.0.1', '--max-sample', str(len(counts))] + argv)
+        status, output = module.check(opts)
+        return status, output, len(served)
+
+    def assert_same_status(self, module, counts, argv):
+        full_status, full_output, full_samples = self.run_check(module, counts, argv + ['--no-early-exit'])
+        status, output, samples = self.run_check(module, counts, argv)
+        self.assertEqual(full_samples, len(counts))
+        self.assertEqual(status, full_status, (output, full_output))
+        return status, samples
+
+    def test_max_docs_burst_stays_ok(self):
+        status, samples = self.assert_same_status(max_docs, BURST_THEN_IDLE, ['-w', '15000', '-c', '20000'])
+        self.assertEqual(status, 'OK')
+
+    def test_min_docs_burst_stays_warning(self):
+        status, samples = self.assert_same_status(min_docs, BURST_THEN_IDLE, ['-w', '15000', '-c', '10000'])
+        self.assertEqual(status, 'Warning')
+
+    def test_max_docs_steady_settles_critical(self):
+        status, samples = self.assert_same_status(max_docs, STEADY, ['-w', '15000', '-c', '20000'])
+        self.assertEqual(status, 'Critical')
+        self.assertLess(samples, len(STEADY))
+
+    def test_min_docs_steady_settles_ok(self):
+        status, samples = self.assert_same_status(min_docs, STEADY, ['-w', '15000', '-c', '10000'])
+        self.assertEqual(status, 'OK')
+        self.assertLess(samples, len(STEADY))
+
+    def test_reported_rate_is_the_settling_floor(self):
+        for module, argv in [(min_docs, ['-w', '15000', '-c', '10000']), (max_docs, ['-w', '15000', '-c', '20000'])]:
+            status, output, samples = self.run_check(module, STEADY, argv)
+            self.assertLess(samples, len(STEADY))
+            message_rate = output.split(' docs/s fitted')[0].split('(')[-1]
+            perf_data_rate = output.split("'indexing_rate'=")[1].split(';')[0]
+            self.assertEqual(message_rate, perf_data_rate)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2013:
+#     Sébastien Pasche, sebastien.pasche@leshop.ch
+#     Raphael Anthamatten  raphael.anthamatten@leshop.ch
+#
+# Permission is hereby granted, free of charge, to any person obtaining a
+# copy of this software and associated documentation files (the "Software"),
+# to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.
+#
+
+"""
+Exporter page cache and its per scrape counters.
+"""
+
+import optparse
+import unittest
+
+from helpers import FakeClock
+
+import check_elasticsearch_exporter
+from check_elasticsearch_exporter import MetricsPage
+
+
+class MetricsPageTest(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock().install(self)
+        #the exporter imported the lib clock by name
+        monotonic = check_elasticsearch_exporter.monotonic
+        check_elasticsearch_exporter.monotonic = self.clock
+        self.addCleanup(setattr, check_elasticsearch_exporter, 'monotonic', monotonic)
+        self.page = MetricsPage(optparse.Values({
+            'hostname': 'es1,es2',
+            'metrics_cluster': None,
+            'metrics_prefix': 'elasticsearch',
+            'cache_interval': 15,
+        }))
+        self.renders = []
+
+        def render():
+            self.renders.append(self.clock.now)
+            return b'cached\n'
+        self.page.render = render
+
+    def scrapes_total(self, page):
+        for line in page.decode('utf-8').splitlines():
+            if line.startswith('elasticsearch_exporter_scrapes_total{'):
+                return float(line.split()[-1])
+
+    def test_scrapes_counted_on_cached_pages(self):
+        pages = [self.page.get() for i in range(3)]
+        self.assertEqual(len(self.renders), 1)
+        self.assertEqual([self.scrapes_total(page) for page in pages], [1.0, 2.0, 3.0])
+        self.assertTrue(all(page.startswith(b'cached\n') for page in pages))
+
+    def test_rendered_again_after_the_interval(self):
+        self.page.get()
+        self.clock.sleep(15)
+        page = self.page.get()
+        self.assertEqual(len(self.renders), 2)
+        self.assertIn(b'elasticsearch_exporter_renders_total{cluster="es1"} 2.0', page)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2013:
+#     Sébastien Pasche, sebastien.pasche@leshop.ch
+#     Raphael Anthamatten  raphael.anthamatten@leshop.ch
+#
+# Permission is hereby granted, free of charge, to any person obtaining a
+# copy of this software and associated documentation files (the "Software"),
+# to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.
+#
+
+"""
+Heap check: every node path reads the node stats table.
+"""
+
+import unittest
+
+from helpers import FakeClock
+
+import check_elasticsearch_node_percentage_heap_used as heap
+from elasticsearch_checks import ElasticSearchStatsEvalHelpers, ElasticSearchStatsHelpers
+
+
+def node_stats(nodes):
+    """
+    :param nodes: dict node name -> heap used percent, None when the node does not report it
+    """
+    return {'nodes': dict(
+        ('id-' + name, {'name': name, 'jvm': {'mem': {'heap_used_percent': value}} if value is not None else {}})
+        for name, value in nodes.items()
+    )}
+
+
+class HeapCheckTest(unittest.TestCase):
+
+    def setUp(self):
+        FakeClock().install(self)
+        self.response = None
+        original = ElasticSearchStatsHelpers.__dict__['node_statistics']
+        ElasticSearchStatsHelpers.node_statistics = classmethod(lambda cls, **options: self.response)
+        self.addCleanup(setattr, ElasticSearchStatsHelpers, 'node_statistics', original)
+
+    def check(self, nodes, argv):
+        self.response = node_stats(nodes)
+        return heap.check(heap.parse_args(['-H', 'es', '-w', '80', '-c', '90'] + argv))
+
+    def test_single_node(self):
+        status, output = self.check({'node0': 85}, ['--node-id', 'node0'])
+        self.assertEqual(status, 'Warning')
+        self.assertIn('Heap usage is too high 85%', output)
+        self.assertIn("'heap_used'=85[%];80;90;0;100;", output)
+
+    def test_single_node_without_the_metric(self):
+        status, output = self.check({'node0': None}, ['--node-id', 'node0'])
+        self.assertEqual(status, 'Unknown')
+        self.assertNotIn('nan', output)
+
+    def test_single_node_not_found(self):
+        status, output = self.check({}, ['--node-id', 'node0'])
+        self.assertEqual(status, 'Unknown')
+        self.assertIn('no node matches node0', output)
+
+    def test_node_without_the_metric_has_no_perf_data(self):
+        status, output = self.check({'node0': 20, 'node1': None}, ['--all-nodes'])
+        self.assertEqual(status, 'Unknown')
+        self.assertIn('node1 (no value)', output)
+        self.assertNotIn('nan', output)
+        self.assertNotIn('node1_heap_used', output)
+        self.assertIn("'node0_heap_used'=20[%]", output)
+
+    def test_first_node_value(self):
+        stats = node_stats({'node1': 30, 'node0': 20})
+        self.assertEqual(ElasticSearchStatsEvalHelpers.get_heap_used_percent(stats), 20)
+        self.assertIsNone(ElasticSearchStatsEvalHelpers.get_heap_used_percent({'nodes': {}}))
+
+
+if __name__ == '__main__':
+    unittest.main()
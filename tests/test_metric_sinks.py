@@ -0,0 +1,184 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2013:
+#     Sébastien Pasche, sebastien.pasche@leshop.ch
+#     Raphael Anthamatten  raphael.anthamatten@leshop.ch
+#
+# Permission is hereby granted, free of charge, to any person obtaining a
+# copy of this software and associated documentation files (the "Software"),
+# to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.
+#
+
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import unittest
+
+try:
+    from StringIO import StringIO
+except ImportError:
+    from io import StringIO
+
+import helpers
+
+from elasticsearch_checks import \
+    Metric, MetricSink, MetricSinkHelpers, GraphiteSink, InfluxSink, PrometheusTextfileSink
+
+
+def metric(name, value, check='heap', node=None, timestamp=None):
+    tags = (('cluster', 'es-a'), ('check', check))
+    if node is not None:
+        tags += (('node', node),)
+    return Metric(name, value, 'gauge', tags, timestamp or helpers.time.time())
+
+
+def source(check):
+    return (('cluster', 'es-a'), ('check', check))
+
+
+class BlockedSink(MetricSink):
+    """
+        Sink whose writes wait for the test to release them
+    """
+
+    def __init__(self, max_pending):
+        self.release = threading.Event()
+        self.written = []
+        super(BlockedSink, self).__init__('elasticsearch', max_pending)
+
+    def format(self, batches):
+        return batches
+
+    def write(self, payload):
+        self.release.wait(5)
+        self.written.append(payload)
+
+
+class MetricSinkTest(unittest.TestCase):
+
+    def test_queued_batches_are_written_together_and_oldest_dropped(self):
+        sink = BlockedSink(max_pending=2)
+        self.addCleanup(sink.close)
+        sink.submit(source('heap'), [metric('a', 1)])
+        #the first write holds the writer, the next batches queue up
+        while not sink._writing:
+            helpers.time.sleep(0.001)
+        for index in range(4):
+            sink.submit(source('heap'), [metric('b', index)])
+        sink.release.set()
+        self.assertTrue(sink.flush(5))
+        self.assertEqual(sink.statistics['dropped'], 2)
+        self.assertEqual([len(batches) for batches in sink.written][-1], 2)
+
+    def test_flush_gives_up_on_a_slow_sink(self):
+        sink = BlockedSink(max_pending=10)
+        self.addCleanup(sink.release.set)
+        sink.submit(source('heap'), [metric('a', 1)])
+        self.assertFalse(sink.flush(0.05))
+
+
+class FormatTest(unittest.TestCase):
+
+    def test_graphite_path(self):
+        sink = GraphiteSink('127.0.0.1', prefix='es')
+        self.addCleanup(sink.close)
+        payload = sink.format([(source('heap'), [metric('heap_used_percent', 20, node='node.0', timestamp=10)])])
+        self.assertEqual(payload, b'es.es-a.heap.node_0.heap_used_percent 20.0 10\n')
+
+    def test_influx_fields_of_a_node_share_a_line(self):
+        sink = InfluxSink('http://127.0.0.1:8086/write', prefix='es')
+        self.addCleanup(sink.close)
+        payload = sink.format([(source('docs'), [
+            metric('docs_count', 10, check='docs', timestamp=10),
+            metric('indexing_rate', 2.5, check='docs', timestamp=10),
+        ])])
+        self.assertEqual(payload, b'es,cluster=es-a,check=docs docs_count=10.0,indexing_rate=2.5 10000000000\n')
+
+
+class PrometheusTextfileSinkTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.path = os.path.join(self.directory, 'elasticsearch.prom')
+
+    def write(self, batch_source, metrics):
+        #a new sink each time, as every check process has its own
+        sink = PrometheusTextfileSink(self.path)
+        self.addCleanup(sink.close)
+        sink.submit(batch_source, metrics)
+        self.assertTrue(sink.flush(5))
+        self.assertEqual(sink.statistics['errors'], 0)
+        with open(self.path) as textfile:
+            return textfile.read()
+
+    def test_processes_share_the_file(self):
+        self.write(source('heap'), [metric('heap_used_percent', 20, node='node0')])
+        content = self.write(source('cluster-status'), [metric('check_state', 0, check='cluster-status')])
+        self.assertIn('elasticsearch_heap_used_percent{cluster="es-a",check="heap",node="node0"} 20.0', content)
+        self.assertIn('elasticsearch_check_state{cluster="es-a",check="cluster-status"} 0.0', content)
+        self.assertEqual([name for name in os.listdir(self.directory) if name.endswith('.prom')], ['elasticsearch.prom'])
+
+    def test_a_run_replaces_the_series_of_its_check(self):
+        self.write(source('heap'), [
+            metric('heap_used_percent', 20, node='node0'),
+            metric('heap_used_percent', 30, node='node1'),
+        ])
+        content = self.write(source('heap'), [metric('heap_used_percent', 25, node='node0')])
+        self.assertIn('node="node0"} 25.0', content)
+        self.assertNotIn('node1', content)
+        self.assertEqual(content.count('# TYPE elasticsearch_heap_used_percent gauge'), 1)
+
+    def test_old_sources_are_dropped(self):
+        self.write(source('heap'), [metric('heap_used_percent', 20, node='node0', timestamp=1)])
+        content = self.write(source('disk-io'), [metric('disk_io_op_rate', 5, check='disk-io', node='node0')])
+        self.assertNotIn('heap_used_percent', content)
+
+
+class MetricSinkHelpersTest(unittest.TestCase):
+
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.path = os.path.join(directory, 'elasticsearch.prom')
+        self.addCleanup(MetricSinkHelpers.configure)
+
+        stdout = sys.stdout
+        sys.stdout = self.output = StringIO()
+        self.addCleanup(setattr, sys, 'stdout', stdout)
+
+    def test_debug_statistics_count_the_flushed_run(self):
+        MetricSinkHelpers.configure(prometheus_textfile=self.path, debug=True)
+        MetricSinkHelpers.start_batch(source('heap'))
+        MetricSinkHelpers.record('heap_used_percent', 20, {'node': 'node0'})
+        MetricSinkHelpers.submit_batch()
+        self.assertTrue(MetricSinkHelpers.flush(5))
+        self.assertIn('Metric sink statistics', self.output.getvalue())
+        self.assertIn("'batches': 1", self.output.getvalue())
+        self.assertIn("'writes': 1", self.output.getvalue())
+
+    def test_no_statistics_without_debug(self):
+        MetricSinkHelpers.configure(prometheus_textfile=self.path)
+        MetricSinkHelpers.flush(5)
+        self.assertEqual(self.output.getvalue(), '')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2013:
+#     Sébastien Pasche, sebastien.pasche@leshop.ch
+#     Raphael Anthamatten  raphael.anthamatten@leshop.ch
+#
+# Permission is hereby granted, free of charge, to any person obtaining a
+# copy of this software and associated documentation files (the "Software"),
+# to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.
+#
+
+"""
+Rate analytics of a sampled counter, with and without numpy.
+"""
+
+import unittest
+
+from helpers import docs_stats
+
+from elasticsearch_checks import ElasticSearchStatsEvalHelpers, SampleTime
+
+
+def samples(points):
+    """
+    :param points: list of (time in [s], docs count)
+    """
+    return [(SampleTime(t, t), docs_stats(count)) for t, count in points]
+
+
+class RateAnalyticsTest(unittest.TestCase):
+
+    def analytics(self, points, stall_rate=0):
+        return ElasticSearchStatsEvalHelpers.rate_analytics(
+            samples(points),
+            ElasticSearchStatsEvalHelpers.get_nb_indexed_docs,
+            stall_rate=stall_rate
+        )
+
+    def test_steady_rate(self):
+        rates = self.analytics([(0, 0), (1, 100), (2, 200), (3, 300)])
+        self.assertAlmostEqual(rates.slope, 100.0)
+        self.assertAlmostEqual(rates.mean, 100.0)
+        self.assertAlmostEqual(rates.p50, 100.0)
+        self.assertEqual(rates.stalled, 0.0)
+
+    def test_late_sample_weighs_little(self):
+        #the last sample came late, the rate between samples did not change
+        rates = self.analytics([(0, 0), (1, 100), (2, 200), (3.5, 350)])
+        self.assertAlmostEqual(rates.slope, 100.0)
+        self.assertAlmostEqual(rates.min, 100.0)
+        self.assertAlmostEqual(rates.max, 100.0)
+
+    def test_longest_stall(self):
+        rates = self.analytics([(0, 0), (1, 100), (2, 100), (3, 100), (4, 200), (5, 200)])
+        self.assertAlmostEqual(rates.stalled, 2.0)
+        self.assertAlmostEqual(rates.min, 0.0)
+
+    def test_needs_two_ordered_samples(self):
+        self.assertRaises(Exception, self.analytics, [(0, 0)])
+        self.assertRaises(Exception, self.analytics, [(1, 0), (1, 10)])
+
+    def test_numpy_and_python_agree(self):
+        numpy = ElasticSearchStatsEvalHelpers._numpy()
+        if numpy is None:
+            self.skipTest('numpy is not installed')
+        points = [(t * 1.1, (t * t * 7) % 50 + t * 90) for t in range(40)]
+        times = [t for t, count in points]
+        values = [float(count) for t, count in points]
+        expected = ElasticSearchStatsEvalHelpers._python_rate_analytics(times, values, 60)
+        measured = ElasticSearchStatsEvalHelpers._numpy_rate_analytics(numpy, times, values, 60)
+        for field in expected._fields:
+            self.assertAlmostEqual(getattr(expected, field), getattr(measured, field), places=6)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,140 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2013:
+#     Sébastien Pasche, sebastien.pasche@leshop.ch
+#     Raphael Anthamatten  raphael.anthamatten@leshop.ch
+#
+# Permission is hereby granted, free of charge, to any person obtaining a
+# copy of this software and associated documentation files (the "Software"),
+# to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.
+#
+
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+import unittest
+
+from helpers import FakeClock, docs_stats
+
+import elasticsearch_checks
+from elasticsearch_checks import ElasticSearchStateHelpers, ElasticSearchStatsEvalHelpers
+import check_elasticsearch_http_max_indexed_docs as max_docs
+import check_elasticsearch_http_min_indexed_docs as min_docs
+
+try:
+    from StringIO import StringIO
+except ImportError:
+    from io import StringIO
+
+
+class MonotonicClockTest(unittest.TestCase):
+
+    @unittest.skipUnless(sys.platform.startswith('linux'), 'clock_gettime is read on Linux')
+    def test_not_the_wall_clock(self):
+        #time since boot, far from the epoch based wall clock
+        self.assertGreater(abs(time.time() - elasticsearch_checks.monotonic()), 86400)
+
+    def test_never_goes_back(self):
+        times = [elasticsearch_checks.monotonic() for index in range(1000)]
+        self.assertEqual(times, sorted(times))
+
+    def test_same_boot_entries_ignore_wall_clock_steps(self):
+        previous = {'monotonic': 100.0, 'wall': 5000.0, 'boot_id': 'a'}
+        #the wall clock was stepped back an hour in between
+        current = {'monotonic': 160.0, 'wall': 5060.0 - 3600, 'boot_id': 'a'}
+        self.assertEqual(ElasticSearchStateHelpers._elapsed(previous, current), 60.0)
+        current['boot_id'] = 'b'
+        self.assertEqual(ElasticSearchStateHelpers._elapsed(previous, current), -3540.0)
+
+
+class RecordSampleTest(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock().install(self)
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.path = os.path.join(directory, 'docs.state')
+
+    def record(self, count, age=0, **options):
+        return ElasticSearchStateHelpers.record_sample(self.path, docs_stats(count), age=age, **options)
+
+    def stored_counts(self):
+        with open(self.path) as state_file:
+            return [
+                ElasticSearchStatsEvalHelpers.get_nb_indexed_docs(entry['payload'])
+                for entry in json.load(state_file)['entries']
+            ]
+
+    def test_first_run_has_no_rate(self):
+        self.assertEqual(len(self.record(10)), 1)
+
+    def test_rate_against_previous_run(self):
+        self.record(100)
+        self.clock.sleep(10)
+        stats = self.record(600)
+        self.assertEqual(len(stats), 2)
+        rate = ElasticSearchStatsEvalHelpers.rate_analytics(stats, ElasticSearchStatsEvalHelpers.get_nb_indexed_docs)
+        self.assertAlmostEqual(rate.slope, 50.0)
+
+    def test_stale_and_young_entries(self):
+        self.record(100)
+        self.clock.sleep(0.5)
+        #too young to give a rate, kept for the next run
+        self.assertEqual(len(self.record(110, min_interval=1)), 1)
+        self.clock.sleep(1)
+        self.assertEqual(len(self.record(120, min_interval=1, history=3)), 3)
+        self.clock.sleep(100)
+        self.assertEqual(len(self.record(130, max_age=50)), 1)
+
+    def test_concurrent_runs_keep_each_other_samples(self):
+        #runs get the lock in the reverse order of their responses
+        for index in range(8):
+            stats = self.record(index, age=0.1 * index, history=10, min_interval=0)
+            self.assertEqual(ElasticSearchStatsEvalHelpers.get_nb_indexed_docs(stats[-1][1]), index)
+            self.assertEqual(len(stats), 1)
+        self.assertEqual(self.stored_counts(), list(reversed(range(8))))
+
+        self.clock.sleep(1)
+        stats = self.record(100, history=10, min_interval=0)
+        self.assertEqual(len(stats), 9)
+        times = [sample_time.timestamp for sample_time, payload in stats]
+        self.assertEqual(times, sorted(times))
+
+
+class DocsOptionsTest(unittest.TestCase):
+
+    def setUp(self):
+        stderr = sys.stderr
+        sys.stderr = StringIO()
+        self.addCleanup(setattr, sys, 'stderr', stderr)
+
+    def test_sampling_needs_two_samples(self):
+        for module in [min_docs, max_docs]:
+            for argv in [['--max-sample', '1'], ['--max-sample', '0'], ['--sample-interval', '0']]:
+                self.assertRaises(SystemExit, module.parse_args, ['-H', 'es'] + argv)
+
+    def test_state_file_takes_a_single_sample(self):
+        opts = min_docs.parse_args(['-H', 'es', '--max-sample', '1', '--state-file', 'docs.state'])
+        self.assertEqual(opts.max_sample, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,234 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2013:
+#     Sébastien Pasche, sebastien.pasche@leshop.ch
+#     Raphael Anthamatten  raphael.anthamatten@leshop.ch
+#
+# Permission is hereby granted, free of charge, to any person obtaining a
+# copy of this software and associated documentation files (the "Software"),
+# to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.
+#
+
+"""
+Stats helpers queries: seed hosts, hedging, node stats shared by the checks
+of a cluster and statistics counted from many threads.
+"""
+
+import threading
+import unittest
+
+import helpers
+
+from elasticsearch_checks import ElasticSearchStatsHelpers, ElasticSearchResponseCache
+from fake_elasticsearch import FakeCluster, FakeElasticSearchServer
+
+
+HEAP_METRICS = ['jvm']
+HEAP_FILTER_PATH = ['nodes.*.name', 'nodes.*.jvm.mem.heap_used_percent']
+DISK_IO_METRICS = ['fs', 'jvm']
+DISK_IO_FILTER_PATH = ['nodes.*.name', 'nodes.*.fs.total.disk_io_op', 'nodes.*.jvm.uptime_in_millis']
+NODE_STATS = {'nodes': {'n0': {
+    'name': 'node0',
+    'jvm': {'mem': {'heap_used_percent': 42}, 'uptime_in_millis': 1000},
+    'fs': {'total': {'disk_io_op': 12345}},
+}}}
+
+
+class SharedNodeStatisticsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.uris = []
+        original = ElasticSearchStatsHelpers.__dict__['_http_query']
+
+        def http_query(cls, uri, **options):
+            self.uris.append(uri)
+            return NODE_STATS
+        ElasticSearchStatsHelpers._http_query = classmethod(http_query)
+        self.addCleanup(setattr, ElasticSearchStatsHelpers, '_http_query', original)
+
+        shares = ElasticSearchStatsHelpers._node_statistics_shares
+        ElasticSearchStatsHelpers._node_statistics_shares = {}
+        self.addCleanup(setattr, ElasticSearchStatsHelpers, '_node_statistics_shares', shares)
+
+    def query(self, metrics, filter_path, cache=True):
+        return ElasticSearchStatsHelpers.node_statistics(
+            hostname='es', port=9200, node_id='_all',
+            metrics=metrics, filter_path=filter_path, cache=cache
+        )
+
+    def share(self):
+        for metrics, filter_path in [(HEAP_METRICS, HEAP_FILTER_PATH), (DISK_IO_METRICS, DISK_IO_FILTER_PATH)]:
+            ElasticSearchStatsHelpers.share_node_statistics(
+                hostname='es', port=9200, node_id='_all', metrics=metrics, filter_path=filter_path
+            )
+
+    def test_checks_send_the_same_request(self):
+        self.share()
+        heap = self.query(HEAP_METRICS, HEAP_FILTER_PATH)
+        disk_io = self.query(DISK_IO_METRICS, DISK_IO_FILTER_PATH)
+        self.assertEqual(len(set(self.uris)), 1)
+        self.assertEqual(heap, {'nodes': {'n0': {'name': 'node0', 'jvm': {'mem': {'heap_used_percent': 42}}}}})
+        self.assertEqual(disk_io['nodes']['n0']['fs'], {'total': {'disk_io_op': 12345}})
+        self.assertNotIn('mem', disk_io['nodes']['n0']['jvm'])
+
+    def test_unshared_requests_unchanged(self):
+        self.query(HEAP_METRICS, HEAP_FILTER_PATH)
+        self.query(DISK_IO_METRICS, DISK_IO_FILTER_PATH)
+        self.assertEqual(len(set(self.uris)), 2)
+
+    def test_uncached_queries_not_shared(self):
+        self.share()
+        self.query(HEAP_METRICS, HEAP_FILTER_PATH)
+        self.query(DISK_IO_METRICS, DISK_IO_FILTER_PATH, cache=False)
+        self.assertEqual(len(set(self.uris)), 2)
+        self.assertIn('filter_path=nodes.*.name,nodes.*.fs.total.disk_io_op,nodes.*.jvm.uptime_in_millis', self.uris[1])
+
+
+class SeedHostsTest(unittest.TestCase):
+
+    def test_port_per_seed(self):
+        self.assertEqual(
+            ElasticSearchStatsHelpers._seed_hosts('127.0.0.1:29200, es2,es3:9201', 9200),
+            [('127.0.0.1', 29200), ('es2', 9200), ('es3', 9201)]
+        )
+
+    def test_ipv6_addresses(self):
+        self.assertEqual(ElasticSearchStatsHelpers._seed_hosts('::1', 9200), [('::1', 9200)])
+        self.assertEqual(ElasticSearchStatsHelpers._seed_hosts('[::1]:9201', 9200), [('[::1]', 9201)])
+
+    def test_seed_uris(self):
+        uris = []
+        original = ElasticSearchStatsHelpers.__dict__['_http_query']
+
+        def http_query(cls, uri, hedge_uris=(), **options):
+            uris.extend([uri] + list(hedge_uris))
+            return {}
+        ElasticSearchStatsHelpers._http_query = classmethod(http_query)
+        self.addCleanup(setattr, ElasticSearchStatsHelpers, '_http_query', original)
+
+        ElasticSearchStatsHelpers.cluster_health(hostname='127.0.0.1:29200,es2', port=9200)
+        self.assertEqual(uris, ['http://127.0.0.1:29200/_cluster/health', 'http://es2:9200/_cluster/health'])
+
+
+class HedgedQueryTest(unittest.TestCase):
+
+    def setUp(self):
+        original = ElasticSearchStatsHelpers.__dict__['_send_query']
+        self.release = release = threading.Event()
+        self.threads = set(threading.enumerate())
+
+        def send_query(cls, uri, **options):
+            if '//slow' in uri:
+                release.wait(5)
+                cls.add_phase_time('wait', 5)
+            else:
+                cls.add_phase_time('wait', 0.01)
+            return {'uri': uri}
+        ElasticSearchStatsHelpers._send_query = classmethod(send_query)
+        self.addCleanup(setattr, ElasticSearchStatsHelpers, '_send_query', original)
+        self.addCleanup(self.join_hedges)
+        self.addCleanup(release.set)
+
+        delay = ElasticSearchStatsHelpers.DEFAULT_HEDGE_DELAY
+        ElasticSearchStatsHelpers.DEFAULT_HEDGE_DELAY = 0.01
+        self.addCleanup(setattr, ElasticSearchStatsHelpers, 'DEFAULT_HEDGE_DELAY', delay)
+
+    def join_hedges(self):
+        #the slow queries left behind finish before the interpreter exits
+        for thread in set(threading.enumerate()) - self.threads:
+            thread.join(5)
+
+    def test_hedge_answers_first(self):
+        stats = ElasticSearchStatsHelpers._hedged_query(['http://slow:9200/', 'http://fast:9200/'])
+        self.assertEqual(stats, {'uri': 'http://fast:9200/'})
+
+    def test_phases_of_the_winner_only(self):
+        timings = ElasticSearchStatsHelpers.start_phase_timings()
+        self.addCleanup(setattr, ElasticSearchStatsHelpers._context, 'timings', None)
+        ElasticSearchStatsHelpers._hedged_query(['http://slow:9200/', 'http://fast:9200/'])
+        #the slow query finishing late does not count either
+        self.release.set()
+        self.join_hedges()
+        self.assertAlmostEqual(timings['wait'], 0.01)
+
+    def test_statistics_of_concurrent_queries(self):
+        before = ElasticSearchStatsHelpers.hedge_statistics()
+
+        def queries():
+            for index in range(20):
+                ElasticSearchStatsHelpers._hedged_query(['http://slow:9200/', 'http://fast:9200/'])
+        threads = [threading.Thread(target=queries) for index in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        after = ElasticSearchStatsHelpers.hedge_statistics()
+        self.assertEqual(after['hedged'] - before['hedged'], 160)
+        self.assertEqual(after['won'] - before['won'], 160)
+
+
+def in_threads(run, nb_threads=8):
+    threads = [threading.Thread(target=run) for index in range(nb_threads)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+
+class ConcurrentStatisticsTest(unittest.TestCase):
+
+    def test_connections_counted_once_per_query(self):
+        server = FakeElasticSearchServer(('127.0.0.1', 0), FakeCluster(1))
+        thread = threading.Thread(target=server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+
+        before = ElasticSearchStatsHelpers.connection_statistics()
+
+        def queries():
+            for index in range(10):
+                ElasticSearchStatsHelpers.cluster_health(
+                    hostname='127.0.0.1', port=server.server_address[1], cache=False
+                )
+        in_threads(queries)
+
+        after = ElasticSearchStatsHelpers.connection_statistics()
+        self.assertEqual(sum(after.values()) - sum(before.values()), 80)
+
+    def test_cache_lookups_counted(self):
+        ElasticSearchResponseCache.configure(memory=True, ttl=60)
+        self.addCleanup(ElasticSearchResponseCache.configure)
+        ElasticSearchResponseCache.put('http://es:9200/_cluster/health', {'status': 'green'})
+        before = ElasticSearchResponseCache.statistics()
+
+        def lookups():
+            for index in range(1000):
+                ElasticSearchResponseCache.get('http://es:9200/_cluster/health')
+                ElasticSearchResponseCache.get('http://es:9200/_stats/docs')
+        in_threads(lookups)
+
+        after = ElasticSearchResponseCache.statistics()
+        self.assertEqual(after['hits'] - before['hits'], 8000)
+        self.assertEqual(after['misses'] - before['misses'], 8000)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,108 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2013:
+#     Sébastien Pasche, sebastien.pasche@leshop.ch
+#     Raphael Anthamatten  raphael.anthamatten@leshop.ch
+#
+# Permission is hereby granted, free of charge, to any person obtaining a
+# copy of this software and associated documentation files (the "Software"),
+# to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.
+#
+
+"""
+Cluster status watch: transitions seen from scripted health long-polls.
+"""
+
+import sys
+import unittest
+
+try:
+    from StringIO import StringIO
+except ImportError:
+    from io import StringIO
+
+from helpers import FakeClock
+
+import check_elasticsearch_http_cluster_status
+from check_elasticsearch_http_cluster_status import parse_args, watch
+from elasticsearch_checks import ElasticSearchStatsHelpers
+
+HEALTH_STATUSES = ElasticSearchStatsHelpers.HEALTH_STATUSES
+
+
+class WatchTest(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock(start=0.0).install(self)
+        monotonic = check_elasticsearch_http_cluster_status.monotonic
+        check_elasticsearch_http_cluster_status.monotonic = self.clock
+        self.addCleanup(setattr, check_elasticsearch_http_cluster_status, 'monotonic', monotonic)
+
+        stdout = sys.stdout
+        sys.stdout = self.output = StringIO()
+        self.addCleanup(setattr, sys, 'stdout', stdout)
+
+    def script(self, timeline, end):
+        """
+        Answer the long-polls as elasticsearch does, from a timeline of
+        (start time, colour), until the end time
+        """
+        self.timeouts = []
+        original = ElasticSearchStatsHelpers.__dict__['wait_for_health']
+
+        def colour():
+            return [c for t, c in timeline if t <= self.clock.now][-1]
+
+        def wait_for_health(cls, status, nb_nodes=None, timeout=30, **options):
+            self.timeouts.append(timeout)
+            if status in HEALTH_STATUSES[:-1]:
+                deadline = self.clock.now + timeout
+                wanted = HEALTH_STATUSES.index(status) + 1
+                while HEALTH_STATUSES.index(colour()) < wanted and self.clock.now < deadline:
+                    self.clock.sleep(0.25)
+                if self.clock.now >= end:
+                    raise KeyboardInterrupt()
+                return {'status': colour(), 'number_of_nodes': 3, 'timed_out': self.clock.now >= deadline}
+            if self.clock.now >= end:
+                raise KeyboardInterrupt()
+            self.clock.sleep(0.25)
+            return {'status': colour(), 'number_of_nodes': 3, 'timed_out': False}
+
+        ElasticSearchStatsHelpers.wait_for_health = classmethod(wait_for_health)
+        self.addCleanup(setattr, ElasticSearchStatsHelpers, 'wait_for_health', original)
+
+    def transitions(self, argv=()):
+        self.assertRaises(KeyboardInterrupt, watch, parse_args(['-H', 'es', '--watch'] + list(argv)))
+        return [line.split(': ')[1].split(',')[0] for line in self.output.getvalue().splitlines()]
+
+    def test_yellow_turning_red_seen(self):
+        self.script([(0, 'yellow'), (10, 'red'), (11, 'yellow')], end=40)
+        self.assertEqual(self.transitions(), [
+            'cluster status is yellow', 'cluster status is red', 'cluster status is yellow'
+        ])
+        self.assertTrue(max(self.timeouts[1:]) <= 2)
+
+    def test_improvement_still_awaited(self):
+        self.script([(0, 'red'), (5, 'yellow'), (7, 'green')], end=20)
+        self.assertEqual(self.transitions(['--watch-degraded-timeout', '30']), [
+            'cluster status is red', 'cluster status is yellow', 'cluster status is green'
+        ])
+
+
+if __name__ == '__main__':
+    unittest.main()